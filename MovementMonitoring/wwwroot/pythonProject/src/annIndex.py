@@ -0,0 +1,123 @@
+import math
+
+import numpy
+
+
+class IVFIndex:
+    def __init__(self, nprobe: int = 0, nlist: int = 0, probe_fraction: float = 0.4, iterations: int = 10,
+                 seed: int = 0):
+        """
+        Inverted file index over the rows of the gallery matrix. Rows are split into nlist clusters by k-means,
+        a query visits only the nprobe closest clusters and returns their rows as a shortlist. The index keeps
+        only row ids, the shortlist is re-ranked exactly against the gallery matrix by the caller.
+
+        :param nprobe: number of clusters visited by every query. Higher values give better recall. 0 visits
+        probe_fraction of the clusters, so the recall does not drop when nlist grows with the gallery
+        :param nlist: number of clusters. 0 chooses 4 * sqrt(rows) on every training
+        :param probe_fraction: fraction of the clusters visited by every query if nprobe is 0
+        :param iterations: number of k-means iterations
+        :param seed: seed of the random generator used for training
+        """
+
+        self.nprobe = nprobe
+        self.probe_fraction = probe_fraction
+        self.__nlist = nlist
+        self.__iterations = iterations
+        self.__random = numpy.random.default_rng(seed)
+        self.__centroids = None
+        self.__lists: list[numpy.ndarray] = []
+        self.__sizes = numpy.zeros(0, dtype=numpy.int64)
+        self.__count = 0
+        self.__trained_count = 0
+
+    @property
+    def is_trained(self):
+        return self.__centroids is not None
+
+    @property
+    def trained_count(self):
+        """Number of rows the current centroids were trained on."""
+
+        return self.__trained_count
+
+    @property
+    def count(self):
+        return self.__count
+
+    def train(self, matrix: numpy.ndarray):
+        """
+        Trains centroids on a sample of the matrix and rebuilds the inverted lists for all of its rows.
+
+        :param matrix: (N, D) matrix of normalized embeddings
+        """
+
+        count = matrix.shape[0]
+        nlist = self.__nlist if self.__nlist > 0 else int(4 * numpy.sqrt(count))
+        nlist = max(1, min(nlist, count))
+        sample = matrix[numpy.sort(self.__random.choice(count, min(count, 256 * nlist), replace=False))]
+        centroids = sample[self.__random.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.__iterations):
+            assignment = self.__assign(sample, centroids)
+            order = numpy.argsort(assignment, kind='stable')
+            clusters, starts = numpy.unique(assignment[order], return_index=True)
+            sums = numpy.add.reduceat(sample[order], starts, axis=0)
+            empty = numpy.setdiff1d(numpy.arange(nlist), clusters)
+            centroids[clusters] = sums
+            centroids[empty] = sample[self.__random.choice(sample.shape[0], len(empty), replace=False)]
+            centroids /= numpy.maximum(numpy.linalg.norm(centroids, axis=1, keepdims=True), 1e-6)
+        self.__centroids = numpy.ascontiguousarray(centroids, dtype=numpy.float32)
+        self.__lists = [numpy.empty(16, dtype=numpy.int64) for _ in range(nlist)]
+        self.__sizes = numpy.zeros(nlist, dtype=numpy.int64)
+        self.__count = 0
+        self.add(matrix, 0)
+        self.__trained_count = count
+        print(f'Info> IVF index trained with {nlist} lists on {count} rows.')
+
+    def add(self, rows: numpy.ndarray, first_row: int):
+        """
+        Adds rows to the inverted lists of their closest centroids.
+
+        :param rows: (N, D) matrix of normalized embeddings
+        :param first_row: gallery row id of the first added row
+        """
+
+        assignment = self.__assign(rows, self.__centroids)
+        order = numpy.argsort(assignment, kind='stable')
+        clusters, starts = numpy.unique(assignment[order], return_index=True)
+        ends = numpy.append(starts[1:], order.shape[0])
+        for cluster, start, end in zip(clusters, starts, ends):
+            self.__append(cluster, order[start:end] + first_row)
+        self.__count = first_row + rows.shape[0]
+
+    def search(self, queries: numpy.ndarray):
+        """
+        Returns shortlist of candidate row ids for every query.
+
+        :param queries: (Q, D) matrix of normalized query embeddings
+        :return: list of row id arrays
+        """
+
+        nlist = self.__centroids.shape[0]
+        nprobe = self.nprobe if self.nprobe > 0 else math.ceil(self.probe_fraction * nlist)
+        nprobe = max(1, min(nprobe, nlist))
+        scores = queries @ self.__centroids.T
+        probes = numpy.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+        return [numpy.concatenate([self.__lists[cluster][:self.__sizes[cluster]] for cluster in probe])
+                for probe in probes]
+
+    def __append(self, cluster: int, ids: numpy.ndarray):
+        size = self.__sizes[cluster]
+        required = size + ids.shape[0]
+        if required > self.__lists[cluster].shape[0]:
+            ids_list = numpy.empty(max(required, 2 * self.__lists[cluster].shape[0]), dtype=numpy.int64)
+            ids_list[:size] = self.__lists[cluster][:size]
+            self.__lists[cluster] = ids_list
+        self.__lists[cluster][size:required] = ids
+        self.__sizes[cluster] = required
+
+    @staticmethod
+    def __assign(rows: numpy.ndarray, centroids: numpy.ndarray, chunk: int = 65536):
+        assignment = numpy.empty(rows.shape[0], dtype=numpy.int64)
+        for start in range(0, rows.shape[0], chunk):
+            assignment[start:start + chunk] = numpy.argmax(rows[start:start + chunk] @ centroids.T, axis=1)
+        return assignment
@@ -0,0 +1,112 @@
+import argparse
+import os.path as osp
+import tempfile
+import time
+
+import numpy
+import torch
+import torch.nn.functional as f
+
+import configuration as cfg
+import dataManager as dataMgr
+import embedder as emb
+import inferenceEngine
+import quantization
+
+
+def run_engine(model, batches):
+    """
+    Computes the normalized embeddings of the batches and measures the throughput. The first batch is run once
+    before the measurement to warm the engine up.
+
+    :param model: callable returned by inferenceEngine.build
+    :param batches: list of preprocessed (N, 3, H, W) tensors
+    :return: tuple of the (N, D) numpy.ndarray of embeddings and the embeddings per second
+    """
+
+    embeddings = []
+    with torch.no_grad():
+        model(batches[0])
+        started = time.perf_counter()
+        for batch in batches:
+            embeddings.append(f.normalize(model(batch).float()).numpy())
+        seconds = time.perf_counter() - started
+    embeddings = numpy.concatenate(embeddings)
+    return embeddings, embeddings.shape[0] / seconds
+
+
+def compare(reference: numpy.ndarray, embeddings: numpy.ndarray, guids: list[str]):
+    """
+    Compares the embeddings of an engine with the fp32 embeddings of the same faces.
+
+    :param reference: (N, D) fp32 embeddings
+    :param embeddings: (N, D) embeddings of the engine
+    :param guids: guid of every face
+    :return: tuple of the mean cosine, the minimal cosine, the share of faces whose nearest other face is the
+    same as with fp32 and the share of faces whose nearest other face has the same guid as with fp32
+    """
+
+    cosines = numpy.sum(reference * embeddings, axis=1)
+    if reference.shape[0] < 2:
+        return float(cosines.mean()), float(cosines.min()), 1.0, 1.0
+    reference_top = __nearest_other(reference)
+    top = __nearest_other(embeddings)
+    guids = numpy.asarray(guids)
+    return (float(cosines.mean()), float(cosines.min()), float(numpy.mean(top == reference_top)),
+            float(numpy.mean(guids[top] == guids[reference_top])))
+
+
+def __nearest_other(embeddings: numpy.ndarray):
+    """
+    :return: index of the most similar other face for every face
+    """
+
+    scores = embeddings @ embeddings.T
+    numpy.fill_diagonal(scores, -numpy.inf)
+    return numpy.argmax(scores, axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the speed and the accuracy of the embedder engines on '
+                                                 'the gallery faces on CPU.')
+    parser.add_argument('--engines', nargs='+', default=list(inferenceEngine.engines),
+                        choices=inferenceEngine.engines)
+    parser.add_argument('--count', type=int, default=None, help='maximal number of gallery faces')
+    parser.add_argument('--calibration', type=int, default=cfg.quantization_calibration_size,
+                        help='number of gallery faces the int8 engine is calibrated on')
+    parser.add_argument('--batch-size', type=int, default=cfg.embedding_batch_size)
+    parser.add_argument('--threads', type=int, default=None, help='number of torch threads')
+    args = parser.parse_args()
+
+    cfg.load()
+    cfg.embedder_engine = 'eager'
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    faces = dataMgr.get_gallery_faces(args.count)
+    if len(faces) == 0:
+        raise SystemExit('Error> The gallery has no faces to benchmark on.')
+    guids = [guid for guid, _, _ in faces]
+    images = [image for _, _, image in faces]
+    batches = list(quantization.get_calibration_batches(images, emb.preprocess, args.batch_size))
+    calibration = list(quantization.get_calibration_batches(images[:args.calibration], emb.preprocess,
+                                                            args.batch_size))
+    backbone = emb.load_backbone(torch.device('cpu'))
+    print(f'Info> Benchmark of {len(images)} faces of {len(set(guids))} persons in batches of {args.batch_size}, '
+          f'{torch.get_num_threads()} threads.')
+    reference, reference_speed = run_engine(backbone, batches)
+    print(f'{"engine":<14}{"emb/s":>10}{"speedup":>10}{"mean cos":>12}{"min cos":>12}{"top-1 face":>12}'
+          f'{"top-1 guid":>12}')
+    with tempfile.TemporaryDirectory() as temp_path:
+        for engine in args.engines:
+            # noinspection PyBroadException
+            try:
+                model = inferenceEngine.build(backbone, engine, cfg.face_size,
+                                              onnx_path=osp.join(temp_path, 'backbone.onnx'),
+                                              calibration_batches=calibration)
+                embeddings, speed = run_engine(model, batches)
+            except Exception as e:
+                print(f'{engine:<14}failed: {e!r}')
+                continue
+            mean_cosine, min_cosine, face_agreement, guid_agreement = compare(reference, embeddings, guids)
+            print(f'{engine:<14}{speed:10.1f}{speed / reference_speed:10.2f}{mean_cosine:12.6f}'
+                  f'{min_cosine:12.6f}{face_agreement:12.4f}{guid_agreement:12.4f}')
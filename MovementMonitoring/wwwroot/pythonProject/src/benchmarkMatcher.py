@@ -0,0 +1,223 @@
+import argparse
+import contextlib
+import json
+import os
+import os.path as osp
+import platform
+import subprocess
+import sys
+import time
+
+import numpy
+
+import configuration as cfg
+import embeddingsTable as embTable
+from person import Person, PersonData
+
+
+class SyntheticGallery:
+    def __init__(self, templates: int, noise: float, seed: int = 0):
+        """
+        Generates synthetic identities. Every identity has a random unit-norm center, its templates and queries are
+        the center with gaussian noise, normalized again, so a query has a true match in the gallery.
+
+        :param templates: number of templates per person
+        :param noise: standard deviation of the noise of a template relative to the center
+        :param seed: seed of the generator
+        """
+
+        self.__templates = templates
+        self.__noise = noise
+        self.__generator = numpy.random.default_rng(seed)
+        self.__centers = numpy.empty((0, cfg.embedding_size), dtype=numpy.float32)
+
+    @property
+    def count(self):
+        return self.__centers.shape[0]
+
+    def grow(self, count: int):
+        """
+        Adds identities until there are count of them and returns the new persons.
+
+        :param count: number of identities after the call
+        :return: list of the new Person objects
+        """
+
+        first = self.count
+        centers = _normalize(self.__generator.standard_normal((count - first, cfg.embedding_size),
+                                                              dtype=numpy.float32))
+        self.__centers = numpy.concatenate([self.__centers, centers])
+        persons = []
+        for index, center in enumerate(centers):
+            person = Person(f'synthetic-{first + index}')
+            person.data.extend(PersonData(embedding) for embedding in self.__samples(center, self.__templates))
+            persons.append(person)
+        return persons
+
+    def queries(self, count: int):
+        """
+        :param count: number of queries
+        :return: (count, D) query embeddings and the guids of their identities
+        """
+
+        identities = self.__generator.integers(0, self.count, count)
+        queries = _normalize(self.__centers[identities] + self.__noise *
+                             self.__generator.standard_normal((count, cfg.embedding_size), dtype=numpy.float32))
+        return queries, [f'synthetic-{identity}' for identity in identities]
+
+    def __samples(self, center: numpy.ndarray, count: int):
+        return _normalize(center + self.__noise *
+                          self.__generator.standard_normal((count, cfg.embedding_size), dtype=numpy.float32))
+
+
+def measure(gallery: SyntheticGallery, persons, query_count: int, batch_size: int, compare: bool):
+    """
+    Adds the persons to the embedding table and measures the insert cost, the latency of single queries, the
+    throughput of batch queries, the top-1 accuracy and the resident memory, or the peak resident memory where
+    the resident memory is not available.
+
+    :param gallery: generator of the persons
+    :param persons: new persons to insert
+    :param query_count: number of single and of batch queries
+    :param batch_size: number of queries in a batch
+    :param compare: also measure compare_persons, it is quadratic in the number of templates
+    :return: dictionary of the results
+    """
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for person in persons:
+            embTable.add_person(person)
+        insert_seconds = time.perf_counter() - started
+    queries, guids = gallery.queries(query_count)
+    latencies = []
+    correct = 0
+    for query, guid in zip(queries, guids):
+        probe = Person('query')
+        probe.data.append(PersonData(query))
+        started = time.perf_counter()
+        found, _, _ = embTable.most_similar_person(probe)
+        latencies.append(time.perf_counter() - started)
+        correct += found is not None and found.guid == guid
+    started = time.perf_counter()
+    for start in range(0, query_count, batch_size):
+        embTable.most_similar_persons(queries[start:start + batch_size], k=1)
+    batch_seconds = time.perf_counter() - started
+    latencies = numpy.asarray(latencies) * 1000
+    p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99])
+    result = {
+        'identities': gallery.count,
+        'inserted': len(persons),
+        'insert_us_per_identity': insert_seconds / max(1, len(persons)) * 1e6,
+        'query_ms': {'mean': float(latencies.mean()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99)},
+        'batch_queries_per_second': query_count / batch_seconds,
+        'top1_accuracy': correct / query_count,
+    }
+    memory, memory_name = get_memory_mb()
+    result[memory_name] = memory
+    if compare:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            embTable.compare_persons()
+            result['compare_persons_seconds'] = time.perf_counter() - started
+    return result
+
+
+def get_memory_mb():
+    """
+    Returns the resident memory of the process. Where it is not available, the peak resident memory is returned,
+    it does not drop when memory is released and the growth of a table can not be taken from it.
+
+    :return: tuple of the memory in megabytes and its name, 'rss_mb' or 'peak_rss_mb'. NaN if no memory is
+    available
+    """
+
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 1024 / 1024, 'rss_mb'
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024, 'rss_mb'
+    except OSError:
+        pass
+    try:
+        # resource exists on Unix only
+        import resource
+    except ImportError:
+        return float('nan'), 'rss_mb'
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024), 'peak_rss_mb'
+
+
+def get_environment():
+    """
+    :return: dictionary describing the commit and the machine the benchmark ran on
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=osp.dirname(osp.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': numpy.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'ivf_nprobe': cfg.ivf_nprobe,
+            'ivf_probe_fraction': cfg.ivf_probe_fraction, 'ivf_nlist': cfg.ivf_nlist,
+            'ivf_min_train_size': cfg.ivf_min_train_size}
+
+
+def _normalize(matrix: numpy.ndarray):
+    return matrix / numpy.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the embedding table with synthetic identities at growing '
+                                                 'gallery sizes for every search backend.')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000, 1000000],
+                        help='numbers of identities, the gallery grows through them in order')
+    parser.add_argument('--backends', nargs='+', default=['exact', 'ivf'], choices=['exact', 'ivf'])
+    parser.add_argument('--templates', type=int, default=1, help='templates per person')
+    parser.add_argument('--noise', type=float, default=0.04, help='noise of a template around its identity')
+    parser.add_argument('--queries', type=int, default=200, help='number of single and of batch queries')
+    parser.add_argument('--batch-size', type=int, default=64, help='number of queries in a batch')
+    parser.add_argument('--compare-max', type=int, default=1000,
+                        help='largest number of identities compare_persons is measured at')
+    parser.add_argument('--output', default=None, help='JSON file of the results')
+    args = parser.parse_args()
+
+    sizes = sorted(args.sizes)
+    curves = {}
+    for backend in args.backends:
+        embTable.clear()
+        embTable.set_search_backend(backend)
+        gallery = SyntheticGallery(args.templates, args.noise)
+        base_memory, memory_name = get_memory_mb()
+        memory_label = 'rss MB' if memory_name == 'rss_mb' else 'peak MB'
+        curve = []
+        print(f'Info> Backend {backend}, {args.templates} templates per person.')
+        print(f'    {"identities":>10}{"insert us":>11}{"p50 ms":>9}{"p99 ms":>9}{"batch q/s":>11}{"top-1":>8}'
+              f'{memory_label:>9}{"compare s":>11}')
+        for size in sizes:
+            result = measure(gallery, gallery.grow(size), args.queries, args.batch_size, size <= args.compare_max)
+            memory = result.get('rss_mb')
+            if memory is not None:
+                result['table_mb'] = memory - base_memory
+            else:
+                memory = result['peak_rss_mb']
+            curve.append(result)
+            compare = result.get('compare_persons_seconds')
+            print(f'    {size:10d}{result["insert_us_per_identity"]:11.1f}{result["query_ms"]["p50"]:9.2f}'
+                  f'{result["query_ms"]["p99"]:9.2f}{result["batch_queries_per_second"]:11.1f}'
+                  f'{result["top1_accuracy"]:8.3f}{memory:9.0f}'
+                  f'{"" if compare is None else f"{compare:11.2f}"}')
+        curves[backend] = curve
+    embTable.clear()
+    results = {'environment': get_environment(), 'arguments': vars(args), 'curves': curves}
+    output = args.output or f'benchmark-matcher-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Info> Results were written to {output}.')
@@ -0,0 +1,344 @@
+import argparse
+import glob
+import json
+import os
+import os.path as osp
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy
+import torch
+
+import configuration as cfg
+import dataManager as dataMgr
+import detectorPool
+import embedder as emb
+import embeddingsTable as embTable
+import main
+import startup
+from detectionService import DetectionService
+from faceTracker import FaceTracker
+from motionGate import MotionGate
+from validator import InputType, Validator
+
+stages = ('decode', 'detect', 'embed', 'match', 'write', 'publish')
+
+
+class StageTimer:
+    def __init__(self):
+        """
+        Collects the durations of the pipeline stages of all sources.
+        """
+
+        self.__lock = threading.Lock()
+        self.__durations: dict[str, list[float]] = {stage: [] for stage in stages}
+
+    def record(self, stage: str, seconds: float):
+        with self.__lock:
+            self.__durations[stage].append(seconds)
+
+    def wrap(self, stage: str, function):
+        """
+        :return: function that calls the function and records its duration as the stage
+        """
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        return timed
+
+    def summary(self):
+        """
+        :return: dictionary of the count, the mean and the percentiles of every stage in milliseconds
+        """
+
+        with self.__lock:
+            durations = {stage: numpy.asarray(values) * 1000 for stage, values in self.__durations.items()}
+        result = {}
+        for stage, values in durations.items():
+            if len(values) == 0:
+                result[stage] = {'count': 0}
+                continue
+            p50, p90, p99 = numpy.percentile(values, [50, 90, 99])
+            result[stage] = {'count': int(len(values)), 'mean': float(values.mean()), 'p50': float(p50),
+                             'p90': float(p90), 'p99': float(p99), 'max': float(values.max())}
+        return result
+
+
+class ReplayReader:
+    def __init__(self, path: str, timer: StageTimer):
+        """
+        Decodes the frames of a video file on request and starts the video again when it ends, so a source can
+        be replayed for any number of frames without waiting for its frame rate.
+
+        :param path: path to the video file
+        :param timer: timer of the decode stage
+        """
+
+        self.__path = path
+        self.__timer = timer
+        self.__capture = cv2.VideoCapture(path)
+        self.__frame_number = 0
+
+    def get_frame(self, last_number: int = 0):
+        """
+        Decodes the next frame. Has the interface of FrameReader.get_frame.
+
+        :return: frame, its number and its age, which is always 0
+        """
+
+        started = time.perf_counter()
+        ok, frame = self.__capture.read()
+        if not ok:
+            self.__capture.release()
+            self.__capture = cv2.VideoCapture(self.__path)
+            ok, frame = self.__capture.read()
+        self.__timer.record('decode', time.perf_counter() - started)
+        if not ok:
+            raise IOError(f'Video {self.__path} can not be read')
+        self.__frame_number += 1
+        return frame, self.__frame_number, 0.0
+
+    def release(self):
+        self.__capture.release()
+
+
+class StubPublisher:
+    def __init__(self, timer: StageTimer):
+        """
+        Serializes the messages like the Publisher and counts them instead of sending them to the broker.
+
+        :param timer: timer of the publish stage
+        """
+
+        self.__timer = timer
+        self.__lock = threading.Lock()
+        self.published_count = 0
+        self.published_bytes = 0
+
+    def publish(self, message: dict):
+        started = time.perf_counter()
+        body = json.dumps(message, separators=(',', ':'), default=str).encode('utf-8')
+        with self.__lock:
+            self.published_count += 1
+            self.published_bytes += len(body)
+        self.__timer.record('publish', time.perf_counter() - started)
+        return True
+
+
+class MemoryImageWriter:
+    def __init__(self):
+        """
+        Encodes the images at once and keeps only their sizes, so the benchmark includes the encoding but does
+        not depend on the disk.
+        """
+
+        self.__lock = threading.Lock()
+        self.written_count = 0
+        self.written_bytes = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+
+    @property
+    def queue_depth(self):
+        return 0
+
+    def submit(self, file_path: str, image: numpy.ndarray, params: list[int], block: bool = False):
+        ok, encoded = cv2.imencode(osp.splitext(file_path)[1], image, params)
+        with self.__lock:
+            if ok:
+                self.written_count += 1
+                self.written_bytes += len(encoded)
+            else:
+                self.failed_count += 1
+        return bool(ok)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(video_paths: list[str], source_count: int, frames: int, res: int, motion: bool, tracking: bool):
+    """
+    Validates frames frames of every simulated source. The sources replay the videos in turn and share one
+    detection service, as the sources of one process in main.loop.
+
+    :param video_paths: replayed video files
+    :param source_count: number of simulated sources
+    :param frames: number of frames validated per source
+    :param res: max_size of the face detector
+    :param motion: use a motion gate per source
+    :param tracking: use a face tracker per source
+    :return: dictionary of the results
+    """
+
+    timer = StageTimer()
+    publisher = StubPublisher(timer)
+    writer = MemoryImageWriter()
+    dataMgr.set_image_writer(writer)
+    emb.get_embeddings = timer.wrap('embed', emb.get_embeddings)
+    embTable.most_similar_persons = timer.wrap('match', embTable.most_similar_persons)
+    for name in ('write_camera_capture', 'write_event', 'write_image_by_guid'):
+        setattr(dataMgr, name, timer.wrap('write', getattr(dataMgr, name)))
+    service = DetectionService(detectorPool.get_detector(main.get_detector_size({'res': res})),
+                               batch_size=cfg.detection_batch_size, max_delay=cfg.detection_max_delay)
+    detector = _TimedDetector(service, timer)
+    readers = []
+    validators = []
+    for index in range(source_count):
+        reader = ReplayReader(video_paths[index % len(video_paths)], timer)
+        readers.append(reader)
+        service.add_source()
+        motion_gate = MotionGate(**cfg.motion_defaults) if motion else None
+        face_tracker = None
+        if tracking:
+            face_tracker = FaceTracker(iou_threshold=cfg.track_iou_threshold,
+                                       max_missed=cfg.track_max_missed,
+                                       reembed_interval=cfg.track_reembed_interval,
+                                       confidence_threshold=cfg.track_confidence_threshold)
+        validators.append(Validator(source_id=f'benchmark-{index + 1}',
+                                    source_cap=reader,
+                                    source_type=InputType.VIDEO,
+                                    face_detector=detector,
+                                    publisher=publisher,
+                                    validation_threshold=cfg.validation_threshold,
+                                    motion_gate=motion_gate,
+                                    face_tracker=face_tracker))
+    service.start()
+    faces = [0] * source_count
+
+    def replay(number: int):
+        for _ in range(frames):
+            response = validators[number].validate()
+            if response is not None:
+                faces[number] += len(response['DetectedPersons'])
+
+    threads = [threading.Thread(target=replay, args=(index,), name=f'Benchmark-{index + 1}')
+               for index in range(source_count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    for reader in readers:
+        reader.release()
+    frame_count = source_count * frames
+    return {
+        'frames': frame_count,
+        'faces': sum(faces),
+        'seconds': seconds,
+        'frames_per_second': frame_count / seconds,
+        'faces_per_second': sum(faces) / seconds,
+        'messages': publisher.published_count,
+        'message_bytes': publisher.published_bytes,
+        'images': writer.written_count,
+        'image_bytes': writer.written_bytes,
+        'stages': timer.summary(),
+    }
+
+
+def print_results(results: dict, baseline: dict = None):
+    """
+    Prints the throughput and the stage latencies, and their change to the baseline results if given.
+    """
+
+    def change(value, reference):
+        if reference is None or reference == 0:
+            return ''
+        return f' ({(value / reference - 1) * 100:+.1f}%)'
+
+    base_stages = baseline['stages'] if baseline is not None else {}
+    print(f'Info> {results["frames"]} frames with {results["faces"]} faces in {results["seconds"]:.2f} s.')
+    for key in ('frames_per_second', 'faces_per_second'):
+        reference = baseline.get(key) if baseline is not None else None
+        print(f'    {key:<20}{results[key]:10.2f}{change(results[key], reference)}')
+    print(f'    {"stage":<10}{"count":>8}{"mean ms":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+    for stage, values in results['stages'].items():
+        if values['count'] == 0:
+            print(f'    {stage:<10}{0:8d}')
+            continue
+        reference = base_stages.get(stage, {}).get('p50')
+        print(f'    {stage:<10}{values["count"]:8d}{values["mean"]:10.2f}{values["p50"]:10.2f}{values["p90"]:10.2f}'
+              f'{values["p99"]:10.2f}{values["max"]:10.2f}{change(values["p50"], reference)}')
+
+
+def get_environment():
+    """
+    :return: dictionary describing the commit and the machine the benchmark ran on
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=osp.dirname(osp.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'torch': torch.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'threads': torch.get_num_threads(),
+            'device': str(cfg.device), 'embedder_engine': cfg.embedder_engine}
+
+
+class _TimedDetector:
+    def __init__(self, face_detector, timer: StageTimer):
+        """
+        Records the duration of the face detection, including the wait for the batch of the detection service.
+        """
+
+        self.__face_detector = face_detector
+        self.__timer = timer
+
+    def detect_all_faces_with_boxes(self, image):
+        started = time.perf_counter()
+        try:
+            return self.__face_detector.detect_all_faces_with_boxes(image)
+        finally:
+            self.__timer.record('detect', time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    default_videos = osp.join(osp.dirname(osp.abspath(__file__)), '..', 'data', 'videos', 'test_videos', '*.mp4')
+    parser = argparse.ArgumentParser(description='Replays videos as simulated sources through Validator.validate '
+                                                 'with a stubbed broker and an in-memory image writer.')
+    parser.add_argument('--videos', nargs='+', default=sorted(glob.glob(default_videos)),
+                        help='replayed video files, the sources use them in turn')
+    parser.add_argument('--sources', type=int, default=1, help='number of simulated sources')
+    parser.add_argument('--frames', type=int, default=100, help='number of frames validated per source')
+    parser.add_argument('--res', type=int, default=640, help='max_size of the face detector')
+    parser.add_argument('--motion', action='store_true', help='use a motion gate per source')
+    parser.add_argument('--no-tracking', action='store_true', help='embed every face of every frame')
+    parser.add_argument('--no-gallery', action='store_true', help='match against an empty gallery')
+    parser.add_argument('--output', default=None, help='JSON file of the results')
+    parser.add_argument('--baseline', default=None, help='JSON file of earlier results to compare with')
+    args = parser.parse_args()
+
+    if len(args.videos) == 0:
+        raise SystemExit('Error> No video files to replay.')
+    startup.load_configuration()
+    with tempfile.TemporaryDirectory() as temp_path:
+        cfg.events_path = osp.join(temp_path, 'events')
+        cfg.cameras_path = osp.join(temp_path, 'cameras')
+        startup.initialize([main.get_detector_size({'res': args.res})],
+                           (lambda: None) if args.no_gallery else embTable.fill_embedding_table_from_files)
+        # unknown faces are enrolled as new persons, their folders must not get into the gallery
+        cfg.data_path = osp.join(temp_path, 'gallery')
+        results = run(args.videos, args.sources, args.frames, args.res, args.motion, not args.no_tracking)
+    results = {'environment': get_environment(), 'arguments': vars(args)} | results
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    output = args.output or f'benchmark-pipeline-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Info> Results were written to {output}.')
@@ -1,22 +1,124 @@
-import torch
+import os
+import threading
+
 import yaml
 
-with open('../../../Properties/Config.yml') as f:
-    config = yaml.safe_load(f)
-    print(config)
-    data_path: str = config['п»їdata_path']
-    model_path: str = config['model_path']
-    events_path: str = config['events_path']
-    cameras_path: str = config['cameras_path']
-    uploads_path: str = config['uploads_path']
-    face_size: list[int] = config['face_size']
-    supported_extensions: list[str] = config['supported_extensions']
-    sources = config['sources']
-    max_photo_count: int = 5
-    min_detector_size: int = 128
-    max_detector_size: int = 2048
-    confidence_threshold: float = 0.99
-    validation_threshold: float = 0.4
-    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-    print(torch.cuda.is_available())
-    exit()
+config_path = '../../../Properties/Config.yml'
+max_photo_count: int = 5
+min_detector_size: int = 128
+align_detector_size_step: int = 128
+max_detector_size: int = 2048
+confidence_threshold: float = 0.99
+first_face_confidence_threshold: float = 0.7
+validation_threshold: float = 0.4
+embedding_size: int = 512
+embedding_batch_size: int = 32
+embedder_engine: str = 'torchscript'
+embedder_check_equivalence: bool = True
+embedder_min_cosine: float = 0.9999
+quantized_min_cosine: float = 0.98
+quantization_calibration_size: int = 256
+gallery_loader_workers: int = os.cpu_count() or 1
+gallery_parallel_min_files: int = 64
+gallery_progress_interval: float = 2.0
+frame_max_age: float = 1.0
+reconnect_min_delay: float = 0.5
+reconnect_max_delay: float = 30.0
+idle_loop_delay: float = 0.005
+detection_batch_size: int = 4
+detection_max_delay: float = 0.01
+event_image_extension: str = '.png'
+capture_image_extension: str = '.jpg'
+gallery_image_extension: str = '.png'
+jpeg_quality: int = 90
+webp_quality: int = 90
+png_compression: int = 1
+image_writer_workers: int = 2
+image_writer_queue_size: int = 256
+rabbitmq_host: str = 'localhost'
+rabbitmq_queue: str = 'validator'
+publisher_queue_size: int = 1024
+publisher_batch_size: int = 64
+publisher_confirms: bool = False
+publisher_high_water: int = 512
+spool_enabled: bool = True
+spool_segment_size: int = 16 * 1024 * 1024
+spool_fsync_batch: int = 100
+spool_fsync_interval: float = 0.5
+worker_count: int = 0
+# the metrics endpoint is opt-in, it is enabled by the metrics_enabled key of the configuration file
+metrics_enabled: bool = False
+metrics_host: str = '127.0.0.1'
+metrics_port: int = 9464
+worker_restart_delay: float = 1.0
+gallery_shared: bool = True
+gallery_store_capacity: int = 1024
+uploads_notifications: bool = True
+uploads_debounce: float = 0.3
+uploads_poll_interval: float = 1.0
+motion_defaults: dict = {'threshold': 25, 'min_area': 0.002, 'width': 160, 'learning_rate': 0.05,
+                         'max_skip_time': 5.0, 'hold_time': 1.0}
+roi_tile_overlap: float = 0.2
+roi_merge_threshold: float = 0.5
+tracking_enabled: bool = True
+track_iou_threshold: float = 0.3
+track_max_missed: int = 5
+track_reembed_interval: int = 15
+track_confidence_threshold: float = 0.5
+search_backend: str = 'exact'
+ivf_nlist: int = 0
+ivf_nprobe: int = 0
+ivf_probe_fraction: float = 0.4
+ivf_min_train_size: int = 20000
+ivf_retrain_growth: float = 4.0
+
+
+def load(path: str = None):
+    """
+    Reads the configuration file and selects the device. Called on the first access to a setting of the file,
+    or explicitly to load the configuration at a chosen moment of the startup.
+
+    :param path: path of the configuration file. Default config_path
+    """
+
+    global config, data_path, model_path, events_path, cameras_path, uploads_path, cache_path, spool_path, \
+        face_size, supported_extensions, sources, gallery_store_path, device, metrics_enabled, __loaded
+
+    with __load_lock:
+        if __loaded:
+            return
+        import torch
+
+        with open(path or config_path, encoding='utf-8-sig') as f:
+            config = yaml.safe_load(f)
+        print(config)
+        data_path = config['data_path']
+        model_path = config['model_path']
+        events_path = config['events_path']
+        cameras_path = config['cameras_path']
+        uploads_path = config['uploads_path']
+        cache_path = config['cache_path']
+        spool_path = config['spool_path']
+        face_size = config['face_size']
+        supported_extensions = config['supported_extensions']
+        if gallery_image_extension not in supported_extensions:
+            print(f'Warning> Gallery images are written as {gallery_image_extension}, which is not in '
+                  f'supported_extensions, they will not be loaded on the next start!')
+        sources = config['sources']
+        metrics_enabled = bool(config.get('metrics_enabled', metrics_enabled))
+        gallery_store_path = os.path.join(cache_path, 'gallery')
+        device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        __loaded = True
+
+
+def __getattr__(name: str):
+    if not __loaded and name in __lazy_settings:
+        load()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+__loaded = False
+__load_lock = threading.Lock()
+__lazy_settings = {'config', 'data_path', 'model_path', 'events_path', 'cameras_path', 'uploads_path', 'cache_path',
+                   'spool_path', 'face_size', 'supported_extensions', 'sources', 'gallery_store_path', 'device'}
@@ -1,55 +1,68 @@
+import atexit
 import datetime
 import os
 import os.path as osp
+import threading
 
 import cv2
 import numpy
 
 import configuration as cfg
-import embedder as emb
-from faceDetector import FaceDetector
-from person import PersonData
+import detectorPool
+from imageWriter import ImageWriter
 
 
-def get_aligned_faces_by_guid(guid: str):
+def get_aligned_images_by_paths(paths: list[str]):
     """
-    Returns aligned face images for the given guid.
+    Returns aligned face images for the given paths. Used by the gallery loader processes.
+
+    :param paths: paths to images
+    :return: list of (path, aligned face image) tuples for the images where a face was found
+    """
+
+    aligned = []
+    for file_path in paths:
+        image = __get_aligned_face_by_path(file_path)
+        if image is not None:
+            aligned.append((file_path, image))
+    return aligned
+
+
+def get_gallery_faces(max_count: int = None):
+    """
+    Returns aligned face images of the gallery, e.g. to calibrate or benchmark the embedder.
+
+    :param max_count: maximal number of returned faces. Default all faces
+    :return: list of (guid, path, aligned face image) tuples
+    """
+
+    faces = []
+    for guid in get_guid_list():
+        for file_path, image in get_aligned_images_by_paths(get_image_paths_by_guid(guid)):
+            if max_count is not None and len(faces) >= max_count:
+                return faces
+            faces.append((guid, file_path, image))
+    return faces
+
+
+def get_image_paths_by_guid(guid: str):
+    """
+    Returns paths of all entries in the folder of the given guid.
 
     :param guid: the guid of the person
-    :return: array of PersonData objects
+    :return: list of paths
     """
+
     __check_folder_exist(cfg.data_path)
     guid_path = osp.join(cfg.data_path, guid)
-    person_data_array = []
+    paths = []
     if osp.isdir(guid_path):
         with os.scandir(guid_path) as files:
             for file in files:
-                file_path = osp.join(guid_path, file.name)
-                person_data = get_aligned_image_by_path(file_path)
-                if person_data is not None:
-                    person_data_array.append(person_data)
-        if len(person_data_array) == 0:
-            print(f'Warning> Directory {guid_path} is empty!')
+                paths.append(osp.join(guid_path, file.name))
     else:
         print(f'Error> Directory {guid_path} does not exist!')
-    return person_data_array
-
-
-def get_aligned_image_by_path(file_path: str):
-    """
-    Returns aligned face image for the given path.
-
-    :param file_path: path to image
-    :return: PersonData object or None
-    """
-
-    image = __get_aligned_face_by_path(file_path)
-    if image is not None:
-        person_data = PersonData(path=file_path)
-        person_data.face_image = image
-        return person_data
-    else:
-        return None
+    return paths
 
 
 def __get_aligned_face_by_path(file_path: str):
@@ -70,11 +83,12 @@ def __get_aligned_face_by_path(file_path: str):
                           f'A face search and a rescaler have been launched. It is recommended to delete '
                           f'the original photo!')
                     image_max_size = max(image.shape[0], image.shape[1])
+                    image_max_size = -(-image_max_size // cfg.align_detector_size_step) * cfg.align_detector_size_step
                     if image_max_size < cfg.min_detector_size:
                         image_max_size = cfg.min_detector_size
                     elif image_max_size > cfg.max_detector_size:
                         image_max_size = cfg.max_detector_size
-                    fd_align = FaceDetector(max_size=image_max_size)
+                    fd_align = detectorPool.get_detector(image_max_size)
                     face = fd_align.detect_first_face(image)
                     if face is not None:
                         return face
@@ -115,7 +129,7 @@ def get_guid_list():
     return guid_list
 
 
-def write_event(guid: str, source_id: str, time: str, image: numpy.ndarray, extension='.png'):
+def write_event(guid: str, source_id: str, time: str, image: numpy.ndarray, extension=None):
     """
     Writes the photo to the event folder.
 
@@ -123,68 +137,132 @@ def write_event(guid: str, source_id: str, time: str, image: numpy.ndarray, exte
     :param time: time mark of capture
     :param guid: the guid of the person
     :param image: face image of guid person
-    :param extension: extension in which the file will be written. Default .png
+    :param extension: extension in which the file will be written. Default cfg.event_image_extension
 
     :return: path of written file or None
     """
 
     file_path = osp.join(cfg.events_path, source_id, time)
-    return __write_image_to_path(file_path, guid, image, extension)
+    return __write_image_to_path(file_path, guid, image, extension or cfg.event_image_extension)
 
 
-def write_image_by_guid(guid: str, image: numpy.ndarray, extension='.png'):
+def write_image_by_guid(guid: str, image: numpy.ndarray, extension=None):
     """
-    Writes the photo to the guid folder.
+    Writes the photo to the guid folder. Gallery photos are never dropped by a full writer queue.
 
     :param guid: the guid of the person
     :param image: face image of guid person
-    :param extension: extension in which the file will be written. Default .png
+    :param extension: extension in which the file will be written. Default cfg.gallery_image_extension
 
     :return: path of written file or None
     """
 
     file_path = osp.join(cfg.data_path, guid)
-    return __write_image_to_path(file_path, get_formatted_datetime(), image, extension)
+    return __write_image_to_path(file_path, get_formatted_datetime(), image,
+                                 extension or cfg.gallery_image_extension, block=True)
 
 
-def write_camera_capture(source_id: str, time: str, capture: numpy.ndarray, extension='.jpg'):
+def write_camera_capture(source_id: str, time: str, capture: numpy.ndarray, extension=None):
     """
     Writes the capture to the camera folder.
 
     :param source_id: id of camera
     :param time: time mark of capture
     :param capture: image of capture
-    :param extension: extension in which the file will be written. Default .png
+    :param extension: extension in which the file will be written. Default cfg.capture_image_extension
 
     :return: path of written file or None
     """
     file_path = osp.join(cfg.cameras_path, source_id)
-    return __write_image_to_path(file_path, time, capture, extension)
+    return __write_image_to_path(file_path, time, capture, extension or cfg.capture_image_extension)
+
+
+def flush_images():
+    """
+    Waits until all queued images are written.
+    """
+
+    if __image_writer is not None:
+        __image_writer.flush()
+
+
+def get_image_writer():
+    """
+    Returns the image writer, it is created on the first call.
+
+    :return: ImageWriter object
+    """
+
+    global __image_writer
+
+    with __image_writer_lock:
+        if __image_writer is None:
+            __image_writer = ImageWriter(workers=cfg.image_writer_workers, queue_size=cfg.image_writer_queue_size)
+            atexit.register(__image_writer.close)
+        return __image_writer
+
+
+def set_image_writer(writer):
+    """
+    Replaces the image writer, e.g. by an in-memory writer of a benchmark. The previous writer is not closed.
+
+    :param writer: object with the submit, flush and close methods of ImageWriter
+    :return: previous image writer or None
+    """
+
+    global __image_writer
 
+    with __image_writer_lock:
+        previous = __image_writer
+        __image_writer = writer
+        return previous
 
-def __write_image_to_path(path: str, file_name: str, image: numpy.ndarray, extension='.png'):
+
+def __write_image_to_path(path: str, file_name: str, image: numpy.ndarray, extension='.png', block=False):
     """
-    Writes the image to the path folder.
+    Queues the image for writing to the path folder. The image is encoded and written by the image writer.
 
     :param path: path where the file will be written
     :param file_name: name of written file
     :param image: face image
     :param extension: extension in which the file will be written. Default .png
+    :param block: wait for a free place in the writer queue instead of dropping the image
 
     :return: path of written file or None
     """
 
-    if extension in cfg.supported_extensions:
+    params = __get_encoding_params(extension)
+    if params is not None:
         __check_folder_exist(path)
         file_path = fr'{path}\{file_name}{extension}'
-        cv2.imwrite(file_path, image)
-        print(f'Info> Image has been written to path {file_path}.')
-        return file_path
+        if get_image_writer().submit(file_path, image, params, block):
+            print(f'Info> Image has been queued for writing to path {file_path}.')
+            return file_path
+        return None
     else:
         print(f'Error> Extension {extension} is not supported!')
         return None
 
 
+def __get_encoding_params(extension: str):
+    """
+    Returns cv2.imwrite parameters for the extension.
+
+    :param extension: extension of the written file
+    :return: list of parameters or None if the extension can not be written
+    """
+
+    match extension:
+        case '.jpg' | '.jpeg':
+            return [cv2.IMWRITE_JPEG_QUALITY, cfg.jpeg_quality]
+        case '.webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, cfg.webp_quality]
+        case '.png':
+            return [cv2.IMWRITE_PNG_COMPRESSION, cfg.png_compression]
+        case _:
+            return None
+
+
 def __check_folder_exist(path: str):
     """
     Create a folder if it does not exist
@@ -193,7 +271,7 @@ def __check_folder_exist(path: str):
     """
 
     if not osp.exists(path):
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
         print(f'Info> Folder {path} created.')
 
 
@@ -201,35 +279,40 @@ def get_formatted_datetime():
     return str(datetime.datetime.now().strftime("%Y-%m-%d-%H.%M.%S.%f"))
 
 
-def check_uploads(embTable):
+def ingest_uploads(embTable, guid: str, file_paths: list[str]):
     """
-    Check images in upload folder.
+    Moves uploaded images of a person to the gallery. Faces are aligned, written to the guid folder and added
+    to the embedding table in one batch. The uploaded files and the emptied upload folder are removed.
+
+    :param embTable: embedding table module
+    :param guid: the guid of the person
+    :param file_paths: paths of the uploaded images
     """
-    __check_folder_exist(cfg.uploads_path)
-    with os.scandir(cfg.uploads_path) as dirs:
-        for dr in dirs:
-            guid_path = osp.join(cfg.uploads_path, dr.name)
-            if osp.isdir(guid_path):
-                print(f'Info> scan uploads for guid {dr.name}.')
-                with os.scandir(guid_path) as files:
-                    for file in files:
-                        file_path = osp.join(guid_path, file.name)
-                        if osp.isfile(file_path):
-                            print(">>>>>>>> ", file_path)
-                            image = __get_aligned_face_by_path(file_path)
-                            if image is not None:
-                                image_path = write_image_by_guid(dr.name, image)
-                                if image_path is not None:
-                                    print(f'Info> find face image for guid {dr.name}.')
-                                    person_data = PersonData(path=image_path, face_image=image,
-                                                             embedding=emb.get_embedding(image))
-                                    embTable.add_person_data(dr.name, person_data)
-                            os.remove(file_path)
-                        else:
-                            os.rmdir(file_path)
-                with os.scandir(guid_path) as it:
-                    if not any(it):
-                        os.rmdir(guid_path)
-            else:
-                os.remove(guid_path)
 
+    images = []
+    image_paths = []
+    for file_path in file_paths:
+        if not osp.isfile(file_path):
+            continue
+        image = __get_aligned_face_by_path(file_path)
+        if image is not None:
+            image_path = write_image_by_guid(guid, image)
+            if image_path is not None:
+                print(f'Info> find face image for guid {guid}.')
+                images.append(image)
+                image_paths.append(image_path)
+        os.remove(file_path)
+    if len(images) != 0:
+        embTable.add_person_images(guid, images, image_paths)
+    guid_path = osp.join(cfg.uploads_path, guid)
+    # noinspection PyBroadException
+    try:
+        with os.scandir(guid_path) as it:
+            if not any(it):
+                os.rmdir(guid_path)
+    except Exception:
+        pass
+
+
+__image_writer: ImageWriter = None
+__image_writer_lock = threading.Lock()
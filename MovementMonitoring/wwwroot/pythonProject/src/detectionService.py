@@ -0,0 +1,80 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from faceDetector import FaceDetector
+
+
+class DetectionService(threading.Thread):
+    def __init__(self, face_detector: FaceDetector, batch_size: int = 4, max_delay: float = 0.01):
+        """
+        Collects images of all sources that share a face detector and runs them through the detector as one
+        batch. A batch is flushed when it is full or when its first image has waited max_delay seconds.
+
+        :param face_detector: detector shared by the sources
+        :param batch_size: maximal number of images in one batch
+        :param max_delay: maximal time in seconds an image waits for the batch to fill
+        """
+
+        super().__init__(name=f'DetectionService-{face_detector.max_size}', daemon=True)
+        self.__face_detector = face_detector
+        self.__batch_size = batch_size
+        self.__max_delay = max_delay
+        self.__source_count = 0
+        self.__queue = queue.Queue()
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting for detection."""
+
+        return self.__queue.qsize()
+
+    def add_source(self, images: int = 1):
+        """
+        Registers a source that submits images. A batch never waits for more images than the sources submit at once.
+
+        :param images: number of images the source submits per frame, e.g. the tiles of its zones
+        """
+
+        self.__source_count += images
+
+    def submit(self, image):
+        """
+        Queues the image for detection.
+
+        :param image: input image
+        :return: future with the tuple of found faces and their bounding boxes
+        """
+
+        future = Future()
+        self.__queue.put((image, future))
+        return future
+
+    def detect_all_faces_with_boxes(self, image):
+        """
+        Return lists of all found faces and of their bounding boxes. Blocks until the batch of the image
+        is processed.
+
+        :param image: input image
+        :return: list of all found faces and list of their bounding boxes [x_min, y_min, x_max, y_max]
+        """
+
+        return self.submit(image).result()
+
+    def run(self):
+        while True:
+            batch = [self.__queue.get()]
+            batch_size = max(1, min(self.__batch_size, self.__source_count))
+            deadline = time.monotonic() + self.__max_delay
+            while len(batch) < batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.__queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            results = self.__face_detector.detect_batch([image for image, _ in batch])
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
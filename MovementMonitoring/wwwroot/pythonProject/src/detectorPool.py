@@ -0,0 +1,45 @@
+import threading
+
+from faceDetector import FaceDetector, load_network
+
+
+def get_detector(max_size: int):
+    """
+    Returns the face detector of the size. All detectors of the process share one RetinaFace network, so its weights
+    are loaded once, and a detector of a size is created once. The network is only read during the detection, the
+    detectors can be used by several threads at once.
+
+    :param max_size: max_size of the detector
+    :return: FaceDetector object
+    """
+
+    detector = __detectors.get(max_size)
+    if detector is not None:
+        return detector
+    network = get_network()
+    with __detectors_lock:
+        detector = __detectors.get(max_size)
+        if detector is None:
+            detector = FaceDetector(max_size=max_size, network=network)
+            __detectors[max_size] = detector
+    return detector
+
+
+def get_network():
+    """
+    :return: RetinaFace network shared by the detectors, loaded on the first call
+    """
+
+    global __network
+
+    if __network is None:
+        with __network_lock:
+            if __network is None:
+                __network = load_network()
+    return __network
+
+
+__network = None
+__network_lock = threading.Lock()
+__detectors: dict[int, FaceDetector] = {}
+__detectors_lock = threading.Lock()
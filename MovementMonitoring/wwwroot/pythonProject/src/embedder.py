@@ -1,27 +1,66 @@
 # Original code
 # https://github.com/ZhaoJ9014/face.evoLVe.PyTorch/blob/master/util/extract_feature_v1.py
+import os
+import os.path as osp
+import threading
+import time
+
 import numpy
 import torch
 import torch.nn.functional as f
-import torchvision.transforms as transforms
 import configuration as cfg
+import inferenceEngine
+import metrics
+import quantization
 from backbone import Backbone
+from preprocessing import Preprocessor
+
+
+def load():
+    """
+    Builds the backbone and loads its weights. Called on the first embedding calculation, or explicitly to load
+    the model at a chosen moment of the startup.
+    """
+
+    global __backbone
+
+    with __load_lock:
+        if __backbone is not None:
+            return
+        __backbone = __build_engine(load_backbone(cfg.device))
+        print(f'Info> Embedder with input size {cfg.face_size}, device {cfg.device} and engine '
+              f'{__engine} was created')
+
+
+def load_backbone(device: torch.device):
+    """
+    Builds a new eager backbone with the weights of cfg.model_path.
+
+    :param device: device of the backbone
+    :return: backbone in eval mode
+    """
 
+    backbone = Backbone(cfg.face_size)
+    backbone.load_state_dict(torch.load(cfg.model_path, map_location=torch.device('cpu')))
+    backbone.to(device)
+    backbone.eval()
+    return backbone
 
-__transform = transforms.Compose(
-    [
-        transforms.ToPILImage(),
-        transforms.Resize([int(128 * cfg.face_size[0] / 112), int(128 * cfg.face_size[0] / 112)], ),
-        transforms.CenterCrop([cfg.face_size[0], cfg.face_size[1]]),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-    ],
-)
-__backbone = Backbone(cfg.face_size)
-__backbone.load_state_dict(torch.load(cfg.model_path, map_location=torch.device('cpu')))
-__backbone.to(cfg.device)
-__backbone.eval()
-print(f'Info> Embedder with input size {cfg.face_size} and device {cfg.device} was created')
+
+def preprocess(images, device: torch.device = None):
+    """
+    Converts aligned BGR face images to the RGB input batch of the backbone.
+
+    :param images: list of aligned face images in numpy.ndarray format
+    :param device: device of the batch. Default CPU
+    :return: (N, 3, H, W) tensor
+    """
+
+    global __preprocessor
+
+    if __preprocessor is None:
+        __preprocessor = Preprocessor(cfg.face_size)
+    return __preprocessor(images, device)
 
 
 # noinspection PyBroadException
@@ -33,29 +72,146 @@ def get_embedding(image: numpy.ndarray):
     """
 
     try:
-        if image.shape[0] == cfg.face_size[0] and image.shape[1] == cfg.face_size[1]:
-            with torch.no_grad():
-                print('Process> embedding calculation started...', sep='', end='')
-                image = __transform(image)
-                image = torch.unsqueeze(image, 0)
-                embedding = f.normalize(__backbone(image.to(cfg.device))).cpu()
-                print(' Done!')
-            return embedding
-        else:
-            print('Error> Incorrect image size!')
-            return None
+        embeddings = get_embeddings([image])
+        if embeddings is not None:
+            return torch.from_numpy(embeddings)
+        return None
     except Exception:
         print(Exception)
         return None
 
 
 # noinspection PyBroadException
-def get_embeddings_list(images):
-    embeddings = []
+def get_embeddings(images, batch_size: int = None):
+    """
+    Calculate and return embeddings of several images. Images are stacked and passed through the backbone
+    in chunks of batch_size images.
+
+    :param images: list of input images in numpy.ndarray format
+    :param batch_size: number of images in one forward pass. Default cfg.embedding_batch_size
+    :return: (N, D) numpy.ndarray of normalized embeddings or None
+    """
+
     try:
         for image in images:
-            embeddings.append(get_embedding(image))
+            if image.shape[0] != cfg.face_size[0] or image.shape[1] != cfg.face_size[1]:
+                print('Error> Incorrect image size!')
+                return None
+        batch_size = batch_size if batch_size is not None else cfg.embedding_batch_size
+        if __backbone is None:
+            load()
+        embeddings = numpy.empty((len(images), cfg.embedding_size), dtype=numpy.float32)
+        with torch.no_grad():
+            print(f'Process> embedding calculation for {len(images)} images started...', sep='', end='')
+            for start in range(0, len(images), batch_size):
+                started = time.perf_counter()
+                batch = preprocess(images[start:start + batch_size], cfg.device)
+                embedding = f.normalize(__backbone(batch))
+                embeddings[start:start + batch.shape[0]] = embedding.cpu().numpy()
+                __embedding_seconds.observe(time.perf_counter() - started)
+            print(' Done!')
+            __embedded_faces.inc(len(images))
         return embeddings
     except Exception:
         print(Exception)
         return None
+
+
+def get_model_identity():
+    """
+    Returns a string identifying the weights, the preprocessing and the quantization that produce embeddings.
+    Embeddings made with different identities must not be mixed. The identity depends on the configuration only,
+    so it is known before the model is loaded.
+    """
+
+    stat = os.stat(cfg.model_path)
+    identity = (f'{osp.basename(cfg.model_path)}:{stat.st_size}:{stat.st_mtime_ns}:'
+                f'{cfg.face_size[0]}x{cfg.face_size[1]}:{__pipeline_version}')
+    if cfg.embedder_engine in inferenceEngine.quantized_engines:
+        identity += f':{cfg.embedder_engine}'
+    return identity
+
+
+# noinspection PyBroadException
+def __build_engine(backbone: Backbone):
+    """
+    Builds the inference engine of cfg.embedder_engine and checks that its embeddings equal the embeddings of the
+    eager backbone. The eager backbone is used if the engine can not be built or the check fails. The int8 engine
+    is calibrated on the gallery faces and the quantized engines are compared on them with the lower
+    cfg.quantized_min_cosine.
+
+    :param backbone: backbone with loaded weights in eval mode
+    :return: callable that computes embeddings of a batch
+    """
+
+    global __engine
+
+    __engine = 'eager'
+    if cfg.embedder_engine == 'eager':
+        return backbone
+    try:
+        stat = os.stat(cfg.model_path)
+        onnx_path = osp.join(cfg.cache_path, f'{osp.splitext(osp.basename(cfg.model_path))[0]}-{stat.st_mtime_ns}-'
+                                             f'{cfg.face_size[0]}x{cfg.face_size[1]}.onnx')
+        calibration = None
+        min_cosine = cfg.embedder_min_cosine
+        if cfg.embedder_engine in inferenceEngine.quantized_engines:
+            calibration = list(quantization.get_calibration_batches(__get_calibration_images(), preprocess,
+                                                                    cfg.embedding_batch_size))
+            min_cosine = cfg.quantized_min_cosine
+        optimized = inferenceEngine.build(backbone, cfg.embedder_engine, cfg.face_size, onnx_path=onnx_path,
+                                          calibration_batches=calibration)
+        if cfg.embedder_check_equivalence:
+            difference, cosine = inferenceEngine.check_equivalence(
+                backbone, optimized, cfg.face_size, batch=calibration[0] if calibration else None)
+            if cosine < min_cosine:
+                print(f'Warning> Engine {cfg.embedder_engine} differs from the eager backbone (max difference '
+                      f'{difference:.2e}, min cosine {cosine:.6f}), the eager backbone is used.')
+                return backbone
+            print(f'Info> Engine {cfg.embedder_engine} matches the eager backbone (max difference {difference:.2e}, '
+                  f'min cosine {cosine:.6f}).')
+        __engine = cfg.embedder_engine
+        return optimized
+    except Exception as e:
+        print(f'Warning> Engine {cfg.embedder_engine} was not built, the eager backbone is used: {e!r}')
+        return backbone
+
+
+# noinspection PyBroadException
+def __get_calibration_images():
+    """
+    Returns the aligned gallery faces the int8 engine is calibrated on. The faces are saved to cfg.cache_path on
+    the first calibration and loaded from it later, so the engine is calibrated on the same faces on every start
+    and the cached embeddings stay comparable with the new ones.
+
+    :return: list of aligned face images
+    """
+
+    file_path = osp.join(cfg.cache_path, f'calibration-{cfg.face_size[0]}x{cfg.face_size[1]}-'
+                                         f'{cfg.quantization_calibration_size}.npy')
+    try:
+        return list(numpy.load(file_path))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'Warning> Calibration faces {file_path} were not loaded, they are collected again: {e!r}')
+    # The gallery faces are aligned by the face detectors, which are not needed when the faces are cached.
+    import dataManager as dataMgr
+
+    images = [image for _, _, image in dataMgr.get_gallery_faces(cfg.quantization_calibration_size)]
+    if len(images) > 0:
+        os.makedirs(cfg.cache_path, exist_ok=True)
+        temp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            numpy.save(file, numpy.stack(images))
+        os.replace(temp_path, file_path)
+    return images
+
+
+__pipeline_version = 'tensor-rgb-1'
+__preprocessor: Preprocessor = None
+__backbone: Backbone = None
+__engine = 'eager'
+__load_lock = threading.Lock()
+__embedding_seconds = metrics.histogram('embedder_batch_seconds', 'Duration of the embedding of a batch of faces.')
+__embedded_faces = metrics.counter('embedder_faces_total', 'Faces embedded by the backbone.')
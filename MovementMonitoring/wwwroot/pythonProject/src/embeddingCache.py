@@ -0,0 +1,131 @@
+import os
+import os.path as osp
+import threading
+
+import numpy
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, model_identity: str):
+        """
+        Persistent cache of gallery embeddings. An entry is keyed by the image path and stays valid while the
+        size and modification time of the file and the identity of the embedding model do not change.
+
+        :param path: path of the cache file
+        :param model_identity: string identifying the model and preprocessing that produced the embeddings
+        """
+
+        self.__path = path
+        self.__model_identity = model_identity
+        self.__entries: dict[str, tuple[int, int, numpy.ndarray]] = {}
+        self.__used: set[str] = set()
+        self.__modified = False
+        self.__lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads all entries of the cache file in bulk.
+        """
+
+        with self.__lock:
+            self.__entries = {}
+            self.__used = set()
+            self.__modified = False
+            if not osp.isfile(self.__path):
+                print(f'Info> Embedding cache {self.__path} does not exist yet.')
+                return
+            try:
+                with numpy.load(self.__path, allow_pickle=False) as data:
+                    if str(data['model']) != self.__model_identity:
+                        print(f'Warning> Embedding cache {self.__path} was built by another model and is ignored.')
+                        self.__modified = True
+                        return
+                    embeddings = data['embeddings']
+                    for key, size, mtime, embedding in zip(data['keys'], data['sizes'], data['mtimes'], embeddings):
+                        self.__entries[str(key)] = (int(size), int(mtime), embedding)
+                print(f'Info> Embedding cache with {len(self.__entries)} entries loaded.')
+            except (OSError, KeyError, ValueError) as e:
+                print(f'Error> Embedding cache {self.__path} is damaged and is ignored: {e}')
+                self.__entries = {}
+                self.__modified = True
+
+    def get(self, file_path: str):
+        """
+        Returns cached embedding for the file if the file has not changed since it was cached.
+
+        :param file_path: path to image
+        :return: embedding as numpy.ndarray or None
+        """
+
+        key = osp.abspath(file_path)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            try:
+                stat = os.stat(key)
+            except OSError:
+                return None
+            if entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                return None
+            self.__used.add(key)
+            return entry[2]
+
+    def put(self, file_path: str, embedding):
+        """
+        Adds an embedding to the cache. The file may still be being written, its size and modification time
+        are taken when the cache is saved.
+
+        :param file_path: path to image
+        :param embedding: embedding of the image
+        """
+
+        key = osp.abspath(file_path)
+        with self.__lock:
+            self.__entries[key] = (-1, -1, numpy.asarray(embedding, dtype=numpy.float32).reshape(-1))
+            self.__used.add(key)
+            self.__modified = True
+
+    def save(self, prune: bool = False):
+        """
+        Writes the cache file atomically if it was modified.
+
+        :param prune: drop entries that were not used or added since the cache was loaded
+        """
+
+        with self.__lock:
+            if prune:
+                stale = set(self.__entries) - self.__used
+                for key in stale:
+                    del self.__entries[key]
+                self.__modified = self.__modified or len(stale) > 0
+            if not self.__modified:
+                return
+            keys, sizes, mtimes, embeddings = [], [], [], []
+            for key, (size, mtime, embedding) in self.__entries.items():
+                if size < 0:
+                    try:
+                        stat = os.stat(key)
+                    except OSError:
+                        continue
+                    size, mtime = stat.st_size, stat.st_mtime_ns
+                    self.__entries[key] = (size, mtime, embedding)
+                keys.append(key)
+                sizes.append(size)
+                mtimes.append(mtime)
+                embeddings.append(embedding)
+            folder = osp.dirname(self.__path)
+            if folder != '' and not osp.exists(folder):
+                os.makedirs(folder)
+            temp_path = f'{self.__path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as file:
+                numpy.savez(file,
+                            model=numpy.array(self.__model_identity),
+                            keys=numpy.array(keys, dtype=str),
+                            sizes=numpy.array(sizes, dtype=numpy.int64),
+                            mtimes=numpy.array(mtimes, dtype=numpy.int64),
+                            embeddings=numpy.array(embeddings, dtype=numpy.float32) if len(keys) > 0 else
+                            numpy.empty((0, 0), dtype=numpy.float32))
+            os.replace(temp_path, self.__path)
+            self.__modified = False
+            print(f'Info> Embedding cache with {len(keys)} entries saved to {self.__path}.')
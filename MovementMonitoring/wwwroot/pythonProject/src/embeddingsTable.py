@@ -1,10 +1,21 @@
-from torch.nn import CosineSimilarity
-
+import atexit
+import os.path as osp
+import threading
+import time
+
+import numpy
+import torch
+
+from annIndex import IVFIndex
+from embeddingCache import EmbeddingCache
+from galleryLoader import load_persons
+from galleryStore import GalleryStore
 from person import Person, PersonData
 
 import configuration as cfg
 import dataManager as dataMgr
 import embedder as emb
+import metrics
 
 
 # noinspection PyBroadException
@@ -12,83 +23,116 @@ def fill_embedding_table_from_files():
     """
     Fills the embedding table with data from the received directory.
     """
-    global __embeddings_table
-
     try:
-        __embeddings_table = []
+        with __lock:
+            if __store is not None and __store.writable and __store.count > 0:
+                open_store(__store_path, writable=True)
+            __reset()
+        embedding_cache = __get_embedding_cache()
+        embedding_cache.load()
         guid_list = dataMgr.get_guid_list()
         if len(guid_list) == 0:
             print('Warning> No person has been saved in the system yet.')
         else:
-            for guid in guid_list:
-                add_person_by_guid(guid)
+            persons = load_persons(guid_list, embedding_cache)
+            with __lock:
+                for person in persons:
+                    __add_person(person)
+        embedding_cache.save(prune=True)
     except Exception:
         print(Exception)
 
 
-# noinspection PyBroadException
 def add_person(person: Person):
-    try:
-        if len(person.data) > 0:
-            __embeddings_table.append(person)
-            print(f'Info> Person {person.guid} added in embedding table.')
-        else:
-            print(f'Error> Data of Person {person.guid} is empty!')
-    except Exception:
-        print(Exception)
-        pass
+    if __is_store_reader():
+        with __lock:
+            __add_pending(person.guid, person.data, person)
+        __notify_update(person.guid, person.data)
+    elif __add_person(person):
+        __notify_update(person.guid, person.data)
+
+
+def open_store(path: str, writable: bool):
+    """
+    Keeps the gallery matrix in a memory-mapped store shared with other processes. The writer creates an empty
+    store and fills it with the persons it adds. Readers map the store and take the persons added by the writer
+    on every search. Their own additions are passed to the update listener, which forwards them to the writer,
+    and are searched as pending rows of the reader until the writer has appended them to the store.
+
+    :param path: folder of the store
+    :param writable: the process is the single writer of the store
+    """
+
+    global __store, __store_path
+
+    with __lock:
+        if __store is not None:
+            __store.close()
+        __store = GalleryStore(path, cfg.embedding_size, writable=writable, capacity=cfg.gallery_store_capacity)
+        __store_path = path
+        __reset()
+        __refresh_from_store()
+    print(f'Info> Gallery store {path} opened for {"writing" if writable else "reading"}.')
+
+
+def set_update_listener(listener):
+    """
+    Sets the function that is called with the guid and the new person data whenever persons or photos are
+    added to the embedding table by this process. Used to forward gallery updates to the other workers.
+
+    :param listener: function(guid, person_data_array) or None
+    """
+
+    global __update_listener
+
+    __update_listener = listener
 
 
 # noinspection PyBroadException
-def add_person_by_guid(guid: str):
+def apply_update(guid: str, rows):
     """
-    Add a new person to the embedding table by guid.
+    Adds photos that were added to the gallery by another worker. Photos whose path is already in the
+    embedding table are skipped. The update listener is not called.
 
-    :param guid: guid of the person being added
+    :param guid: guid of the person
+    :param rows: list of (embedding, path) tuples
     """
 
     try:
-        person_data_array = dataMgr.get_aligned_faces_by_guid(guid)
-        if len(person_data_array) != 0:
-            person = Person(guid)
-            for person_data in person_data_array:
-                print(f'Info> {guid} photo found.')
-                embedding = emb.get_embedding(person_data.face_image)
-                if embedding is not None:
-                    person.add_image(embedding, person_data.path, person_data.face_image)
-                else:
-                    print('Error> Embedding is None!!!')
-            add_person(person)
-        else:
-            print(f'Warning> Person {guid} does not have a photo!')
+        with __lock:
+            person: Person = get_person_by_guid(guid)
+            known = set() if person is None else {person_data.path for person_data in person.data}
+            person_data_array = [PersonData(embedding, path) for embedding, path in rows
+                                 if not path or path not in known]
+            if len(person_data_array) == 0:
+                return
+            if person is None:
+                person = Person(guid)
+                person.data.extend(person_data_array)
+                __add_person(person)
+            else:
+                person.data.extend(person_data_array)
+                __append_rows(guid, person_data_array)
+                __cache_rows(person_data_array)
     except Exception:
         print(Exception)
-        pass
 
 
 # noinspection PyBroadException
-def similarity_between_persons(person1: Person, person2: Person):
+def add_person_by_guid(guid: str):
     """
-    Find and return minimal cosine from 0 to 1 cosine distance between two persons.
+    Add a new person to the embedding table by guid. Embeddings of unchanged photos are taken from the
+    embedding cache, only new or changed photos are aligned and embedded.
 
-    :param person1: first person
-    :param person2: second person
-    :return: max similarity from 0 to 1 between two persons and most similar PersonData of second person
+    :param guid: guid of the person being added
     """
 
-    max_similarity: float = 0.0
-    most_similar_data = None
     try:
-        for pd1 in person1.data:
-            for pd2 in person2.data:
-                similarity = abs(__cos(pd1.embedding, pd2.embedding).item())
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    most_similar_data = pd2
-        return max_similarity, most_similar_data
+        for person in load_persons([guid], __get_embedding_cache()):
+            __add_person(person)
     except Exception:
         print(Exception)
-        return None
+        pass
 
 
 # noinspection PyBroadException
@@ -104,27 +148,100 @@ def most_similar_person(compared_person: Person):
         max_similarity: float = 0.0
         most_similar: Person = compared_person
         most_similar_data: PersonData = compared_person.data[0]
-        for person in __embeddings_table:
-            similarity, similar_data = similarity_between_persons(compared_person, person)
-            if similarity > max_similarity:
-                max_similarity = similarity
-                most_similar = person
-                most_similar_data = similar_data
+        matches = most_similar_persons([pd.embedding for pd in compared_person.data], k=1)
+        for found in matches:
+            if len(found) > 0 and found[0][2] > max_similarity:
+                most_similar, most_similar_data, max_similarity = found[0]
         return most_similar, most_similar_data, max_similarity
     except Exception:
         print(Exception)
         return None, None, None
 
 
+# noinspection PyBroadException
+def most_similar_persons(embeddings, k: int = 1):
+    """
+    Find the k most similar persons from the embedding table for every query embedding with a single
+    matrix product against the gallery matrix.
+
+    :param embeddings: Q query embeddings as (Q, D) array or tensor, or a list of embeddings
+    :param k: number of different persons returned for every query
+    :return: for every query a list of (person, person data, similarity) tuples sorted by similarity
+    """
+
+    try:
+        started = time.perf_counter()
+        queries = __to_matrix(embeddings)
+        with __lock:
+            __refresh_from_store()
+            count = len(__gallery_rows)
+            matrix = __gallery_matrix[:count]
+            rows = __gallery_rows
+            shortlists = __search_index.search(queries) if __is_index_used() else None
+            pending_matrix = __pending_matrix
+            pending_rows = __pending_rows
+        if count == 0:
+            found = [[] for _ in range(queries.shape[0])]
+        elif shortlists is None:
+            similarities = numpy.abs(queries @ matrix.T)
+            found = [__top_persons(scores, rows, k) for scores in similarities]
+        else:
+            found = [__top_persons(numpy.abs(matrix[shortlist] @ query), rows, k, shortlist)
+                     for query, shortlist in zip(queries, shortlists)]
+        if len(pending_rows) > 0:
+            similarities = numpy.abs(queries @ pending_matrix.T)
+            found = [__merge_found(gallery_found, __top_persons(scores, pending_rows, k), k)
+                     for gallery_found, scores in zip(found, similarities)]
+        backend = 'exact' if shortlists is None else 'ivf'
+        __search_seconds.observe(time.perf_counter() - started, backend=backend)
+        __search_queries.inc(queries.shape[0], backend=backend)
+        return found
+    except Exception:
+        print(Exception)
+        return None
+
+
+def clear():
+    """
+    Empties the embedding table, e.g. before it is filled again by a benchmark. The search backend is reset to
+    cfg.search_backend, the embedding cache is kept.
+    """
+
+    with __lock:
+        if __is_store_reader():
+            raise RuntimeError('The embedding table of a gallery store reader can not be cleared')
+        if __store is not None and __store.count > 0:
+            open_store(__store_path, writable=True)
+        __reset()
+
+
+def set_search_backend(backend: str):
+    """
+    Replaces the search index by the index of the backend and indexes the gallery rows again.
+
+    :param backend: 'exact' or 'ivf'
+    """
+
+    global __search_index
+
+    if backend not in ('exact', 'ivf'):
+        raise ValueError(f'Unknown search backend {backend}, expected exact or ivf')
+    with __lock:
+        __search_index = __create_search_index(backend)
+        __index_rows(0, len(__gallery_rows))
+
+
 def print_embeddings_table():
     """displays the contents of the embedding table."""
 
+    with __lock:
+        __refresh_from_store()
     for person in __embeddings_table:
         print('person name: ', person.guid, ' embedding count: ', len(person.data))
 
 
 def check_max_count(person):
-    return len(person.data) == cfg.max_photo_count
+    return len(person.data) >= cfg.max_photo_count
 
 
 def get_person_by_guid(guid: str):
@@ -133,28 +250,455 @@ def get_person_by_guid(guid: str):
     :return: with this guid or None.
     """
 
-    return next((person for person in __embeddings_table if person.guid == guid), None)
+    return __persons_by_guid.get(guid)
 
 
 def add_person_data(guid: str, person_data: PersonData):
-    person: Person = get_person_by_guid(guid)
-    if person is not None:
-        person.add_data(person_data)
-    else:
-        person = Person(guid)
-        person.add_data(person_data)
-        add_person(person)
+    if __is_store_reader():
+        with __lock:
+            __add_pending(guid, [person_data])
+        __notify_update(guid, [person_data])
+        return
+    with __lock:
+        person: Person = get_person_by_guid(guid)
+        if person is not None:
+            person.add_data(person_data)
+            __append_rows(guid, [person_data])
+            __cache_rows([person_data])
+        else:
+            person = Person(guid)
+            person.add_data(person_data)
+            if not __add_person(person):
+                return
+        __notify_update(guid, [person_data])
+
+
+# noinspection PyBroadException
+def add_person_images(guid: str, images, paths):
+    """
+    Calculates embeddings of the face images in one batch and adds them to the person with the guid.
+
+    :param guid: guid of the person
+    :param images: list of aligned face images
+    :param paths: list of paths the images are written to
+    """
+
+    try:
+        embeddings = emb.get_embeddings(images)
+        if embeddings is None:
+            print('Error> Embedding is None!!!')
+            return
+        if __is_store_reader():
+            person_data_array = [PersonData(embedding, path, image)
+                                 for embedding, path, image in zip(embeddings, paths, images)]
+            with __lock:
+                __add_pending(guid, person_data_array)
+            __notify_update(guid, person_data_array)
+            return
+        with __lock:
+            person: Person = get_person_by_guid(guid)
+            person_data_array = [PersonData(embedding, path, image)
+                                 for embedding, path, image in zip(embeddings, paths, images)]
+            if person is None:
+                person = Person(guid)
+                for person_data in person_data_array:
+                    person.add_data(person_data)
+                if not __add_person(person):
+                    return
+            else:
+                for person_data in person_data_array:
+                    person.add_data(person_data)
+                __append_rows(guid, person_data_array)
+                __cache_rows(person_data_array)
+            __notify_update(guid, person_data_array)
+    except Exception:
+        print(Exception)
 
 
 def compare_persons():
-    for person1 in __embeddings_table:
-        for person2 in __embeddings_table:
-            maximum, s = similarity_between_persons(person1, person2)
-            print(f"person {person1.guid} - person {person2.guid} - {maximum}")
+    """
+    Prints the maximal similarity between the photos of every pair of persons. The gallery rows are grouped by
+    person and every group is compared with all rows in one matrix product, the maxima of the groups are taken
+    with numpy.maximum.reduceat.
+
+    :return: list of guids and (P, P) matrix of the maximal similarities in the order of the guids
+    """
+
+    with __lock:
+        __refresh_from_store()
+        count = len(__gallery_rows)
+        matrix = __gallery_matrix[:count]
+        rows = __gallery_rows[:count]
+        persons = list(__embeddings_table)
+    person_rows = {}
+    for row, (guid, _) in enumerate(rows):
+        person_rows.setdefault(guid, []).append(row)
+    guids = [person.guid for person in persons if person.guid in person_rows]
+    order = numpy.array([row for guid in guids for row in person_rows[guid]], dtype=numpy.int64)
+    sizes = numpy.array([len(person_rows[guid]) for guid in guids], dtype=numpy.int64)
+    starts = numpy.cumsum(sizes) - sizes
+    grouped = matrix[order]
+    maxima = numpy.empty((len(guids), len(guids)), dtype=numpy.float32)
+    for index, (start, size) in enumerate(zip(starts, sizes)):
+        similarities = numpy.abs(grouped[start:start + size] @ grouped.T).max(axis=0)
+        maxima[index] = numpy.maximum.reduceat(similarities, starts)
+    if len(guids) > 0:
+        print('\n'.join(f'person {guid1} - person {guid2} - {maxima[index1, index2]}'
+                        for index1, guid1 in enumerate(guids) for index2, guid2 in enumerate(guids)))
+    return guids, maxima
+
+
+# noinspection PyBroadException
+def __add_person(person: Person):
+    """
+    Adds the person to the embedding table without calling the update listener.
+
+    :param person: person with at least one person data
+    :return: True if the person was added
+    """
+
+    try:
+        if len(person.data) > 0:
+            with __lock:
+                __embeddings_table.append(person)
+                __persons_by_guid[person.guid] = person
+                __append_rows(person.guid, person.data)
+            __cache_rows(person.data)
+            print(f'Info> Person {person.guid} added in embedding table.')
+            return True
+        else:
+            print(f'Error> Data of Person {person.guid} is empty!')
+    except Exception:
+        print(Exception)
+    return False
+
+
+# noinspection PyBroadException
+def __notify_update(guid: str, person_data_array):
+    """
+    Passes the embeddings and paths of the added person data to the update listener.
+
+    :param guid: guid of the person
+    :param person_data_array: list of added PersonData objects
+    """
+
+    if __update_listener is None:
+        return
+    try:
+        rows = [(__to_matrix(person_data.embedding)[0], person_data.path)
+                for person_data in person_data_array if person_data.embedding is not None]
+        if len(rows) > 0:
+            __update_listener(guid, rows)
+    except Exception:
+        print(Exception)
+
+
+def __add_pending(guid: str, person_data_array, person: Person = None):
+    """
+    Adds person data of a gallery store reader to its own table as pending rows. The writer appends them to the
+    store only after the round trip through the update listener, until then they are searched and counted here,
+    so the next frames find the person instead of adding it again. Must be called under the lock.
+
+    :param guid: guid of the person
+    :param person_data_array: list of added PersonData objects
+    :param person: person object to add if the guid is not in the table. Default a new person
+    """
+
+    known = __persons_by_guid.get(guid)
+    if known is None:
+        known = person if person is not None else Person(guid)
+        __embeddings_table.append(known)
+        __persons_by_guid[guid] = known
+    person_data_array = [pd for pd in person_data_array if pd.embedding is not None]
+    for pd, row in zip(person_data_array, __to_matrix([pd.embedding for pd in person_data_array])):
+        pd.embedding = row
+        if pd not in known.data:
+            known.data.append(pd)
+    __set_pending(__pending_rows + [(guid, pd) for pd in person_data_array])
+
+
+def __set_pending(pending_rows):
+    """
+    Replaces the pending rows and their matrix. Searches keep the previous lists, so they are never changed in
+    place. Must be called under the lock.
+    """
+
+    global __pending_matrix, __pending_rows
+
+    __pending_rows = pending_rows
+    __pending_matrix = __to_matrix([pd.embedding for _, pd in pending_rows])
+
+
+def __merge_found(first, second, k: int):
+    """
+    :return: the k best different persons of two lists of (person, person data, similarity) tuples
+    """
+
+    found = []
+    seen = set()
+    for match in sorted(first + second, key=lambda item: item[2], reverse=True):
+        if match[0].guid not in seen:
+            seen.add(match[0].guid)
+            found.append(match)
+            if len(found) == k:
+                break
+    return found
+
+
+def __to_matrix(embeddings):
+    """
+    Converts embeddings to a contiguous float32 matrix of L2-normalized rows.
+
+    :param embeddings: (N, D) array or tensor, or a list of embeddings
+    :return: numpy.ndarray with shape (N, D)
+    """
+
+    if isinstance(embeddings, (list, tuple)):
+        if len(embeddings) == 0:
+            return numpy.empty((0, cfg.embedding_size), dtype=numpy.float32)
+        embeddings = numpy.concatenate([__to_matrix(embedding) for embedding in embeddings])
+    elif isinstance(embeddings, torch.Tensor):
+        embeddings = embeddings.detach().cpu().numpy()
+    matrix = numpy.asarray(embeddings, dtype=numpy.float32).reshape(-1, cfg.embedding_size)
+    norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+    return numpy.ascontiguousarray(matrix / numpy.maximum(norms, 1e-6))
+
+
+def __append_rows(guid: str, person_data_array):
+    """
+    Appends embeddings of the person data to the gallery matrix. The matrix grows geometrically, so the rows
+    already published to searches are never moved or changed while being read. The embedding of a person data
+    becomes a view of its row of the gallery matrix, and the face image is dropped, it is read from its path on
+    demand. Must be called under the lock.
+
+    :param guid: guid of the person the data belongs to
+    :param person_data_array: list of PersonData objects
+    """
+
+    global __gallery_matrix
+
+    person_data_array = [pd for pd in person_data_array if pd.embedding is not None]
+    rows = __to_matrix([pd.embedding for pd in person_data_array])
+    count = len(__gallery_rows)
+    required = count + rows.shape[0]
+    if __store is not None:
+        __store.append(rows, [(guid, pd.path) for pd in person_data_array])
+        matrix = __store.matrix
+    else:
+        matrix = __gallery_matrix
+        if required > matrix.shape[0]:
+            matrix = numpy.empty((max(required, 2 * __gallery_matrix.shape[0], 64), cfg.embedding_size),
+                                 dtype=numpy.float32)
+            matrix[:count] = __gallery_matrix[:count]
+        matrix[count:required] = rows
+    moved = matrix is not __gallery_matrix
+    __gallery_matrix = matrix
+    for pd in person_data_array:
+        pd.release_face_image()
+    __gallery_rows.extend((guid, pd) for pd in person_data_array)
+    __bind_rows(0 if moved else count)
+    __index_rows(count, required)
+
+
+def __bind_rows(first: int):
+    """
+    Sets the embeddings of the gallery person data from the row first to views of their rows of the gallery
+    matrix. Called with 0 when the matrix was replaced, so no person data keeps the previous matrix alive. Must be
+    called under the lock.
+
+    :param first: first rebound row
+    """
+
+    for row in range(first, len(__gallery_rows)):
+        __gallery_rows[row][1].embedding = __gallery_matrix[row]
+
+
+def __index_rows(count: int, required: int):
+    """
+    Adds the gallery rows from count to required to the search index or trains it again. Must be called under
+    the lock.
+    """
+
+    if __search_index is not None:
+        if __search_index.is_trained and required <= cfg.ivf_retrain_growth * __search_index.trained_count:
+            __search_index.add(__gallery_matrix[count:required], count)
+        elif required >= cfg.ivf_min_train_size:
+            __search_index.train(__gallery_matrix[:required])
 
 
-__embeddings_table = []
-__similarity_table = []
-__cos = CosineSimilarity(eps=1e-6)
+def __reset():
+    """
+    Empties the embedding table. Must be called under the lock.
+    """
+
+    global __embeddings_table, __persons_by_guid, __gallery_matrix, __gallery_rows, __search_index
+
+    __embeddings_table = []
+    __persons_by_guid = {}
+    __gallery_matrix = numpy.empty((0, cfg.embedding_size), dtype=numpy.float32)
+    __gallery_rows = []
+    __search_index = __create_search_index()
+    __set_pending([])
+
+
+def __is_store_reader():
+    return __store is not None and not __store.writable
+
+
+def __refresh_from_store():
+    """
+    Adds the rows appended to the store by the writer since the last refresh. The embeddings of the person data
+    are views of the mapped matrix. A row of a pending person data of this process takes that person data, so it
+    is not counted twice. Must be called under the lock.
+    """
+
+    global __gallery_matrix
+
+    if not __is_store_reader():
+        return
+    first = __store.refresh()
+    count = __store.count
+    moved = __store.matrix is not __gallery_matrix
+    __gallery_matrix = __store.matrix
+    if count == first:
+        if moved:
+            __bind_rows(0)
+        return
+    pending_rows = list(__pending_rows)
+    for row in range(first, count):
+        guid, path = __store.metadata(row)
+        person = __persons_by_guid.get(guid)
+        if person is None:
+            person = Person(guid)
+            __embeddings_table.append(person)
+            __persons_by_guid[guid] = person
+        person_data = next((pd for pending_guid, pd in pending_rows
+                            if pending_guid == guid and pd.path == path), None)
+        if person_data is None:
+            person_data = PersonData(None, path)
+            person.data.append(person_data)
+        else:
+            pending_rows.remove((guid, person_data))
+            person_data.release_face_image()
+        __gallery_rows.append((guid, person_data))
+    if len(pending_rows) != len(__pending_rows):
+        __set_pending(pending_rows)
+    __bind_rows(0 if moved else first)
+    __index_rows(first, count)
+
+
+def __cache_rows(person_data_array):
+    """
+    Puts embeddings of gallery photos that are not cached yet into the embedding cache.
+
+    :param person_data_array: list of PersonData objects
+    """
+
+    person_data_array = [person_data for person_data in person_data_array
+                         if person_data.embedding is not None and person_data.path]
+    if len(person_data_array) == 0:
+        return
+    embedding_cache = __get_embedding_cache()
+    for person_data in person_data_array:
+        if embedding_cache.get(person_data.path) is None:
+            embedding_cache.put(person_data.path, __to_matrix(person_data.embedding)[0])
+
+
+def __save_embedding_cache():
+    """
+    Saves the embedding cache when the process exits, after the queued gallery photos are written.
+    """
+
+    dataMgr.flush_images()
+    if __embedding_cache is not None:
+        __embedding_cache.save()
+
+
+def __get_embedding_cache():
+    """
+    Returns the embedding cache, it is created on the first call.
+
+    :return: EmbeddingCache object
+    """
+
+    global __embedding_cache
+
+    with __embedding_cache_lock:
+        if __embedding_cache is None:
+            __embedding_cache = EmbeddingCache(osp.join(cfg.cache_path, 'embeddings.npz'), emb.get_model_identity())
+        return __embedding_cache
+
+
+def __create_search_index(backend: str = None):
+    """
+    Creates the approximate search index of the backend.
+
+    :param backend: 'exact' or 'ivf'. Default cfg.search_backend
+    :return: IVFIndex or None for the exact search
+    """
+
+    if (backend or cfg.search_backend) == 'ivf':
+        return IVFIndex(nprobe=cfg.ivf_nprobe, nlist=cfg.ivf_nlist, probe_fraction=cfg.ivf_probe_fraction)
+    return None
+
+
+def __is_index_used():
+    """Approximate search is used only after the index was trained on enough rows."""
+
+    return __search_index is not None and __search_index.is_trained and \
+        __search_index.count == len(__gallery_rows)
+
+
+def __top_persons(scores: numpy.ndarray, rows, k: int, row_ids=None):
+    """
+    Selects the k best different persons by the similarity of their gallery rows.
+
+    :param scores: similarity of the query with every gallery row or with the rows of row_ids
+    :param rows: gallery row index of (guid, PersonData) tuples
+    :param k: number of different persons
+    :param row_ids: gallery rows the scores belong to. Default all rows
+    :return: list of (person, person data, similarity) tuples sorted by similarity
+    """
+
+    count = scores.shape[0]
+    candidates = min(count, k * cfg.max_photo_count)
+    while True:
+        if candidates < count:
+            top = numpy.argpartition(-scores, candidates - 1)[:candidates]
+        else:
+            top = numpy.arange(count)
+        top = top[numpy.argsort(-scores[top], kind='stable')]
+        found = []
+        seen = set()
+        for row in top:
+            guid, person_data = rows[row if row_ids is None else row_ids[row]]
+            if guid not in seen:
+                seen.add(guid)
+                found.append((__persons_by_guid[guid], person_data, float(scores[row])))
+                if len(found) == k:
+                    return found
+        if candidates == count:
+            return found
+        candidates = min(count, 2 * candidates)
+
+
+__embeddings_table: list[Person] = []
+__persons_by_guid: dict[str, Person] = {}
+__gallery_matrix = numpy.empty((0, cfg.embedding_size), dtype=numpy.float32)
+__gallery_rows: list[tuple[str, PersonData]] = []
+__pending_matrix = numpy.empty((0, cfg.embedding_size), dtype=numpy.float32)
+__pending_rows: list[tuple[str, PersonData]] = []
+__search_index = __create_search_index()
+__embedding_cache: EmbeddingCache = None
+__embedding_cache_lock = threading.Lock()
+atexit.register(__save_embedding_cache)
+__lock = threading.RLock()
+__update_listener = None
+__store: GalleryStore = None
+__store_path: str = None
+__search_seconds = metrics.histogram('gallery_search_seconds', 'Duration of a batch search in the gallery.',
+                                     ['backend'])
+__search_queries = metrics.counter('gallery_search_queries_total', 'Embeddings searched in the gallery.', ['backend'])
+metrics.gauge('gallery_rows', 'Embeddings in the gallery.').set_function(lambda: len(__gallery_rows))
+metrics.gauge('gallery_persons', 'Persons in the gallery.').set_function(lambda: len(__persons_by_guid))
 print('Info> Embeddings table was created.')
-fill_embedding_table_from_files()
@@ -1,25 +1,58 @@
 import cv2
 import numpy as np
+import torch
+import torch.nn.functional as f
+from retinaface.box_utils import decode
 from retinaface.pre_trained_models import get_model
+from retinaface.prior_box import priorbox
+from torchvision.ops import nms
 
 import configuration as cfg
+import metrics
+
+
+def load_network():
+    """
+    Loads the pretrained RetinaFace network.
+
+    :return: network in eval mode
+    """
+
+    network = get_model('resnet50_2020-07-20', max_size=cfg.min_detector_size).model
+    network.eval()
+    return network
 
 
 # noinspection PyBroadException
 
 class FaceDetector:
-    def __init__(self, max_size=2048):
+    def __init__(self, max_size=2048, network=None):
         """
-        Face detector class. Detect faces.
+        Face detector class. Detect faces. Detectors of different sizes can share the network, only the prior
+        boxes depend on the size.
 
         :param max_size: size in pixels on the longest side of the processed image. Default 2048
+        :param network: RetinaFace network in eval mode. Default the pretrained weights are loaded
         """
 
-        self.__model = get_model('resnet50_2020-07-20', max_size=max_size)
-        self.__model.eval()
+        if network is None:
+            network = load_network()
+        self.__network = network
+        self.__device = next(network.parameters()).device
+        self.__prior_box = priorbox(min_sizes=[[16, 32], [64, 128], [256, 512]], steps=[8, 16, 32], clip=False,
+                                    image_size=(max_size, max_size)).to(self.__device)
+        self.__variance = [0.1, 0.2]
         self.__max_size = max_size
+        self.__mean = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1) * 255
+        self.__std = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1) * 255
         print(f'Info> Face detector with max size {max_size} and device {cfg.device} was created')
 
+    @property
+    def max_size(self):
+        """Size in pixels on the longest side of the processed image."""
+
+        return self.__max_size
+
     def detect_all_faces(self, image):
         """
         Return a list of all found faces.
@@ -28,24 +61,92 @@ class FaceDetector:
         :return: list of all found faces
         """
 
+        faces, _ = self.detect_all_faces_with_boxes(image)
+        return faces
+
+    def detect_all_faces_with_boxes(self, image):
+        """
+        Return lists of all found faces and of their bounding boxes.
+
+        :param image: input image
+        :return: list of all found faces and list of their bounding boxes [x_min, y_min, x_max, y_max]
+        """
+
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        """
+        Return found faces and their bounding boxes for several images with one forward pass of the network.
+
+        :param images: list of input images
+        :return: list with a tuple of found faces and their bounding boxes for every image,
+        None, None for the images without faces
+        """
+
         try:
-            img = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            print('Process> Face search started...', sep='', end='')
-            annotation = self.__model.predict_jsons(image=img, confidence_threshold=cfg.confidence_threshold)
+            print(f'Process> Face search in {len(images)} images started...', sep='', end='')
+            with _detection_seconds.time(size=self.__max_size):
+                annotations = self.__predict(images, cfg.confidence_threshold)
             print(' Done!')
-            faces = []
-            for bb in annotation:
-                bb = np.array(bb['bbox'], dtype=np.int32)
-                if len(bb) == 4:
-                    face = self.__extract_face(image, bb)
-                    faces.append(face)
-                else:
+            _detected_images.inc(len(images), size=self.__max_size)
+            _detected_faces.inc(sum(len(boxes) for boxes in annotations), size=self.__max_size)
+            results = []
+            for image, boxes in zip(images, annotations):
+                if len(boxes) == 0:
                     print('Warning> No faces found in the image!')
-                    faces = None
-            return faces
+                    results.append((None, None))
+                else:
+                    results.append(([self.extract_face(image, bb) for bb in boxes], list(boxes)))
+            return results
         except Exception:
             print(Exception)
-            return None
+            return [(None, None)] * len(images)
+
+    def __predict(self, images, confidence_threshold: float, nms_threshold: float = 0.4):
+        """
+        Runs the network on a batch of images. Every image is resized to max_size on its longest side,
+        normalized and padded to a max_size square, as in predict_jsons of the retinaface model.
+
+        :param images: list of BGR images
+        :param confidence_threshold: minimal score of a face
+        :param nms_threshold: IoU threshold of the non-maximum suppression
+        :return: list with an (N, 4) array of bounding boxes sorted by score for every image
+        """
+
+        size = self.__max_size
+        batch = torch.zeros((len(images), 3, size, size), dtype=torch.float32)
+        placements = []
+        for index, image in enumerate(images):
+            height, width = image.shape[:2]
+            scale = size / max(height, width)
+            resized_width, resized_height = round(width * scale), round(height * scale)
+            img = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            if resized_width != width or resized_height != height:
+                img = cv2.resize(img, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+            x_pad, y_pad = (size - resized_width) // 2, (size - resized_height) // 2
+            tensor = torch.from_numpy(img).permute(2, 0, 1).float()
+            batch[index, :, y_pad:y_pad + resized_height, x_pad:x_pad + resized_width] = \
+                (tensor - self.__mean) / self.__std
+            placements.append((x_pad, y_pad, 1 / scale, width, height))
+
+        with torch.no_grad():
+            loc, conf, _ = self.__network(batch.to(self.__device))
+            conf = f.softmax(conf, dim=-1)
+            scale_bboxes = torch.tensor([size, size, size, size], dtype=torch.float32, device=loc.device)
+            results = []
+            for index, (x_pad, y_pad, resize_coeff, width, height) in enumerate(placements):
+                boxes = decode(loc[index], self.__prior_box, self.__variance) * scale_bboxes
+                scores = conf[index][:, 1]
+                valid_index = torch.where(scores > confidence_threshold)[0]
+                boxes, scores = boxes[valid_index], scores[valid_index]
+                order = scores.argsort(descending=True)
+                boxes, scores = boxes[order], scores[order]
+                boxes = boxes[nms(boxes, scores, nms_threshold)].int().cpu().numpy()
+                boxes = ((boxes - [x_pad, y_pad, x_pad, y_pad]) * resize_coeff).astype(np.int32)
+                boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width - 1)
+                boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height - 1)
+                results.append(boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])])
+        return results
 
     def detect_first_face(self, image):
         """
@@ -56,13 +157,11 @@ class FaceDetector:
         """
 
         try:
-            img = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             print('Process> Face search started...', sep='', end='')
-            annotation = self.__model.predict_jsons(img)
+            boxes = self.__predict([image], cfg.first_face_confidence_threshold)[0]
             print(' Done!')
-            bb = np.array(annotation[0]['bbox'], dtype=np.int32)
-            if len(bb) == 4:
-                face = self.__extract_face(image, bb)
+            if len(boxes) > 0:
+                face = self.extract_face(image, boxes[0])
             else:
                 print('Warning> No faces found in the image!')
                 face = None
@@ -72,7 +171,7 @@ class FaceDetector:
             return None
 
     @staticmethod
-    def __extract_face(image, bb):
+    def extract_face(image, bb):
         """
         Extracts faces from the image by the coordinates of the bounding box.
 
@@ -103,3 +202,8 @@ class FaceDetector:
         print(f'Info> Extracted face with bounding box {bb}, width {img_width} and height {img_height}')
         img = cv2.resize(img, (cfg.face_size[0], cfg.face_size[1]))
         return img
+
+
+_detection_seconds = metrics.histogram('detector_batch_seconds', 'Duration of the face detection of a batch.', ['size'])
+_detected_images = metrics.counter('detector_images_total', 'Images searched for faces.', ['size'])
+_detected_faces = metrics.counter('detector_faces_total', 'Faces found by the detector.', ['size'])
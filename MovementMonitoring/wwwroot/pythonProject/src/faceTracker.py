@@ -0,0 +1,124 @@
+import numpy
+
+
+class Track:
+    def __init__(self, track_id: int, box: numpy.ndarray):
+        """
+        Class describing a face followed across frames.
+
+        :param track_id: id of the track inside its tracker
+        :param box: bounding box [x_min, y_min, x_max, y_max] of the face in the last frame
+        """
+
+        self.track_id = track_id
+        self.box = box
+        self.missed = 0
+        self.frames_since_embedding = 0
+        self.person_data: dict = None
+        self.confident = False
+
+
+class FaceTracker:
+    def __init__(self, iou_threshold: float = 0.3, max_missed: int = 5, reembed_interval: int = 15,
+                 confidence_threshold: float = 0.5):
+        """
+        Associates detections of consecutive frames by the overlap of their bounding boxes, so the identity of
+        a face found in one frame is reused in the next frames without embedding and searching it again.
+
+        :param iou_threshold: minimal intersection over union for a detection to continue a track
+        :param max_missed: number of processed frames a track survives without detections
+        :param reembed_interval: number of frames after which a confident track is embedded again
+        :param confidence_threshold: similarity from which a validated identity is trusted by the track
+        """
+
+        self.__iou_threshold = iou_threshold
+        self.__max_missed = max_missed
+        self.__reembed_interval = reembed_interval
+        self.__confidence_threshold = confidence_threshold
+        self.__tracks: list[Track] = []
+        self.__next_id = 1
+
+    def update(self, boxes):
+        """
+        Continues existing tracks with the detections of a new frame and starts tracks for the rest.
+
+        :param boxes: list of bounding boxes [x_min, y_min, x_max, y_max] found in the frame
+        :return: list of tracks in the order of boxes
+        """
+
+        boxes = numpy.asarray(boxes, dtype=numpy.float32).reshape(-1, 4)
+        assigned: list[Track] = [None] * boxes.shape[0]
+        matched = set()
+        if len(self.__tracks) > 0 and boxes.shape[0] > 0:
+            overlaps = self.__iou(numpy.array([track.box for track in self.__tracks]), boxes)
+            for flat in numpy.argsort(-overlaps, axis=None):
+                track_index, box_index = numpy.unravel_index(flat, overlaps.shape)
+                if overlaps[track_index, box_index] < self.__iou_threshold:
+                    break
+                if assigned[box_index] is None and track_index not in matched:
+                    assigned[box_index] = self.__tracks[track_index]
+                    matched.add(track_index)
+        for track_index, track in enumerate(self.__tracks):
+            track.missed = 0 if track_index in matched else track.missed + 1
+        self.__tracks = [track for track in self.__tracks if track.missed <= self.__max_missed]
+        for box_index, box in enumerate(boxes):
+            track = assigned[box_index]
+            if track is None:
+                track = Track(self.__next_id, box)
+                self.__next_id += 1
+                self.__tracks.append(track)
+                assigned[box_index] = track
+            else:
+                track.box = box
+                track.frames_since_embedding += 1
+        return assigned
+
+    def needs_embedding(self, track: Track):
+        """
+        :param track: track of a detection
+        :return: True if the face of the track should be embedded and searched in this frame
+        """
+
+        return track.person_data is None or not track.confident or \
+            track.frames_since_embedding >= self.__reembed_interval
+
+    def assign(self, track: Track, person_data: dict):
+        """
+        Stores the identity found for the embedded face of the track.
+
+        :param track: track of the embedded face
+        :param person_data: identity of the face as published in DetectedPersons
+        """
+
+        track.frames_since_embedding = 0
+        if person_data is None:
+            return
+        track.person_data = person_data
+        track.confident = not person_data['Validated'] or person_data['Similarity'] >= self.__confidence_threshold
+
+    @staticmethod
+    def mark_embedded(track: Track):
+        """
+        Restarts the embedding interval of a track that keeps its identity.
+
+        :param track: track of the embedded face
+        """
+
+        track.frames_since_embedding = 0
+
+    @staticmethod
+    def __iou(tracks: numpy.ndarray, boxes: numpy.ndarray):
+        """
+        :param tracks: (T, 4) boxes of the tracks
+        :param boxes: (D, 4) boxes of the detections
+        :return: (T, D) matrix of intersection over union
+        """
+
+        x_min = numpy.maximum(tracks[:, None, 0], boxes[None, :, 0])
+        y_min = numpy.maximum(tracks[:, None, 1], boxes[None, :, 1])
+        x_max = numpy.minimum(tracks[:, None, 2], boxes[None, :, 2])
+        y_max = numpy.minimum(tracks[:, None, 3], boxes[None, :, 3])
+        intersection = numpy.clip(x_max - x_min, 0, None) * numpy.clip(y_max - y_min, 0, None)
+        tracks_area = (tracks[:, 2] - tracks[:, 0]) * (tracks[:, 3] - tracks[:, 1])
+        boxes_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        return intersection / numpy.maximum(tracks_area[:, None] + boxes_area[None, :] - intersection, 1e-6)
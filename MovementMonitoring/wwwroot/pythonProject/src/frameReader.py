@@ -0,0 +1,119 @@
+import threading
+import time
+
+import cv2
+
+import configuration as cfg
+import metrics
+
+
+class FrameReader(threading.Thread):
+    def __init__(self, source, source_id: str, live: bool = True):
+        """
+        Reads frames of a camera or a video in a dedicated thread and keeps only the most recent one, so the
+        consumer never waits for I/O and never gets stale buffered frames.
+
+        :param source: camera index, stream url or path to a video file
+        :param source_id: id of the source
+        :param live: True for cameras and streams, they are reconnected with backoff when reading fails.
+        A video file is read with its own frame rate until it ends
+        """
+
+        super().__init__(name=f'FrameReader-{source_id}', daemon=True)
+        self.__source = source
+        self.__source_id = source_id
+        self.__live = live
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__frame = None
+        self.__frame_time = 0.0
+        self.__frame_number = 0
+        self.__connected = False
+        self.__finished = False
+
+    @property
+    def frame_number(self):
+        """Number of the latest frame, 0 while no frame has been read."""
+
+        return self.__frame_number
+
+    @property
+    def connected(self):
+        return self.__connected
+
+    @property
+    def finished(self):
+        """True when a video file has ended or could not be opened."""
+
+        return self.__finished
+
+    def get_frame(self, last_number: int = 0):
+        """
+        Returns the latest frame without blocking.
+
+        :param last_number: number of the frame the caller has already got
+        :return: frame, its number and its age in seconds, or None, last_number and None if there is no newer frame
+        """
+
+        with self.__lock:
+            if self.__frame is None or self.__frame_number == last_number:
+                return None, last_number, None
+            return self.__frame, self.__frame_number, time.monotonic() - self.__frame_time
+
+    def stop(self):
+        self.__stop_event.set()
+
+    def run(self):
+        delay = cfg.reconnect_min_delay
+        while not self.__stop_event.is_set():
+            capture = cv2.VideoCapture(self.__source)
+            if capture.isOpened():
+                print(f'Info> Source {self.__source_id} opened.')
+                if self.__read_frames(capture):
+                    delay = cfg.reconnect_min_delay
+            else:
+                print(f'Error> Error while trying to open source {self.__source_id}!')
+            capture.release()
+            self.__connected = False
+            if not self.__live:
+                print(f'Info> Video of source {self.__source_id} has ended.')
+                self.__finished = True
+                return
+            if not self.__stop_event.is_set():
+                print(f'Warning> Source {self.__source_id} is lost, reconnect in {delay:.1f} s.')
+                self.__stop_event.wait(delay)
+                delay = min(2 * delay, cfg.reconnect_max_delay)
+
+    def __read_frames(self, capture: cv2.VideoCapture):
+        """
+        Reads frames until the capture fails or the reader is stopped.
+
+        :param capture: opened capture
+        :return: True if at least one frame was read
+        """
+
+        interval = 0.0
+        if not self.__live:
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            interval = 1.0 / fps if fps > 0 else 0.0
+        next_time = time.monotonic()
+        has_frames = False
+        while not self.__stop_event.is_set():
+            read_started = time.perf_counter()
+            ret, frame = capture.read()
+            if not ret:
+                break
+            _decode_seconds.observe(time.perf_counter() - read_started, source=self.__source_id)
+            has_frames = True
+            self.__connected = True
+            with self.__lock:
+                self.__frame = frame
+                self.__frame_time = time.monotonic()
+                self.__frame_number += 1
+            if interval > 0:
+                next_time = max(next_time + interval, time.monotonic() - interval)
+                self.__stop_event.wait(max(0.0, next_time - time.monotonic()))
+        return has_frames
+
+
+_decode_seconds = metrics.histogram('frame_decode_seconds', 'Time to read and decode a frame of a source.', ['source'])
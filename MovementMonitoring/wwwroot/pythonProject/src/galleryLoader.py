@@ -0,0 +1,120 @@
+import multiprocessing as mp
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from embeddingCache import EmbeddingCache
+from person import Person, PersonData
+
+import configuration as cfg
+import dataManager as dataMgr
+import embedder as emb
+
+
+# noinspection PyBroadException
+def load_persons(guid_list: list[str], cache: EmbeddingCache):
+    """
+    Loads persons of the guid list from their folders. Cached embeddings are taken as is, photos that are not
+    cached are decoded and aligned by a process pool while the already aligned faces are embedded in batches.
+
+    :param guid_list: list of guid
+    :param cache: embedding cache
+    :return: list of Person objects that have at least one embedding
+    """
+
+    start_time = time.perf_counter()
+    persons = {}
+    pending = {}
+    cached_count = 0
+    for guid in guid_list:
+        person = Person(guid)
+        persons[guid] = person
+        for file_path in dataMgr.get_image_paths_by_guid(guid):
+            embedding = cache.get(file_path)
+            if embedding is not None:
+                person.add_data(PersonData(embedding, file_path))
+                cached_count += 1
+            else:
+                pending.setdefault(guid, []).append(file_path)
+    file_count = sum(len(paths) for paths in pending.values())
+    print(f'Info> Gallery: {cached_count} photos taken from the cache, {file_count} photos of '
+          f'{len(pending)} persons to embed.')
+
+    faces, owners = [], []
+    done_count, embedded_count = 0, 0
+    report_time = time.perf_counter()
+    for guid, aligned in __align(pending, file_count):
+        done_count += 1
+        for file_path, face in aligned:
+            faces.append(face)
+            owners.append((persons[guid], file_path))
+        if len(faces) >= cfg.embedding_batch_size:
+            embedded_count += __embed(faces, owners)
+            faces, owners = [], []
+        if time.perf_counter() - report_time >= cfg.gallery_progress_interval:
+            report_time = time.perf_counter()
+            __print_progress(done_count, len(pending), embedded_count, report_time - start_time)
+    embedded_count += __embed(faces, owners)
+
+    elapsed = time.perf_counter() - start_time
+    loaded = [person for person in persons.values() if len(person.data) > 0]
+    print(f'Info> Gallery loaded: {len(loaded)} persons, {cached_count + embedded_count} photos '
+          f'({cached_count} cached, {embedded_count} embedded) in {elapsed:.2f} s, '
+          f'{embedded_count / max(elapsed, 1e-6):.1f} photos/s embedded.')
+    for guid in guid_list:
+        if len(persons[guid].data) == 0:
+            print(f'Warning> Person {guid} does not have a photo!')
+    return loaded
+
+
+def __align(pending: dict[str, list[str]], file_count: int):
+    """
+    Yields aligned faces of every guid. Large galleries are aligned by a process pool, one task per guid
+    folder, and are yielded in the order of completion. The pool is spawned, it is created by a startup thread
+    while other threads import and load torch, and a forked child could inherit their locks held.
+
+    :param pending: guid -> paths of photos to align
+    :param file_count: total number of photos
+    :return: iterator of (guid, list of (path, face image)) tuples
+    """
+
+    workers = min(cfg.gallery_loader_workers, len(pending))
+    if workers <= 1 or file_count < cfg.gallery_parallel_min_files:
+        for guid, paths in pending.items():
+            yield guid, dataMgr.get_aligned_images_by_paths(paths)
+        return
+    print(f'Info> Gallery is aligned by {workers} processes.')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as executor:
+        futures = {executor.submit(dataMgr.get_aligned_images_by_paths, paths): guid
+                   for guid, paths in pending.items()}
+        for future in as_completed(futures):
+            guid = futures[future]
+            try:
+                yield guid, future.result()
+            except Exception as e:
+                print(f'Error> Photos of person {guid} were not aligned: {e}')
+                yield guid, []
+
+
+def __embed(faces, owners):
+    """
+    Embeds aligned faces in one batch and adds them to their persons.
+
+    :param faces: list of face images
+    :param owners: list of (person, path) tuples for every face
+    :return: number of added embeddings
+    """
+
+    if len(faces) == 0:
+        return 0
+    embeddings = emb.get_embeddings(faces)
+    if embeddings is None:
+        print('Error> Embedding is None!!!')
+        return 0
+    for (person, file_path), embedding in zip(owners, embeddings):
+        person.add_data(PersonData(embedding, file_path))
+    return len(faces)
+
+
+def __print_progress(done_count: int, total_count: int, embedded_count: int, elapsed: float):
+    print(f'Info> Gallery loading: {done_count}/{total_count} persons, {embedded_count} photos embedded, '
+          f'{embedded_count / max(elapsed, 1e-6):.1f} photos/s.')
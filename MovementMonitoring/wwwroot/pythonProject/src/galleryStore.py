@@ -0,0 +1,194 @@
+import glob
+import json
+import os
+import os.path as osp
+
+import numpy
+
+
+class GalleryStore:
+    __magic = 0x59524C4C4147  # 'GALLRY'
+
+    def __init__(self, path: str, dimension: int, writable: bool = False, capacity: int = 1024):
+        """
+        Gallery embedding matrix in a memory-mapped file that is shared by processes. One process appends rows,
+        the others map the same file read-only and see the appended rows without copying them.
+
+        The folder contains the rows file gallery-<generation>.f32, a metadata sidecar gallery.rows with one JSON
+        line of guid and path per row and a small header gallery.head with the generation, capacity and count
+        of rows. The writer fills the rows before their sidecar lines and the sidecar before it increases the
+        count, so readers never see a partially written row. Readers accept only the rows up to the published
+        count. When the capacity is exhausted the rows are copied to a file of the next generation with twice
+        the capacity, readers map the new file on their next refresh.
+
+        :param path: folder of the store
+        :param dimension: size of the embeddings
+        :param writable: the process is the single writer of the store, the store is created empty
+        :param capacity: initial number of rows of a created store
+        """
+
+        self.__path = path
+        self.__dimension = dimension
+        self.__writable = writable
+        self.__head_path = osp.join(path, 'gallery.head')
+        self.__rows_path = osp.join(path, 'gallery.rows')
+        self.__matrix = None
+        self.__generation = -1
+        self.__metadata: list[tuple[str, str]] = []
+        self.__count = 0
+        self.__sidecar_buffer = b''
+        if writable:
+            os.makedirs(path, exist_ok=True)
+            for file_path in glob.glob(osp.join(path, 'gallery-*.f32')):
+                self.__remove(file_path)
+            with open(self.__head_path, 'wb') as file:
+                file.write(numpy.zeros(4, dtype=numpy.uint64).tobytes())
+            self.__head = numpy.memmap(self.__head_path, dtype=numpy.uint64, mode='r+', shape=(4,))
+            self.__sidecar = open(self.__rows_path, 'wb')
+            self.__create_generation(0, max(1, capacity))
+            self.__head[0] = self.__magic
+            self.__head.flush()
+        else:
+            self.__head = numpy.memmap(self.__head_path, dtype=numpy.uint64, mode='r', shape=(4,))
+            if int(self.__head[0]) != self.__magic:
+                raise ValueError(f'{self.__head_path} is not a gallery store header')
+            self.__sidecar = open(self.__rows_path, 'rb')
+
+    @property
+    def writable(self):
+        """True if the process is the writer of the store."""
+
+        return self.__writable
+
+    @property
+    def count(self):
+        """Number of rows known to this process."""
+
+        return self.__count
+
+    @property
+    def matrix(self):
+        """Mapped (capacity, dimension) matrix, only the first count rows are valid."""
+
+        return self.__matrix
+
+    def metadata(self, row: int):
+        """
+        :param row: row of the matrix
+        :return: tuple of guid and path of the row
+        """
+
+        return self.__metadata[row]
+
+    def append(self, rows: numpy.ndarray, metadata: list[tuple[str, str]]):
+        """
+        Appends rows to the store and publishes them to the readers. Called by the writer only.
+
+        :param rows: (N, dimension) float32 matrix
+        :param metadata: list of N (guid, path) tuples
+        :return: index of the first appended row
+        """
+
+        if not self.__writable:
+            raise PermissionError('The gallery store is opened read-only')
+        first = len(self.__metadata)
+        required = first + rows.shape[0]
+        if required > self.__matrix.shape[0]:
+            self.__create_generation(self.__generation + 1, max(required, 2 * self.__matrix.shape[0]))
+        self.__matrix[first:required] = rows
+        self.__sidecar.write(b''.join(json.dumps(item).encode('utf-8') + b'\n' for item in metadata))
+        self.__sidecar.flush()
+        self.__metadata.extend(tuple(item) for item in metadata)
+        self.__count = required
+        self.__head[3] = required
+        return first
+
+    def refresh(self):
+        """
+        Maps the rows appended by the writer since the last refresh. Called by the readers.
+
+        :return: index of the first new row, the rows from it to count are new
+        """
+
+        first = self.__count
+        if self.__writable:
+            return first
+        while True:
+            generation = int(self.__head[1])
+            if generation != self.__generation:
+                file_path = self.__generation_path(generation)
+                try:
+                    capacity = osp.getsize(file_path) // (4 * self.__dimension)
+                    self.__matrix = numpy.memmap(file_path, dtype=numpy.float32, mode='r',
+                                                 shape=(capacity, self.__dimension))
+                except FileNotFoundError:
+                    # The writer has already moved to the next generation.
+                    continue
+                self.__generation = generation
+            # The writer switches the generation before it publishes a count of rows that only the new generation
+            # holds, so a count read while the generation is unchanged belongs to the mapped generation.
+            count = int(self.__head[3])
+            if int(self.__head[1]) != generation:
+                continue
+            if count > self.__count:
+                self.__read_metadata(count)
+            if int(self.__head[1]) == generation:
+                return first
+
+    def close(self):
+        """
+        Closes the sidecar, the mapped files are released with the last reference to the matrix.
+        """
+
+        self.__sidecar.close()
+
+    def __read_metadata(self, count: int):
+        """
+        Reads the sidecar lines of the rows up to the published count. Lines the writer has written for rows that
+        are not published yet are kept for a later refresh.
+
+        :param count: published count of rows
+        """
+
+        self.__sidecar_buffer += self.__sidecar.read()
+        lines = self.__sidecar_buffer.split(b'\n')
+        tail = lines.pop()
+        accepted = min(count - len(self.__metadata), len(lines))
+        self.__metadata.extend(tuple(json.loads(line)) for line in lines[:accepted])
+        self.__sidecar_buffer = b''.join(line + b'\n' for line in lines[accepted:]) + tail
+        if len(self.__metadata) < count:
+            print(f'Warning> Gallery store {self.__path} has {len(self.__metadata)} of {count} published rows '
+                  f'in its sidecar.')
+        self.__count = len(self.__metadata)
+
+    def __create_generation(self, generation: int, capacity: int):
+        """
+        Creates the rows file of the generation, copies the rows into it and switches the header to it.
+        """
+
+        file_path = self.__generation_path(generation)
+        with open(file_path, 'wb') as file:
+            file.truncate(capacity * self.__dimension * 4)
+        matrix = numpy.memmap(file_path, dtype=numpy.float32, mode='r+', shape=(capacity, self.__dimension))
+        count = len(self.__metadata)
+        if count > 0:
+            matrix[:count] = self.__matrix[:count]
+        previous = self.__generation
+        self.__matrix = matrix
+        self.__generation = generation
+        self.__head[2] = capacity
+        self.__head[1] = generation
+        if previous >= 0:
+            self.__remove(self.__generation_path(previous))
+
+    def __generation_path(self, generation: int):
+        return osp.join(self.__path, f'gallery-{generation:06d}.f32')
+
+    @staticmethod
+    def __remove(file_path: str):
+        # noinspection PyBroadException
+        try:
+            os.remove(file_path)
+        except Exception:
+            # The file is still mapped by a reader, it is removed when the store is created next time.
+            pass
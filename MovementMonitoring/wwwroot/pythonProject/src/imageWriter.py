@@ -0,0 +1,91 @@
+import queue
+import threading
+
+import cv2
+import numpy
+
+
+class ImageWriter:
+    def __init__(self, workers: int = 2, queue_size: int = 256):
+        """
+        Encodes and writes images in background threads, so the caller gets the path of the image at once.
+        Images must not be changed by the caller after they were submitted.
+
+        :param workers: number of writing threads
+        :param queue_size: maximal number of images waiting to be written
+        """
+
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__lock = threading.Lock()
+        self.written_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+        self.__threads = [threading.Thread(target=self.__run, name=f'ImageWriter-{index + 1}', daemon=True)
+                          for index in range(workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting to be written."""
+
+        return self.__queue.qsize()
+
+    def submit(self, file_path: str, image: numpy.ndarray, params: list[int], block: bool = False):
+        """
+        Queues the image for writing.
+
+        :param file_path: path of the written file
+        :param image: image
+        :param params: encoding parameters of cv2.imwrite
+        :param block: wait for a free place in a full queue instead of dropping the image
+        :return: True if the image was queued, False if it was dropped
+        """
+
+        try:
+            self.__queue.put((file_path, image, params), block=block)
+            return True
+        except queue.Full:
+            with self.__lock:
+                self.dropped_count += 1
+            print(f'Warning> Image writer queue is full, image {file_path} was dropped!')
+            return False
+
+    def flush(self):
+        """
+        Waits until all queued images are written.
+        """
+
+        self.__queue.join()
+
+    def close(self):
+        """
+        Writes all queued images and stops the writing threads.
+        """
+
+        self.flush()
+        for _ in self.__threads:
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            try:
+                if item is None:
+                    return
+                file_path, image, params = item
+                if cv2.imwrite(file_path, image, params):
+                    with self.__lock:
+                        self.written_count += 1
+                else:
+                    with self.__lock:
+                        self.failed_count += 1
+                    print(f'Error> Image {file_path} was not written!')
+            except Exception as e:
+                with self.__lock:
+                    self.failed_count += 1
+                print(f'Error> Image was not written: {e}')
+            finally:
+                self.__queue.task_done()
@@ -0,0 +1,175 @@
+import copy
+import os
+import os.path as osp
+
+import numpy
+import torch
+import torch.nn as nn
+
+from backbone import Backbone, bottleneck_IR
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+engines = ('eager', 'torchscript', 'onnx', 'int8-linear', 'int8')
+quantized_engines = ('int8-linear', 'int8')
+
+
+def fold_batch_norms(backbone: Backbone):
+    """
+    Returns a copy of the backbone for inference with the batch normalizations folded into the neighbouring
+    layers. A batch normalization after a convolution is folded into the convolution. The batch
+    normalizations around the output Linear layer are folded into it and the Dropout is removed. The batch
+    normalization at the start of a residual layer is kept, it is followed by a zero padded convolution and
+    can not be folded exactly.
+
+    :param backbone: backbone in eval mode
+    :return: folded backbone in eval mode
+    """
+
+    model = copy.deepcopy(backbone).eval()
+    model.input_layer = nn.Sequential(__fold_conv(model.input_layer[0], model.input_layer[1]), model.input_layer[2])
+    for unit in model.body:
+        if isinstance(unit, bottleneck_IR):
+            if isinstance(unit.shortcut_layer, nn.Sequential):
+                unit.shortcut_layer = __fold_conv(unit.shortcut_layer[0], unit.shortcut_layer[1])
+            res = unit.res_layer
+            unit.res_layer = nn.Sequential(res[0], res[1], res[2], __fold_conv(res[3], res[4]))
+    batch_norm, linear, batch_norm_1d = model.output_layer[0], model.output_layer[3], model.output_layer[4]
+    model.output_layer = nn.Sequential(nn.Flatten(), __fold_linear(batch_norm, linear, batch_norm_1d))
+    return model.eval()
+
+
+def build(backbone: Backbone, engine: str, face_size, onnx_path: str = None, calibration_batches=None):
+    """
+    Returns the callable that computes embeddings of a (N, 3, H, W) tensor with the engine.
+
+    :param backbone: backbone with loaded weights in eval mode
+    :param engine: 'eager' runs the backbone as it is, 'torchscript' runs the folded backbone traced and
+    frozen by TorchScript, 'onnx' runs the folded backbone exported to ONNX in onnxruntime, 'int8-linear' runs the
+    folded backbone with the Linear layer quantized to int8, 'int8' also runs the convolutions in int8. The int8
+    engines change the embeddings slightly and run on CPU only
+    :param face_size: input size of the backbone
+    :param onnx_path: file of the exported ONNX model, it is exported again if it does not exist
+    :param calibration_batches: iterable of preprocessed face batches the 'int8' engine is calibrated on
+    :return: module or OnnxBackbone object
+    """
+
+    if engine == 'eager':
+        return backbone
+    device = next(backbone.parameters()).device
+    if engine in quantized_engines:
+        if device.type != 'cpu':
+            raise ValueError(f'Engine {engine} runs on CPU only, the backbone is on {device}')
+        import quantization
+
+        if engine == 'int8-linear':
+            return quantization.quantize_linear(backbone)
+        return quantization.quantize_static(backbone, calibration_batches or [])
+    example = torch.zeros((1, 3, face_size[0], face_size[1]), device=device)
+    folded = fold_batch_norms(backbone)
+    if engine == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.trace(folded, example)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+    if engine == 'onnx':
+        if onnxruntime is None:
+            raise ImportError('onnxruntime is not installed')
+        if not osp.exists(onnx_path):
+            os.makedirs(osp.dirname(onnx_path) or '.', exist_ok=True)
+            temp_path = f'{onnx_path}.{os.getpid()}.tmp'
+            with torch.no_grad():
+                torch.onnx.export(folded.cpu(), example.cpu(), temp_path, input_names=['input'],
+                                  output_names=['embedding'], dynamic_axes={'input': {0: 'batch'},
+                                                                            'embedding': {0: 'batch'}})
+            os.replace(temp_path, onnx_path)
+        return OnnxBackbone(onnx_path)
+    raise ValueError(f'Unknown inference engine {engine}, expected one of {engines}')
+
+
+def check_equivalence(reference, optimized, face_size, batch_size: int = 4, seed: int = 0, batch=None):
+    """
+    Compares the embeddings of the reference and the optimized backbone on random input.
+
+    :param reference: eager backbone
+    :param optimized: callable returned by build
+    :param face_size: input size of the backbone
+    :param batch_size: number of compared images
+    :param seed: seed of the random input
+    :param batch: preprocessed faces compared instead of random input
+    :return: tuple of the maximal absolute difference of the raw outputs and the minimal cosine similarity of
+    the normalized embeddings
+    """
+
+    device = next(reference.parameters()).device
+    if batch is None:
+        generator = torch.Generator().manual_seed(seed)
+        batch = torch.rand((batch_size, 3, face_size[0], face_size[1]), generator=generator) * 2 - 1
+    batch = batch.to(device)
+    with torch.no_grad():
+        expected = reference(batch).float().cpu()
+        actual = optimized(batch).float().cpu()
+    difference = float((expected - actual).abs().max())
+    cosine = float(torch.nn.functional.cosine_similarity(expected, actual).min())
+    return difference, cosine
+
+
+class OnnxBackbone:
+    def __init__(self, path: str):
+        """
+        Runs the exported backbone in onnxruntime on CPU behind the call interface of the torch backbone.
+
+        :param path: file of the ONNX model
+        """
+
+        self.__session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+    def __call__(self, batch: torch.Tensor):
+        output = self.__session.run(None, {'input': batch.detach().cpu().numpy().astype(numpy.float32)})[0]
+        return torch.from_numpy(output)
+
+
+def __fold_conv(conv: nn.Conv2d, batch_norm: nn.BatchNorm2d):
+    """
+    :return: convolution with the following batch normalization folded into its weight and bias
+    """
+
+    scale, shift = __batch_norm_affine(batch_norm)
+    folded = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, conv.padding,
+                       conv.dilation, conv.groups, bias=True).to(conv.weight.device)
+    with torch.no_grad():
+        folded.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1))
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(shift)
+        folded.bias.copy_(bias * scale + shift)
+    return folded
+
+
+def __fold_linear(batch_norm: nn.BatchNorm2d, linear: nn.Linear, batch_norm_1d: nn.BatchNorm1d):
+    """
+    :return: linear layer with the channel batch normalization of its flattened input and the batch
+    normalization of its output folded into its weight and bias
+    """
+
+    input_scale, input_shift = __batch_norm_affine(batch_norm)
+    output_scale, output_shift = __batch_norm_affine(batch_norm_1d)
+    positions = linear.in_features // input_scale.shape[0]
+    input_scale = input_scale.repeat_interleave(positions)
+    input_shift = input_shift.repeat_interleave(positions)
+    folded = nn.Linear(linear.in_features, linear.out_features).to(linear.weight.device)
+    with torch.no_grad():
+        weight = linear.weight * input_scale.view(1, -1)
+        bias = linear.bias + linear.weight @ input_shift
+        folded.weight.copy_(weight * output_scale.view(-1, 1))
+        folded.bias.copy_(bias * output_scale + output_shift)
+    return folded
+
+
+def __batch_norm_affine(batch_norm):
+    """
+    :return: per channel scale and shift that equal the batch normalization in eval mode
+    """
+
+    scale = batch_norm.weight / torch.sqrt(batch_norm.running_var + batch_norm.eps)
+    return scale.detach(), (batch_norm.bias - batch_norm.running_mean * scale).detach()
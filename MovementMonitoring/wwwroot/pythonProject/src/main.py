@@ -1,74 +1,189 @@
-from time import sleep
 from threading import Thread
 
 import cv2
-import pika
 
 import configuration as cfg
 import dataManager as dataMgr
+import detectorPool
 import embeddingsTable as embTable
-from faceDetector import FaceDetector
+import metrics
+import startup
+from detectionService import DetectionService
+from faceTracker import FaceTracker
+from frameReader import FrameReader
+from motionGate import MotionGate
+from publisher import Publisher
+from roi import RoiDetector, get_detection_size
+from spool import Spool
+from supervisor import Supervisor
+from uploadsWatcher import UploadsWatcher
 from validator import Validator, InputType
 
 
-def loop():
-    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    channel = connection.channel()
-    channel.queue_declare(queue='validator')
-    i = 1
+def get_sources():
+    """
+    Returns the configured sources with their ids.
+
+    :return: list of (source id, source) tuples
+    """
+
+    return [(str(index + 1), next(iter(source.values()))) for index, source in enumerate(cfg.sources)]
+
+
+def get_detector_size(source: dict):
+    """
+    :param source: configured source
+    :return: max_size of the face detector of the source
+    """
+
+    res = source['res']
+    if 'roi' in source:
+        res = get_detection_size(source['roi'], res)
+    return min(max(res, cfg.min_detector_size), cfg.max_detector_size)
+
+
+def loop(sources=None, spool_path=None, detectors=None):
+    """
+    Validates the sources until the process ends.
+
+    :param sources: list of (source id, source) tuples. Default all configured sources
+    :param spool_path: folder of the message spool. Default cfg.spool_path
+    :param detectors: dictionary of face detectors created at the startup by their size
+    """
+
+    if sources is None:
+        sources = get_sources()
+    spool = None
+    if cfg.spool_enabled:
+        spool = Spool(spool_path or cfg.spool_path,
+                      segment_size=cfg.spool_segment_size,
+                      fsync_batch=cfg.spool_fsync_batch,
+                      fsync_interval=cfg.spool_fsync_interval)
+    publisher = Publisher(host=cfg.rabbitmq_host,
+                          routing_key=cfg.rabbitmq_queue,
+                          queue_size=cfg.publisher_queue_size,
+                          batch_size=cfg.publisher_batch_size,
+                          confirms=cfg.publisher_confirms,
+                          reconnect_min_delay=cfg.reconnect_min_delay,
+                          reconnect_max_delay=cfg.reconnect_max_delay,
+                          spool=spool,
+                          high_water=cfg.publisher_high_water)
+    publisher.start()
+    __register_publisher_metrics(publisher)
     validators = []
-    face_detectors = {}
-    for source in cfg.sources:
-        print(source)
-        source = next(iter(source.values()))
-        print(source)
-        res = source['res']
-        if res > cfg.max_detector_size:
-            res = cfg.max_detector_size
-        elif res < cfg.min_detector_size:
-            res = cfg.min_detector_size
-        if res in face_detectors:
-            fd = face_detectors[res]
+    detection_services = {}
+    for source_id, source in sources:
+        print(source_id, source)
+        res = get_detector_size(source)
+        if res in detection_services:
+            fd = detection_services[res]
         else:
-            fd = FaceDetector(max_size=res)
-            face_detectors[res] = fd
+            face_detector = detectors.get(res) if detectors is not None else None
+            fd = DetectionService(face_detector or detectorPool.get_detector(res),
+                                  batch_size=cfg.detection_batch_size,
+                                  max_delay=cfg.detection_max_delay)
+            detection_services[res] = fd
+            __queue_depth.set_function(lambda service=fd: service.queue_depth, queue=f'detection-{res}')
+        detector = fd
+        if 'roi' in source:
+            roi = source['roi']
+            detector = RoiDetector(fd, roi['zones'],
+                                   tile=roi.get('tile'),
+                                   overlap=roi.get('overlap', cfg.roi_tile_overlap),
+                                   merge_threshold=cfg.roi_merge_threshold)
+            fd.add_source(detector.region_count)
+        else:
+            fd.add_source()
         src_type = source['type']
         match src_type:
             case "CAM":
                 src_type = InputType.CAM
-                src_cap = cv2.VideoCapture(source['src'])
+                src_cap = FrameReader(source['src'], source_id, live=True)
+                src_cap.start()
             case "VIDEO":
                 src_type = InputType.VIDEO
-                src_cap = cv2.VideoCapture(source['src'])
+                src_cap = FrameReader(source['src'], source_id, live=False)
+                src_cap.start()
             case "IMAGE":
                 src_type = InputType.IMAGE
                 src_cap = cv2.imread(source['src'])
             case _:
                 src_cap = ''
-        val = Validator(source_id=str(i),
+        motion = source.get('motion', True)
+        motion_gate = None
+        if motion is not False:
+            motion_gate = MotionGate(**(cfg.motion_defaults | (motion if isinstance(motion, dict) else {})))
+        face_tracker = None
+        if cfg.tracking_enabled:
+            face_tracker = FaceTracker(iou_threshold=cfg.track_iou_threshold,
+                                       max_missed=cfg.track_max_missed,
+                                       reembed_interval=cfg.track_reembed_interval,
+                                       confidence_threshold=cfg.track_confidence_threshold)
+        val = Validator(source_id=source_id,
                         source_cap=src_cap,
                         source_type=src_type,
-                        face_detector=fd,
-                        channel=channel,
-                        validation_threshold=cfg.validation_threshold)
+                        face_detector=detector,
+                        publisher=publisher,
+                        validation_threshold=cfg.validation_threshold,
+                        motion_gate=motion_gate,
+                        face_tracker=face_tracker)
         validators.append(val)
-        i += 1
 
-    while True:
-        for validator in validators:
-            validator.validate()
-        #embTable.compare_persons()
+    for service in detection_services.values():
+        service.start()
+    threads = [Thread(target=validator.run, args=(), name=f'Validator-{index + 1}')
+               for index, validator in enumerate(validators)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def __register_publisher_metrics(publisher: Publisher):
+    """
+    Exposes the queue depths and the counters of the publisher and of the image writer, they are read at scrape
+    time.
+    """
+
+    __queue_depth.set_function(lambda: publisher.queue_depth, queue='publisher')
+    __queue_depth.set_function(lambda: publisher.spool_depth, queue='spool')
+    __queue_depth.set_function(lambda: dataMgr.get_image_writer().queue_depth, queue='image-writer')
+    messages = metrics.counter('publisher_messages_total', 'Messages handled by the publisher.', ['result'])
+    messages.set_function(lambda: publisher.published_count, result='published')
+    messages.set_function(lambda: publisher.spooled_count, result='spooled')
+    messages.set_function(lambda: publisher.dropped_count, result='dropped')
+    metrics.counter('publisher_reconnects_total', 'Reconnections to the broker.').set_function(
+        lambda: publisher.reconnect_count)
+    metrics.gauge('publisher_connected', '1 if the publisher is connected to the broker.').set_function(
+        lambda: int(publisher.connected))
+    images = metrics.counter('image_writer_images_total', 'Images handled by the image writer.', ['result'])
+    images.set_function(lambda: dataMgr.get_image_writer().written_count, result='written')
+    images.set_function(lambda: dataMgr.get_image_writer().dropped_count, result='dropped')
+    images.set_function(lambda: dataMgr.get_image_writer().failed_count, result='failed')
 
 
 def uploads():
-    while True:
-        dataMgr.check_uploads(embTable)
-        sleep(3)
+    watcher = UploadsWatcher(cfg.uploads_path,
+                             lambda guid, file_paths: dataMgr.ingest_uploads(embTable, guid, file_paths),
+                             debounce=cfg.uploads_debounce,
+                             poll_interval=cfg.uploads_poll_interval,
+                             notifications=cfg.uploads_notifications)
+    watcher.run()
+
 
+__queue_depth = metrics.gauge('queue_depth', 'Number of items waiting in a queue.', ['queue'])
 
 if __name__ == '__main__':
-    embTable.print_embeddings_table()
-    th = Thread(target=loop, args=())
-    th2 = Thread(target=uploads, args=())
-    th.start()
-    th2.start()
+    startup.load_configuration()
+    if cfg.metrics_enabled:
+        metrics.start_server(cfg.metrics_port, cfg.metrics_host)
+    if cfg.worker_count > 0:
+        Supervisor(get_sources(), cfg.worker_count, restart_delay=cfg.worker_restart_delay).run()
+    else:
+        face_detectors = startup.initialize([get_detector_size(source) for _, source in get_sources()],
+                                            embTable.fill_embedding_table_from_files)
+        embTable.print_embeddings_table()
+        th = Thread(target=loop, args=(None, None, face_detectors))
+        th2 = Thread(target=uploads, args=())
+        th.start()
+        th2.start()
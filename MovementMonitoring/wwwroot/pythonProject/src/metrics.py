@@ -0,0 +1,252 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, description: str, label_names=()):
+        """
+        Base of the metrics. A metric keeps a value per combination of label values. The value of a label
+        combination can be computed by a function at scrape time, so e.g. a queue depth costs nothing between the
+        scrapes.
+
+        :param name: name of the metric
+        :param description: help text of the metric
+        :param label_names: names of the labels
+        """
+
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._functions = {}
+
+    def set_function(self, function, **labels):
+        """
+        Computes the value of the labels by the function at scrape time.
+
+        :param function: function without arguments that returns a number
+        """
+
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def remove(self, **labels):
+        """
+        Removes the value and the function of the labels, e.g. of a stopped source.
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+            self._functions.pop(key, None)
+
+    def render(self):
+        """
+        :return: lines of the metric in the Prometheus text format
+        """
+
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, value in values.items():
+            lines.extend(self._render_value(key, value))
+        for key, function in functions.items():
+            # noinspection PyBroadException
+            try:
+                lines.append(f'{self.name}{self._format_labels(key)} {_format_number(function())}')
+            except Exception as e:
+                print(f'Warning> Metric {self.name} was not computed: {e!r}')
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{self._format_labels(key)} {_format_number(value)}']
+
+    def _key(self, labels: dict):
+        if len(labels) != len(self.label_names):
+            raise ValueError(f'Metric {self.name} has labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _format_labels(self, key, extra: str = None):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key)]
+        if extra is not None:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if len(pairs) > 0 else ''
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names=(), buckets=latency_buckets):
+        """
+        Histogram of observed values with cumulative buckets, e.g. of latencies in seconds.
+
+        :param buckets: sorted upper bounds of the buckets, the +Inf bucket is added
+        """
+
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the with block in seconds.
+        """
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key, value):
+        counts, total, count = value[0], value[1], value[2]
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            le = 'le="+Inf"' if bound == math.inf else f'le="{_format_number(bound)}"'
+            lines.append(f'{self.name}_bucket{self._format_labels(key, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{self._format_labels(key)} {_format_number(total)}')
+        lines.append(f'{self.name}_count{self._format_labels(key)} {count}')
+        return lines
+
+
+def counter(name: str, description: str, label_names=()):
+    """
+    :return: registered counter of the name, it is created on the first call
+    """
+
+    return __register(Counter, name, description, label_names)
+
+
+def gauge(name: str, description: str, label_names=()):
+    """
+    :return: registered gauge of the name, it is created on the first call
+    """
+
+    return __register(Gauge, name, description, label_names)
+
+
+def histogram(name: str, description: str, label_names=(), buckets=latency_buckets):
+    """
+    :return: registered histogram of the name, it is created on the first call
+    """
+
+    return __register(Histogram, name, description, label_names, buckets=buckets)
+
+
+def render():
+    """
+    :return: all registered metrics in the Prometheus text format
+    """
+
+    with __lock:
+        metrics = list(__metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def start_server(port: int, host: str = '127.0.0.1'):
+    """
+    Serves the metrics at http://host:port/metrics in a daemon thread. The server only works while it is scraped.
+
+    :param port: port of the endpoint
+    :param host: address the server listens on. Default only local connections
+    :return: ThreadingHTTPServer object or None if the port could not be opened
+    """
+
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f'Error> Metrics endpoint on {host}:{port} was not started: {e!r}')
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True).start()
+    print(f'Info> Metrics are served at http://{host}:{port}/metrics.')
+    return server
+
+
+def __register(metric_type, name: str, description: str, label_names, **kwargs):
+    with __lock:
+        metric = __metrics.get(name)
+        if metric is None:
+            metric = metric_type(name, description, label_names, **kwargs)
+            __metrics[name] = metric
+        elif not isinstance(metric, metric_type) or metric.label_names != tuple(label_names):
+            raise ValueError(f'Metric {name} is already registered with another type or labels')
+        return metric
+
+
+def _format_number(value: float):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+__metrics: dict[str, Metric] = {}
+__lock = threading.Lock()
@@ -0,0 +1,67 @@
+import time
+
+import cv2
+import numpy
+
+
+class MotionGate:
+    def __init__(self, threshold: int = 25, min_area: float = 0.002, width: int = 160, learning_rate: float = 0.05,
+                 max_skip_time: float = 5.0, hold_time: float = 1.0):
+        """
+        Cheap change detector that decides whether a frame is worth the face detection. A downscaled grayscale
+        frame is compared with a running average background of the source.
+
+        :param threshold: grayscale difference from 0 to 255 at which a pixel counts as changed
+        :param min_area: fraction of changed pixels from 0 to 1 at which the frame is processed
+        :param width: width in pixels of the downscaled frame
+        :param learning_rate: speed from 0 to 1 with which the background follows the scene
+        :param max_skip_time: seconds after which a frame is processed even if nothing has changed
+        :param hold_time: seconds during which frames are processed after faces were found
+        """
+
+        self.__threshold = threshold
+        self.__min_area = min_area
+        self.__width = width
+        self.__learning_rate = learning_rate
+        self.__max_skip_time = max_skip_time
+        self.__hold_time = hold_time
+        self.__background = None
+        self.__last_process_time = 0.0
+        self.__hold_until = 0.0
+        self.processed_count = 0
+        self.skipped_count = 0
+
+    def should_process(self, frame: numpy.ndarray):
+        """
+        Updates the background with the frame and decides whether the frame should be processed.
+
+        :param frame: BGR frame
+        :return: True if the frame has changed enough, False if it can be skipped
+        """
+
+        height = max(1, round(frame.shape[0] * self.__width / frame.shape[1]))
+        gray = cv2.cvtColor(cv2.resize(frame, (self.__width, height), interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        now = time.monotonic()
+        if self.__background is None or self.__background.shape != gray.shape:
+            self.__background = gray.astype(numpy.float32)
+            changed = 1.0
+        else:
+            difference = cv2.absdiff(gray, cv2.convertScaleAbs(self.__background))
+            changed = numpy.count_nonzero(difference > self.__threshold) / difference.size
+            cv2.accumulateWeighted(gray, self.__background, self.__learning_rate)
+        if changed >= self.__min_area or now < self.__hold_until or \
+                now - self.__last_process_time >= self.__max_skip_time:
+            self.__last_process_time = now
+            self.processed_count += 1
+            return True
+        self.skipped_count += 1
+        return False
+
+    def hold(self):
+        """
+        Keeps processing the next frames for hold_time seconds. Called when faces were found.
+        """
+
+        self.__hold_until = time.monotonic() + self.__hold_time
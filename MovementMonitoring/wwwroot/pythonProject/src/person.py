@@ -1,23 +1,51 @@
+import cv2
 import numpy
 import torch
 
 
 class PersonData:
+    __slots__ = ('embedding', 'path', '__face_image')
+
     def __init__(self, embedding=None, path=None, face_image=None):
         """
-        Class describing a person data.
+        Class describing a person data. Gallery person data keep only the embedding row and the path, the face
+        image is read from the path when it is requested.
 
         :param embedding: embedding from photo of this person
         :param path: path from proto of this person
-        :param face_image: face image of this person
+        :param face_image: face image of this person, kept until release_face_image is called
         """
 
         self.embedding = embedding
         self.path = path
-        self.face_image = face_image
+        self.__face_image = face_image
+
+    @property
+    def face_image(self):
+        """Face image of this person, read from the path if it is not in memory."""
+
+        if self.__face_image is not None:
+            return self.__face_image
+        if self.path:
+            return cv2.imread(self.path)
+        return None
+
+    @face_image.setter
+    def face_image(self, face_image: numpy.ndarray):
+        self.__face_image = face_image
+
+    def release_face_image(self):
+        """
+        Drops the face image from memory if it can be read from the path.
+        """
+
+        if self.path:
+            self.__face_image = None
 
 
 class Person:
+    __slots__ = ('guid', 'data')
+
     def __init__(self, guid: str):
         """
         Class describing a person.
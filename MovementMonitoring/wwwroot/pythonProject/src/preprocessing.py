@@ -0,0 +1,53 @@
+import threading
+
+import numpy
+import torch
+import torch.nn.functional as f
+
+
+class Preprocessor:
+    def __init__(self, face_size):
+        """
+        Converts batches of aligned BGR faces to the normalized RGB input of the backbone. The faces are stacked
+        into a reused uint8 buffer and resized, cropped and normalized as one batch: the face is resized to 128/112
+        of its size as in the training of the backbone, the center crop of the face size is taken and the values
+        are scaled to [-1, 1]. The resize runs on the uint8 batch on CPU, which gives the values of the PIL resize,
+        only the cropped uint8 batch is moved to the device.
+
+        :param face_size: size of the aligned faces and of the backbone input
+        """
+
+        self.__face_size = (face_size[0], face_size[1])
+        self.__resize_size = (int(128 * face_size[0] / 112), int(128 * face_size[0] / 112))
+        self.__crop_offset = ((self.__resize_size[0] - face_size[0]) // 2,
+                              (self.__resize_size[1] - face_size[1]) // 2)
+        self.__buffers = threading.local()
+
+    def __call__(self, images, device: torch.device = None):
+        """
+        :param images: list of (H, W, 3) uint8 BGR faces of the face size
+        :param device: device of the batch. Default CPU
+        :return: (N, 3, H, W) float tensor
+        """
+
+        batch = torch.from_numpy(self.__stack(images)).permute(0, 3, 1, 2)
+        if self.__resize_size != self.__face_size:
+            batch = f.interpolate(batch, size=self.__resize_size, mode='bilinear', align_corners=False)
+            top, left = self.__crop_offset
+            batch = batch[:, :, top:top + self.__face_size[0], left:left + self.__face_size[1]]
+        batch = batch.to(device or torch.device('cpu')).flip(1).float()
+        return batch.div_(127.5).sub_(1.0).contiguous()
+
+    def __stack(self, images):
+        """
+        :return: (N, H, W, 3) view of the uint8 buffer of the thread holding the images
+        """
+
+        count = len(images)
+        buffer = getattr(self.__buffers, 'buffer', None)
+        if buffer is None or buffer.shape[0] < count:
+            buffer = numpy.empty((count, self.__face_size[0], self.__face_size[1], 3), dtype=numpy.uint8)
+            self.__buffers.buffer = buffer
+        numpy.stack(images, out=buffer[:count])
+        return buffer[:count]
+
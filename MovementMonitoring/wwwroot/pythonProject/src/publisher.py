@@ -0,0 +1,237 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+import pika
+import pika.exceptions
+
+from spool import Spool
+
+
+class Publisher(threading.Thread):
+    def __init__(self, host: str = 'localhost', routing_key: str = 'validator', queue_size: int = 1024,
+                 batch_size: int = 64, confirms: bool = False, reconnect_min_delay: float = 0.5,
+                 reconnect_max_delay: float = 30.0, spool: Spool = None, high_water: int = 512):
+        """
+        Owns the RabbitMQ connection and publishes messages queued by any thread. Messages are serialized and
+        published in batches by this thread, so publishing never blocks the caller.
+
+        With a spool, messages are appended to it while the broker is unreachable or more than high_water
+        messages are queued. Once spooling has started, new messages go to the spool until it is drained, so
+        the messages are published in order. Spooled messages are delivered at least once, a message may be
+        published again if the connection is lost during a drained batch.
+
+        :param host: host of the broker
+        :param routing_key: queue to which messages are published
+        :param queue_size: maximal number of messages waiting to be published
+        :param batch_size: maximal number of messages published before the connection events are processed
+        :param confirms: wait for the broker to confirm every message
+        :param reconnect_min_delay: first delay in seconds before reconnecting to the broker
+        :param reconnect_max_delay: maximal delay in seconds before reconnecting to the broker
+        :param spool: spool that buffers messages on disk or None to keep them in memory only
+        :param high_water: number of queued messages from which new messages are spooled
+        """
+
+        super().__init__(name='Publisher', daemon=True)
+        self.__host = host
+        self.__routing_key = routing_key
+        self.__batch_size = batch_size
+        self.__confirms = confirms
+        self.__reconnect_min_delay = reconnect_min_delay
+        self.__reconnect_max_delay = reconnect_max_delay
+        self.__spool = spool
+        self.__high_water = high_water
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__pending: deque[bytes] = deque()
+        self.__connection = None
+        self.__channel = None
+        self.__stopped = threading.Event()
+        self.__lock = threading.Lock()
+        self.published_count = 0
+        self.dropped_count = 0
+        self.spooled_count = 0
+        self.reconnect_count = 0
+        self.__was_connected = False
+
+    @property
+    def queue_depth(self):
+        """Number of messages waiting to be published in memory."""
+
+        return self.__queue.qsize() + len(self.__pending)
+
+    @property
+    def spool_depth(self):
+        """Number of messages waiting to be published in the spool."""
+
+        return self.__spool.pending_count if self.__spool is not None else 0
+
+    @property
+    def connected(self):
+        """True if the connection to the broker is open."""
+
+        return self.__connection is not None and self.__connection.is_open
+
+    def publish(self, message: dict):
+        """
+        Queues the message for publishing. The message is dropped if the queue is full.
+
+        :param message: message that is serialized to JSON
+        :return: True if the message was queued, False if it was dropped
+        """
+
+        try:
+            self.__queue.put_nowait(message)
+            return True
+        except queue.Full:
+            with self.__lock:
+                self.dropped_count += 1
+            print(f'Warning> Publisher queue is full, message of source {message.get("SourceId")} was dropped!')
+            return False
+
+    def stop(self, timeout: float = None):
+        """
+        Publishes the queued messages if the broker is reachable, otherwise spools them, and closes the
+        connection. Messages left in the spool are published after the next start.
+
+        :param timeout: maximal time in seconds to wait for the publisher thread
+        """
+
+        self.__stopped.set()
+        self.__queue.put(None)
+        self.join(timeout)
+
+    def run(self):
+        delay = self.__reconnect_min_delay
+        next_connect_time = 0.0
+        stop = False
+        while True:
+            if not self.connected and time.monotonic() >= next_connect_time:
+                if self.__connect():
+                    delay = self.__reconnect_min_delay
+                else:
+                    next_connect_time = time.monotonic() + delay
+                    delay = min(delay * 2, self.__reconnect_max_delay)
+            try:
+                if self.connected:
+                    busy = len(self.__pending) > 0 or (self.__spool is not None and not self.__spool.empty)
+                    stop = self.__collect(0.0 if busy or stop else 1.0) or stop
+                    self.__flush()
+                    self.__drain()
+                elif self.__spool is not None:
+                    stop = self.__collect(0.0 if stop else max(0.0, next_connect_time - time.monotonic())) or stop
+                elif not stop:
+                    stop = self.__stopped.wait(max(0.0, next_connect_time - time.monotonic()))
+            except pika.exceptions.AMQPError as e:
+                print(f'Error> Publishing to {self.__host} failed: {e!r}. Reconnecting...')
+                self.__close()
+                self.__spill()
+            if self.__spool is not None:
+                self.__spool.sync_if_due()
+            if stop and (not self.connected or self.__queue.empty()):
+                self.__spill()
+                if self.__spool is not None:
+                    self.__spool.close()
+                self.__close()
+                return
+
+    def __collect(self, timeout: float):
+        """
+        Moves queued messages to the pending batch or to the spool.
+
+        :param timeout: time in seconds to wait for the first message
+        :return: True if the publisher was stopped
+        """
+
+        try:
+            message = self.__queue.get(timeout=timeout) if timeout > 0 else self.__queue.get_nowait()
+        except queue.Empty:
+            return False
+        collected = 0
+        while True:
+            if message is None:
+                return True
+            body = json.dumps(message, separators=(',', ':'), default=str).encode('utf-8')
+            if self.__spool is not None and (not self.connected or not self.__spool.empty or
+                                             self.__queue.qsize() >= self.__high_water):
+                self.__spill()
+                self.__spool.append(body)
+                self.spooled_count += 1
+            else:
+                self.__pending.append(body)
+            collected += 1
+            if collected >= self.__batch_size:
+                return False
+            try:
+                message = self.__queue.get_nowait()
+            except queue.Empty:
+                return False
+
+    def __flush(self):
+        """
+        Publishes the pending batch. Messages stay pending until they are published, so a batch interrupted by
+        a lost connection is published again after reconnecting.
+        """
+
+        while len(self.__pending) > 0:
+            self.__channel.basic_publish(exchange='', routing_key=self.__routing_key, body=self.__pending[0])
+            self.__pending.popleft()
+            self.published_count += 1
+        self.__connection.process_data_events(time_limit=0)
+
+    def __drain(self):
+        """
+        Publishes the next batch of spooled messages. The batch is removed from the spool after all its
+        messages were published.
+        """
+
+        if self.__spool is None or self.__spool.empty or len(self.__pending) > 0:
+            return
+        bodies = self.__spool.read(self.__batch_size)
+        for body in bodies:
+            self.__channel.basic_publish(exchange='', routing_key=self.__routing_key, body=body)
+        self.__spool.commit()
+        self.published_count += len(bodies)
+        if self.__spool.empty:
+            print(f'Info> Spool has been drained.')
+
+    def __spill(self):
+        """
+        Moves the pending batch to the spool. Pending messages are older than the spooled ones, because new
+        messages are not kept pending while the spool is not empty.
+        """
+
+        if self.__spool is None:
+            return
+        while len(self.__pending) > 0:
+            self.__spool.append(self.__pending.popleft())
+            self.spooled_count += 1
+
+    def __connect(self):
+        # noinspection PyBroadException
+        try:
+            self.__connection = pika.BlockingConnection(pika.ConnectionParameters(self.__host))
+            self.__channel = self.__connection.channel()
+            self.__channel.queue_declare(queue=self.__routing_key)
+            if self.__confirms:
+                self.__channel.confirm_delivery()
+            if self.__was_connected:
+                self.reconnect_count += 1
+                print(f'Info> Publisher reconnected to {self.__host}.')
+            self.__was_connected = True
+            return True
+        except Exception as e:
+            print(f'Warning> Publisher can not connect to {self.__host}: {e!r}')
+            self.__close()
+            return False
+
+    def __close(self):
+        # noinspection PyBroadException
+        try:
+            if self.__connection is not None and self.__connection.is_open:
+                self.__connection.close()
+        except Exception:
+            pass
+        self.__connection = None
+        self.__channel = None
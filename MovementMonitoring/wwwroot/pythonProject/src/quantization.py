@@ -0,0 +1,62 @@
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+import inferenceEngine
+from backbone import Backbone
+
+
+def quantize_linear(backbone: Backbone):
+    """
+    Returns a copy of the backbone with the output Linear layer dynamically quantized to int8. The weights of the
+    Linear layer are stored in int8 and its input is quantized on every call, the convolutions stay in float.
+
+    :param backbone: backbone in eval mode on CPU
+    :return: quantized backbone
+    """
+
+    model = inferenceEngine.fold_batch_norms(backbone).cpu()
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(backbone: Backbone, calibration_batches, backend: str = 'x86'):
+    """
+    Returns a copy of the backbone with the convolutions statically quantized to int8 and the output Linear layer
+    dynamically quantized. The ranges of the activations are observed on the calibration batches, which should be
+    preprocessed gallery faces, so the quantization fits the faces the backbone really sees.
+
+    :param backbone: backbone in eval mode on CPU
+    :param calibration_batches: iterable of preprocessed (N, 3, H, W) tensors
+    :param backend: quantized engine of torch, 'x86' or 'fbgemm' on servers, 'qnnpack' on ARM
+    :return: quantized backbone
+    """
+
+    torch.backends.quantized.engine = backend
+    model = inferenceEngine.fold_batch_norms(backbone).cpu()
+    qconfig_mapping = get_default_qconfig_mapping(backend).set_object_type(nn.Linear, None)
+    calibrated = 0
+    prepared = None
+    with torch.no_grad():
+        for batch in calibration_batches:
+            if prepared is None:
+                prepared = prepare_fx(model, qconfig_mapping, example_inputs=(batch[:1].cpu(),))
+            prepared(batch.cpu())
+            calibrated += batch.shape[0]
+    if calibrated == 0:
+        raise ValueError('Static quantization needs at least one calibration image')
+    print(f'Info> Backbone was calibrated on {calibrated} images.')
+    return quantize_dynamic(convert_fx(prepared), {nn.Linear}, dtype=torch.qint8)
+
+
+def get_calibration_batches(images, transform, batch_size: int):
+    """
+    Yields the preprocessed calibration images in batches.
+
+    :param images: list of aligned face images
+    :param transform: function(list of images) that returns a (N, 3, H, W) tensor
+    :param batch_size: number of images in a batch
+    """
+
+    for start in range(0, len(images), batch_size):
+        yield transform(images[start:start + batch_size])
@@ -0,0 +1,168 @@
+import math
+
+import cv2
+import numpy
+
+from detectionService import DetectionService
+from faceDetector import FaceDetector
+
+
+class RoiDetector:
+    def __init__(self, face_detector: FaceDetector | DetectionService, zones, tile: int = None,
+                 overlap: float = 0.2, merge_threshold: float = 0.5):
+        """
+        Detects faces only in the zones of interest of a source. Every zone is cropped from the frame by its
+        bounding rectangle and, if tile is set, split into overlapping tiles of at most tile pixels, so a large
+        frame is not downscaled to the detector size. The crops are detected as one batch, the boxes are moved
+        back to frame coordinates, the duplicates of faces on the borders of tiles and zones are merged, and the
+        faces of a polygon zone whose center lies outside the polygon are dropped.
+
+        :param face_detector: face detector or detection service of the source
+        :param zones: list of rectangles [x_min, y_min, x_max, y_max] or polygons [[x, y], ...] in pixels
+        :param tile: maximal width and height of a crop in pixels. Default the zone is not split
+        :param overlap: part of the tile size shared by neighbouring tiles
+        :param merge_threshold: part of the smaller box that must be covered by the larger one to merge them
+        """
+
+        self.__face_detector = face_detector
+        self.__zones = [_parse_zone(zone) for zone in zones]
+        self.__tile = tile
+        self.__overlap = overlap
+        self.__merge_threshold = merge_threshold
+        self.__frame_shape = None
+        self.__regions = []
+
+    @property
+    def region_count(self):
+        """Number of crops detected per frame, if the zones lie inside the frame."""
+
+        return sum(len(self.__split(rectangle)) for rectangle, _ in self.__zones)
+
+    def detect_all_faces_with_boxes(self, image):
+        """
+        Return lists of all found faces in the zones and of their bounding boxes in frame coordinates.
+
+        :param image: input image
+        :return: list of all found faces and list of their bounding boxes [x_min, y_min, x_max, y_max],
+        None, None if no face was found
+        """
+
+        regions = self.__get_regions(image.shape)
+        crops = [image[y_min:y_max, x_min:x_max] for (x_min, y_min, x_max, y_max), _ in regions]
+        if len(crops) == 0:
+            return None, None
+        if isinstance(self.__face_detector, DetectionService):
+            futures = [self.__face_detector.submit(crop) for crop in crops]
+            results = [future.result() for future in futures]
+        else:
+            results = self.__face_detector.detect_batch(crops)
+        boxes = []
+        for ((x_min, y_min, _, _), polygon), (_, crop_boxes) in zip(regions, results):
+            for box in crop_boxes or []:
+                box = numpy.asarray(box, dtype=numpy.int32) + [x_min, y_min, x_min, y_min]
+                if polygon is None or _contains(polygon, box):
+                    boxes.append(box)
+        boxes = merge_boxes(boxes, self.__merge_threshold)
+        if len(boxes) == 0:
+            return None, None
+        return [FaceDetector.extract_face(image, box) for box in boxes], boxes
+
+    def __get_regions(self, shape):
+        """
+        :return: list of (crop rectangle, polygon or None) tuples of the frame, computed once per frame size
+        """
+
+        if shape[:2] != self.__frame_shape:
+            height, width = shape[:2]
+            regions = []
+            for (x_min, y_min, x_max, y_max), polygon in self.__zones:
+                rectangle = (max(0, x_min), max(0, y_min), min(width, x_max), min(height, y_max))
+                if rectangle[2] > rectangle[0] and rectangle[3] > rectangle[1]:
+                    regions.extend((region, polygon) for region in self.__split(rectangle))
+            self.__frame_shape = shape[:2]
+            self.__regions = regions
+        return self.__regions
+
+    def __split(self, rectangle):
+        """
+        :return: list of the tiles of the rectangle
+        """
+
+        x_min, y_min, x_max, y_max = rectangle
+        return [(x_start, y_start, x_end, y_end)
+                for y_start, y_end in _split_range(y_min, y_max, self.__tile, self.__overlap)
+                for x_start, x_end in _split_range(x_min, x_max, self.__tile, self.__overlap)]
+
+
+def merge_boxes(boxes, threshold: float = 0.5):
+    """
+    Merges boxes of the same face found in several overlapping crops. Larger boxes are kept first, a box is dropped
+    if a kept box covers more than threshold of its area, so a face cut by the border of a tile is replaced by the
+    whole face found in the neighbouring tile.
+
+    :param boxes: list of boxes [x_min, y_min, x_max, y_max]
+    :param threshold: part of the smaller box that must be covered to drop it
+    :return: list of the kept boxes
+    """
+
+    if len(boxes) < 2:
+        return list(boxes)
+    boxes = numpy.asarray(boxes)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = numpy.argsort(-areas, kind='stable')
+    kept = []
+    for index in order:
+        if len(kept) > 0:
+            others = boxes[kept]
+            width = numpy.minimum(others[:, 2], boxes[index, 2]) - numpy.maximum(others[:, 0], boxes[index, 0])
+            height = numpy.minimum(others[:, 3], boxes[index, 3]) - numpy.maximum(others[:, 1], boxes[index, 1])
+            intersection = numpy.clip(width, 0, None) * numpy.clip(height, 0, None)
+            if numpy.any(intersection > threshold * max(areas[index], 1)):
+                continue
+        kept.append(index)
+    return [boxes[index] for index in sorted(kept)]
+
+
+def get_detection_size(roi: dict, res: int):
+    """
+    :param roi: ROI settings of a source
+    :param res: max_size of the detector of the source without ROI
+    :return: max_size of the detector of the source, the tile size if the zones are tiled
+    """
+
+    return roi.get('tile') or res
+
+
+def _parse_zone(zone):
+    """
+    :return: tuple of the bounding rectangle of the zone and its polygon, None for a rectangle zone
+    """
+
+    if len(zone) == 4 and all(isinstance(value, (int, float)) for value in zone):
+        return tuple(int(value) for value in zone), None
+    polygon = numpy.asarray(zone, dtype=numpy.float32).reshape(-1, 1, 2)
+    x, y, width, height = cv2.boundingRect(polygon)
+    return (x, y, x + width, y + height), polygon
+
+
+def _contains(polygon: numpy.ndarray, box):
+    """
+    :return: True if the center of the box lies inside the polygon or on its border
+    """
+
+    center = (float(box[0] + box[2]) / 2, float(box[1] + box[3]) / 2)
+    return cv2.pointPolygonTest(polygon, center, False) >= 0
+
+
+def _split_range(start: int, end: int, tile: int, overlap: float):
+    """
+    :return: list of (start, end) tuples of evenly spaced tiles covering the range
+    """
+
+    length = end - start
+    if tile is None or length <= tile:
+        return [(start, end)]
+    step = max(1, int(tile * (1 - overlap)))
+    count = math.ceil((length - tile) / step) + 1
+    return [(start + round(index * (length - tile) / (count - 1)),
+             start + round(index * (length - tile) / (count - 1)) + tile) for index in range(count)]
@@ -0,0 +1,235 @@
+import json
+import os
+import os.path as osp
+import struct
+import time
+import zlib
+
+
+class Spool:
+    __header = struct.Struct('<II')
+
+    def __init__(self, path: str, segment_size: int = 16 * 1024 * 1024, fsync_batch: int = 100,
+                 fsync_interval: float = 0.5):
+        """
+        Append-only message queue on disk. Messages are appended to segment files as records of length, crc32
+        and body, and are read back in the order they were appended. The position of the first unread message
+        is kept in a cursor file, so the messages survive a restart. Segments that were read completely are
+        deleted. Not thread-safe, the spool is used by one thread.
+
+        :param path: folder of the segment files
+        :param segment_size: size in bytes after which a new segment file is started
+        :param fsync_batch: number of appended messages after which the segment is synced to disk
+        :param fsync_interval: time in seconds after which appended messages are synced to disk
+        """
+
+        self.__path = path
+        self.__segment_size = segment_size
+        self.__fsync_batch = fsync_batch
+        self.__fsync_interval = fsync_interval
+        self.__cursor_path = osp.join(path, 'cursor.json')
+        os.makedirs(path, exist_ok=True)
+        self.__segments = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith('.seg'))
+        self.__read_segment, self.__read_offset = self.__load_cursor()
+        self.__read_file = None
+        self.__next_position = (self.__read_segment, self.__read_offset)
+        self.__read_count = 0
+        self.__write_file = None
+        self.__write_segment = None
+        self.pending_count = self.__count_pending()
+        self.__unsynced_count = 0
+        self.__last_sync_time = time.monotonic()
+        if self.pending_count > 0:
+            print(f'Info> Spool {path} contains {self.pending_count} messages to be published.')
+
+    @property
+    def empty(self):
+        """True if all appended messages were read and committed."""
+
+        return self.pending_count == 0
+
+    def append(self, body: bytes):
+        """
+        Appends the message to the spool. The message is synced to disk with the next batch.
+
+        :param body: message
+        """
+
+        if self.__write_file is None or self.__write_file.tell() >= self.__segment_size:
+            self.__open_segment()
+        self.__write_file.write(self.__header.pack(len(body), zlib.crc32(body)) + body)
+        self.pending_count += 1
+        self.__unsynced_count += 1
+        self.sync_if_due()
+
+    def sync_if_due(self):
+        """
+        Syncs the appended messages to disk if the batch is full or the interval has passed.
+        """
+
+        if self.__unsynced_count > 0 and (self.__unsynced_count >= self.__fsync_batch or
+                                          time.monotonic() - self.__last_sync_time >= self.__fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """
+        Syncs the appended messages to disk.
+        """
+
+        if self.__write_file is not None:
+            self.__write_file.flush()
+            os.fsync(self.__write_file.fileno())
+        self.__unsynced_count = 0
+        self.__last_sync_time = time.monotonic()
+
+    def read(self, max_count: int):
+        """
+        Reads the next messages without removing them. The same messages are read again until commit is called.
+
+        :param max_count: maximal number of messages
+        :return: list of messages
+        """
+
+        if self.__write_file is not None:
+            self.__write_file.flush()
+        bodies = []
+        segment, offset = self.__read_segment, self.__read_offset
+        while len(bodies) < max_count and len(bodies) < self.pending_count:
+            body, segment, offset = self.__read_record(segment, offset)
+            if body is None:
+                self.__drop_unreadable(len(bodies))
+                break
+            bodies.append(body)
+        self.__next_position = (segment, offset)
+        self.__read_count = len(bodies)
+        return bodies
+
+    def commit(self):
+        """
+        Removes the messages returned by the last read from the spool.
+        """
+
+        self.__read_segment, self.__read_offset = self.__next_position
+        self.pending_count -= self.__read_count
+        self.__read_count = 0
+        for segment in [segment for segment in self.__segments if segment < self.__read_segment]:
+            self.__remove_segment(segment)
+        tmp_path = self.__cursor_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'segment': self.__read_segment, 'offset': self.__read_offset}, file)
+        os.replace(tmp_path, self.__cursor_path)
+
+    def close(self):
+        """
+        Syncs the appended messages and closes the segment files.
+        """
+
+        self.sync()
+        for file in (self.__write_file, self.__read_file):
+            if file is not None:
+                file.close()
+        self.__write_file = None
+        self.__read_file = None
+
+    def __read_record(self, segment: int, offset: int):
+        """
+        Reads the record at the position. A torn or corrupted record ends its segment.
+
+        :return: tuple of the message or None and the position of the next record
+        """
+
+        while True:
+            if segment not in self.__segments:
+                following = [index for index in self.__segments if index > segment]
+                if len(following) == 0:
+                    return None, segment, offset
+                segment, offset = following[0], 0
+            file = self.__get_read_file(segment)
+            file.seek(offset)
+            header = file.read(self.__header.size)
+            if len(header) == self.__header.size:
+                length, crc = self.__header.unpack(header)
+                body = file.read(length)
+                if len(body) == length and zlib.crc32(body) == crc:
+                    return body, segment, offset + self.__header.size + length
+                print(f'Warning> Spool segment {segment} has a corrupted record at {offset}, '
+                      f'the rest of the segment is skipped!')
+            elif len(header) > 0:
+                print(f'Warning> Spool segment {segment} has a torn record at {offset}!')
+            if segment == self.__write_segment:
+                return None, segment, offset
+            segment, offset = segment + 1, 0
+
+    def __drop_unreadable(self, readable: int):
+        """
+        Called when the records end before all pending messages were read. The messages behind a torn or corrupted
+        record can not be read, so they are removed from pending_count, otherwise the spool would never become
+        empty. The write segment is closed, so new messages are appended to a new segment and not behind the bad
+        record.
+
+        :param readable: number of messages that could be read
+        """
+
+        print(f'Warning> Spool {self.__path} lost {self.pending_count - readable} messages behind a bad record!')
+        self.pending_count = readable
+        if self.__write_file is not None:
+            self.sync()
+            self.__write_file.close()
+            self.__write_file = None
+            self.__write_segment = None
+
+    def __get_read_file(self, segment: int):
+        if self.__read_file is None or self.__read_file.name != self.__segment_path(segment):
+            if self.__read_file is not None:
+                self.__read_file.close()
+            self.__read_file = open(self.__segment_path(segment), 'rb')
+        return self.__read_file
+
+    def __open_segment(self):
+        """
+        Starts a new segment. Appending never continues an existing segment, whose end may be torn.
+        """
+
+        if self.__write_file is not None:
+            self.sync()
+            self.__write_file.close()
+        self.__write_segment = max(self.__segments[-1] + 1 if len(self.__segments) > 0 else 0,
+                                   self.__read_segment + 1)
+        self.__write_file = open(self.__segment_path(self.__write_segment), 'ab')
+        self.__segments.append(self.__write_segment)
+
+    def __remove_segment(self, segment: int):
+        if self.__read_file is not None and self.__read_file.name == self.__segment_path(segment):
+            self.__read_file.close()
+            self.__read_file = None
+        self.__segments.remove(segment)
+        # noinspection PyBroadException
+        try:
+            os.remove(self.__segment_path(segment))
+        except Exception as e:
+            print(f'Warning> Spool segment {segment} was not removed: {e!r}')
+
+    def __load_cursor(self):
+        # noinspection PyBroadException
+        try:
+            with open(self.__cursor_path, 'r') as file:
+                cursor = json.load(file)
+            return int(cursor['segment']), int(cursor['offset'])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'Warning> Spool cursor {self.__cursor_path} can not be read: {e!r}')
+        return (self.__segments[0] if len(self.__segments) > 0 else 0), 0
+
+    def __count_pending(self):
+        count = 0
+        segment, offset = self.__read_segment, self.__read_offset
+        while True:
+            body, segment, offset = self.__read_record(segment, offset)
+            if body is None:
+                break
+            count += 1
+        return count
+
+    def __segment_path(self, segment: int):
+        return osp.join(self.__path, f'{segment:012d}.seg')
@@ -0,0 +1,110 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import configuration as cfg
+import embedder as emb
+import detectorPool
+
+
+def load_configuration():
+    """
+    Loads the configuration file. Must be called before initialize.
+    """
+
+    with measure('configuration'):
+        cfg.load()
+
+
+def initialize(detector_sizes, load_gallery):
+    """
+    Loads the backbone weights, the face detectors and the gallery in parallel. The detectors share the weights
+    loaded by the first of them. The gallery loader takes cached embeddings without waiting for the backbone, it
+    waits for the backbone only for photos that must be embedded. Prints the timing report of the phases.
+
+    :param detector_sizes: max_size values of the face detectors to create
+    :param load_gallery: function that fills the embedding table
+    :return: dictionary of the created face detectors by their size
+    """
+
+    detector_sizes = sorted(set(detector_sizes))
+    with measure('initialization'):
+        with ThreadPoolExecutor(max_workers=len(detector_sizes) + 2, thread_name_prefix='Startup') as executor:
+            embedder = executor.submit(__run_phase, 'embedder', emb.load)
+            detectors = {size: executor.submit(__run_phase, f'detector {size}', detectorPool.get_detector, size)
+                         for size in detector_sizes}
+            gallery = executor.submit(__run_phase, 'gallery', load_gallery)
+            embedder.result()
+            gallery.result()
+            detectors = {size: future.result() for size, future in detectors.items()}
+    print_report()
+    return detectors
+
+
+@contextmanager
+def measure(phase: str):
+    """
+    Records the duration of the with block as a startup phase.
+
+    :param phase: name of the phase
+    """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def record(phase: str, seconds: float):
+    """
+    Records the duration of a startup phase.
+
+    :param phase: name of the phase
+    :param seconds: duration in seconds
+    """
+
+    with __lock:
+        __phases.append((phase, seconds))
+
+
+def mark(event: str):
+    """
+    Records the time of an event since the start once, e.g. the first processed frame.
+
+    :param event: name of the event
+    """
+
+    with __lock:
+        if event in __events:
+            return
+        __events[event] = time.perf_counter() - __started
+    print(f'Info> Startup: {event} after {__events[event]:.3f} s.')
+
+
+def print_report():
+    """
+    Prints the durations of the startup phases and the events recorded so far.
+    """
+
+    with __lock:
+        phases = list(__phases)
+        events = dict(__events)
+    print('Info> Startup report:')
+    for phase, seconds in phases:
+        print(f'    {phase:<24}{seconds:8.3f} s')
+    for event, seconds in events.items():
+        print(f'    {event:<24}{seconds:8.3f} s since start')
+    print(f'    {"total":<24}{time.perf_counter() - __started:8.3f} s since start')
+
+
+def __run_phase(phase: str, function, *args, **kwargs):
+    with measure(phase):
+        return function(*args, **kwargs)
+
+
+__started = time.perf_counter()
+__phases: list[tuple[str, float]] = []
+__events: dict[str, float] = {}
+__lock = threading.Lock()
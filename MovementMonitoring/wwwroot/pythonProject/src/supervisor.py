@@ -0,0 +1,180 @@
+import multiprocessing as mp
+import os
+import os.path as osp
+import queue
+import time
+from threading import Thread
+
+import torch
+
+import configuration as cfg
+import embeddingsTable as embTable
+import metrics
+import startup
+
+
+class Supervisor:
+    def __init__(self, sources, worker_count: int, restart_delay: float = 1.0):
+        """
+        Runs the validation of the sources in worker processes, each with its own face detectors, embedder and
+        embedding table. Sources are assigned to the workers round-robin. Photos added to the gallery by one
+        worker are forwarded to the others, so all workers search the same gallery. A crashed worker is
+        restarted and loads the gallery files again. Photos are written to the files asynchronously, so the
+        supervisor keeps the forwarded photos whose files do not exist yet and sends them to a restarted worker.
+
+        With cfg.gallery_shared the supervisor loads the gallery into a memory-mapped store and is its single
+        writer. Workers map the store instead of loading their own copy and send their photos to the supervisor,
+        which appends them to the store.
+
+        :param sources: list of (source id, source) tuples
+        :param worker_count: number of worker processes
+        :param restart_delay: time in seconds before a crashed worker is restarted
+        """
+
+        worker_count = max(1, min(worker_count, len(sources)))
+        self.__groups = [sources[index::worker_count] for index in range(worker_count)]
+        self.__restart_delay = restart_delay
+        self.__context = mp.get_context('spawn')
+        self.__updates = self.__context.Queue()
+        self.__workers: list = [None] * worker_count
+        self.__inboxes: list = [None] * worker_count
+        self.__failed_at: list[float] = [0.0] * worker_count
+        self.__unwritten: dict[str, tuple[str, object]] = {}
+        self.__pruned_at = 0.0
+        self.restart_count = 0
+
+    def run(self):
+        """
+        Starts the workers, forwards gallery updates between them and restarts crashed workers until the
+        process ends.
+        """
+
+        if cfg.gallery_shared:
+            with startup.measure('gallery'):
+                embTable.open_store(cfg.gallery_store_path, writable=True)
+                embTable.fill_embedding_table_from_files()
+            startup.print_report()
+        for index in range(len(self.__groups)):
+            self.__start_worker(index)
+        try:
+            while True:
+                try:
+                    sender, guid, rows = self.__updates.get(timeout=1.0)
+                    if cfg.gallery_shared:
+                        embTable.apply_update(guid, rows)
+                    else:
+                        self.__keep_unwritten(guid, rows)
+                        for index, inbox in enumerate(self.__inboxes):
+                            if index != sender:
+                                inbox.put((guid, rows))
+                except queue.Empty:
+                    pass
+                self.__prune_unwritten()
+                self.__check_workers()
+        finally:
+            for worker in self.__workers:
+                if worker is not None and worker.is_alive():
+                    worker.terminate()
+
+    def __check_workers(self):
+        for index, worker in enumerate(self.__workers):
+            if worker.is_alive():
+                continue
+            now = time.monotonic()
+            if self.__failed_at[index] == 0.0:
+                print(f'Error> Worker {index + 1} exited with code {worker.exitcode}, '
+                      f'it will be restarted in {self.__restart_delay} s.')
+                self.__failed_at[index] = now
+            elif now - self.__failed_at[index] >= self.__restart_delay:
+                self.__failed_at[index] = 0.0
+                self.restart_count += 1
+                self.__start_worker(index)
+
+    def __keep_unwritten(self, guid: str, rows):
+        """
+        Keeps the rows of the update whose files have not been written yet, a restarted worker would not find
+        them in the gallery files.
+
+        :param guid: guid of the person
+        :param rows: list of (embedding, path) tuples
+        """
+
+        for embedding, path in rows:
+            if path and not osp.exists(path):
+                self.__unwritten[path] = (guid, embedding)
+
+    def __prune_unwritten(self):
+        """
+        Forgets the kept rows whose files have been written since, at most once a second.
+        """
+
+        now = time.monotonic()
+        if now - self.__pruned_at < 1.0:
+            return
+        self.__pruned_at = now
+        for path in [path for path in self.__unwritten if osp.exists(path)]:
+            del self.__unwritten[path]
+
+    def __start_worker(self, index: int):
+        """
+        Starts the worker with a new inbox. The worker loads the gallery from the files. The kept rows whose files
+        did not exist before it started are queued in the inbox first, followed by the updates that arrive while
+        it loads. Rows that the worker has already loaded from the files are skipped by the worker.
+        """
+
+        inbox = self.__context.Queue()
+        if not cfg.gallery_shared:
+            self.__prune_unwritten()
+            rows_by_guid = {}
+            for path, (guid, embedding) in self.__unwritten.items():
+                rows_by_guid.setdefault(guid, []).append((embedding, path))
+            for guid, rows in rows_by_guid.items():
+                inbox.put((guid, rows))
+        worker = self.__context.Process(target=run_worker,
+                                        args=(index, self.__groups[index], inbox, self.__updates, index == 0),
+                                        name=f'Worker-{index + 1}')
+        worker.start()
+        self.__inboxes[index] = inbox
+        self.__workers[index] = worker
+        source_ids = [source_id for source_id, _ in self.__groups[index]]
+        print(f'Info> Worker {index + 1} started with sources {source_ids}.')
+
+
+def run_worker(index: int, sources, inbox, updates, uploads: bool):
+    """
+    Entry point of a worker process. Loads the gallery, applies the gallery updates of the other workers,
+    sends its own updates to the supervisor and validates its sources.
+
+    :param index: index of the worker
+    :param sources: list of (source id, source) tuples validated by the worker
+    :param inbox: queue of gallery updates from the other workers
+    :param updates: queue of gallery updates to the supervisor
+    :param uploads: the worker checks the uploads folder
+    """
+
+    # main imports the supervisor
+    import main
+
+    startup.load_configuration()
+    if cfg.metrics_enabled:
+        metrics.start_server(cfg.metrics_port + index + 1, cfg.metrics_host)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // max(1, cfg.worker_count)))
+    # every worker loads the gallery at the same time, they share the cores between their alignment processes
+    cfg.gallery_loader_workers = max(1, cfg.gallery_loader_workers // max(1, cfg.worker_count))
+    if cfg.gallery_shared:
+        detectors = startup.initialize([main.get_detector_size(source) for _, source in sources],
+                                       lambda: embTable.open_store(cfg.gallery_store_path, writable=False))
+    else:
+        detectors = startup.initialize([main.get_detector_size(source) for _, source in sources],
+                                       embTable.fill_embedding_table_from_files)
+        Thread(target=__apply_updates, args=(inbox,), name='GalleryUpdates', daemon=True).start()
+    embTable.set_update_listener(lambda guid, rows: updates.put((index, guid, rows)))
+    if uploads:
+        Thread(target=main.uploads, args=(), name='Uploads', daemon=True).start()
+    main.loop(sources, osp.join(cfg.spool_path, f'worker-{index + 1}'), detectors)
+
+
+def __apply_updates(inbox):
+    while True:
+        guid, rows = inbox.get()
+        embTable.apply_update(guid, rows)
@@ -0,0 +1,200 @@
+import os
+import os.path as osp
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class UploadsWatcher:
+    def __init__(self, path: str, ingest, debounce: float = 0.3, poll_interval: float = 1.0,
+                 notifications: bool = True):
+        """
+        Watches the uploads folder <path>/<guid>/<file> and passes new files to ingest once they were not
+        changed for debounce seconds, so files that are still being written are not read. Files are collected
+        per guid and ingested together. Files directly in the uploads folder and folders inside a guid folder
+        are not uploads. The files are removed, the folders only when they are empty, a folder with files is kept
+        with a warning so nothing uploaded by mistake is lost. Filesystem notifications of watchdog are used when
+        it is installed, otherwise the folder is polled.
+
+        :param path: uploads folder
+        :param ingest: function(guid, file paths) that ingests the files of a person
+        :param debounce: time in seconds a file must stay unchanged before it is ingested
+        :param poll_interval: time in seconds between scans of the folder when polling
+        :param notifications: use filesystem notifications if watchdog is installed
+        """
+
+        self.__path = path
+        self.__ingest = ingest
+        self.__debounce = debounce
+        self.__poll_interval = poll_interval
+        self.__notifications = notifications and Observer is not None
+        self.__pending: dict[str, tuple[float, int, int]] = {}
+        self.__kept: set[str] = set()
+        self.__lock = threading.Lock()
+        self.__changed = threading.Event()
+        self.__stopped = threading.Event()
+        self.ingested_count = 0
+
+    def run(self):
+        """
+        Ingests uploaded files until stop is called. Files uploaded before the start are ingested first.
+        """
+
+        os.makedirs(self.__path, exist_ok=True)
+        observer = None
+        if self.__notifications:
+            observer = Observer()
+            observer.schedule(_UploadsEventHandler(self.__touch), self.__path, recursive=True)
+            observer.start()
+            print(f'Info> Uploads folder {self.__path} is watched by filesystem notifications.')
+        else:
+            print(f'Info> Uploads folder {self.__path} is polled every {self.__poll_interval} s.')
+        self.__scan()
+        try:
+            while not self.__stopped.is_set():
+                timeout = self.__next_timeout()
+                if observer is None:
+                    timeout = self.__poll_interval if timeout is None else min(timeout, self.__poll_interval)
+                self.__changed.wait(timeout)
+                self.__changed.clear()
+                if observer is None:
+                    self.__scan()
+                self.__ingest_ready()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        """
+        Stops the watcher after the current batch.
+        """
+
+        self.__stopped.set()
+        self.__changed.set()
+
+    def __touch(self, file_path: str):
+        """
+        Registers a created or changed file and restarts its debounce time. A folder of a guid that was created
+        or moved in registers its files and removes its folders like a scan.
+        """
+
+        if osp.isdir(file_path):
+            if osp.dirname(file_path) == osp.abspath(self.__path):
+                with os.scandir(file_path) as files:
+                    for file in files:
+                        self.__touch(osp.join(file_path, file.name))
+            elif osp.dirname(osp.dirname(file_path)) == osp.abspath(self.__path):
+                self.__remove_stray(file_path)
+            return
+        if osp.dirname(file_path) == osp.abspath(self.__path):
+            self.__remove_stray(file_path)
+            return
+        if osp.dirname(osp.dirname(file_path)) != osp.abspath(self.__path):
+            return
+        with self.__lock:
+            self.__pending[file_path] = (time.monotonic(), -1, -1)
+        self.__changed.set()
+
+    def __scan(self):
+        """
+        Registers the files of the uploads folder. Files whose size or modification time have changed since the
+        last scan restart their debounce time. Stray files and empty nested folders are removed.
+        """
+
+        now = time.monotonic()
+        with os.scandir(self.__path) as dirs:
+            for dr in dirs:
+                if not dr.is_dir():
+                    self.__remove_stray(dr.path)
+                    continue
+                with os.scandir(dr.path) as files:
+                    for file in files:
+                        if not file.is_file():
+                            self.__remove_stray(file.path)
+                            continue
+                        stat = file.stat()
+                        file_path = osp.abspath(osp.join(self.__path, dr.name, file.name))
+                        with self.__lock:
+                            previous = self.__pending.get(file_path)
+                            if previous is None or previous[1:] != (stat.st_size, stat.st_mtime_ns):
+                                self.__pending[file_path] = (now, stat.st_size, stat.st_mtime_ns)
+
+    def __next_timeout(self):
+        """
+        :return: time in seconds until the next pending file is ready or None if no file is pending
+        """
+
+        with self.__lock:
+            if len(self.__pending) == 0:
+                return None
+            first = min(changed for changed, _, _ in self.__pending.values())
+        return max(0.0, first + self.__debounce - time.monotonic())
+
+    def __ingest_ready(self):
+        """
+        Ingests the files that were not changed for the debounce time, grouped by guid.
+        """
+
+        now = time.monotonic()
+        ready: dict[str, list[str]] = {}
+        with self.__lock:
+            for file_path, (changed, _, _) in list(self.__pending.items()):
+                if now - changed >= self.__debounce:
+                    del self.__pending[file_path]
+                    if osp.isfile(file_path):
+                        ready.setdefault(osp.basename(osp.dirname(file_path)), []).append(file_path)
+        for guid, file_paths in ready.items():
+            # noinspection PyBroadException
+            try:
+                self.__ingest(guid, sorted(file_paths))
+                self.ingested_count += len(file_paths)
+            except Exception as e:
+                print(f'Error> Uploads of guid {guid} were not ingested: {e!r}')
+
+    def __remove_stray(self, path: str):
+        """
+        Removes a file or an empty folder that is not an upload of a guid. A folder that can not be removed is
+        reported once and is removed by a later scan when it is empty.
+        """
+
+        path = osp.abspath(path)
+        try:
+            if osp.isdir(path):
+                os.rmdir(path)
+            else:
+                os.remove(path)
+            self.__kept.discard(path)
+            print(f'Info> {path} is not an upload of a guid and was removed.')
+        except OSError as e:
+            if path not in self.__kept:
+                self.__kept.add(path)
+                print(f'Warning> {path} is not an upload of a guid and was not removed: {e!r}')
+
+
+class _UploadsEventHandler(FileSystemEventHandler):
+    def __init__(self, touch):
+        """
+        Passes the paths of created, changed and moved in files and folders to the watcher.
+
+        :param touch: function(file path) of the watcher
+        """
+
+        super().__init__()
+        self.__touch = touch
+
+    def on_created(self, event):
+        self.__touch(osp.abspath(event.src_path))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.__touch(osp.abspath(event.src_path))
+
+    def on_moved(self, event):
+        self.__touch(osp.abspath(event.dest_path))
@@ -1,15 +1,22 @@
-import json
 import uuid
 from enum import Enum
+from time import monotonic, perf_counter, sleep
 
-from pika.adapters.blocking_connection import BlockingChannel
-
+import configuration as cfg
+import metrics
+from detectionService import DetectionService
 from faceDetector import FaceDetector
+from faceTracker import FaceTracker, Track
+from frameReader import FrameReader
+from motionGate import MotionGate
 from person import Person, PersonData
+from publisher import Publisher
+from roi import RoiDetector
 
 import dataManager as dataMgr
 import embedder as emb
 import embeddingsTable as embTable
+import startup
 
 
 class InputType(Enum):
@@ -19,86 +26,237 @@ class InputType(Enum):
 
 
 class Validator:
-    def __init__(self, source_cap, source_id: str, source_type: InputType, face_detector: FaceDetector,
-                 channel: BlockingChannel, validation_threshold=0.5):
+    def __init__(self, source_cap, source_id: str, source_type: InputType,
+                 face_detector: FaceDetector | DetectionService | RoiDetector, publisher: Publisher,
+                 validation_threshold=0.5, motion_gate: MotionGate = None, face_tracker: FaceTracker = None):
         self.__source_id = source_id
         self.__source_cap = source_cap
         self.__source_type = source_type
         self.__validation_threshold = validation_threshold
         self.__face_detector = face_detector
-        self.__channel = channel
+        self.__publisher = publisher
+        self.__motion_gate = motion_gate
+        self.__face_tracker = face_tracker
+        self.__frame_number = 0
+        self.__captured_at = None
+        self.__last_frame_at = None
+        self.__frame_interval = None
+
+    def has_new_frame(self):
+        """
+        :return: True if the source has a frame that has not been validated yet.
+        """
+
+        if isinstance(self.__source_cap, FrameReader):
+            return self.__source_cap.frame_number != self.__frame_number
+        return self.__source_type == InputType.IMAGE
+
+    def run(self):
+        """
+        Validates new frames of the source until the process ends. Used as a thread target.
+        """
+
+        while True:
+            if self.has_new_frame():
+                self.validate()
+            else:
+                sleep(cfg.idle_loop_delay)
 
     def validate(self):
-        print(f'Process> validate for source {self.__source_id} started...')
         time = dataMgr.get_formatted_datetime()
+        started = perf_counter()
         frame = self.__get_frame()
-        faces = self.__face_detector.detect_all_faces(frame)
-        if faces is not None:
-            dataMgr.write_camera_capture(self.__source_id, time, frame)
-            response = {
-                'SourceId': self.__source_id,
-                'Time': time,
-                'ValidationThreshold': self.__validation_threshold
-            }
-            persons = []
-            for face in faces:
-                embedding = emb.get_embedding(face)
-                if embedding is not None:
-                    current_person = Person('tmp_person')
-                    current_person_pd = PersonData(embedding, '', face)
-                    current_person.add_data(current_person_pd)
-                    most_similar_person, most_similar_data, similarity = embTable.most_similar_person(
-                        current_person)
-                    if most_similar_person is not None:
-                        if similarity >= self.__validation_threshold:
-                            if most_similar_person.guid is not None:
-                                last_photo_path = dataMgr.write_event(most_similar_person.guid,
-                                                                      self.__source_id,
-                                                                      time, face)
-                                person_data = {'Guid': most_similar_person.guid,
-                                               'LastPhotoPath': last_photo_path,
-                                               'Validated': True,
-                                               'MostSimilarGuid': most_similar_person.guid,
-                                               'MostSimilarPhotoPath': most_similar_data.path,
-                                               'Similarity': similarity}
-                                if not embTable.check_max_count(most_similar_person):
-                                    path = dataMgr.write_image_by_guid(most_similar_person.guid, face)
-                                    most_similar_person.add_image(embedding, path, face)
-                                if most_similar_person.guid != 'tmp_person':
-                                    persons.append(person_data)
-                        else:
-                            guid = str(uuid.uuid4())
-                            last_photo_path = dataMgr.write_event(guid, self.__source_id, time, face)
-                            person_data = {'Guid': guid,
-                                           'LastPhotoPath': last_photo_path,
-                                           'Validated': False,
-                                           'MostSimilarGuid': most_similar_person.guid,
-                                           'MostSimilarPhotoPath': most_similar_data.path,
-                                           'Similarity': similarity}
-                            current_path = dataMgr.write_image_by_guid(guid, face)
-                            current_person.guid = guid
-                            current_person_pd.path = current_path
-                            if current_person.guid != 'tmp_person':
-                                persons.append(person_data)
-                                embTable.add_person(current_person)
-            response['DetectedPersons'] = persons
-            json_data = json.dumps(response, indent=4, default=str)
-            # with open('data.json', 'w') as f:
-            #     json.dump(response, f, ensure_ascii=False, indent=4)
-            self.__channel.basic_publish(exchange='', routing_key='validator', body=json_data)
-            return json_data
+        if frame is None:
+            return None
+        self.__count_frame()
+        stage_started = self.__observe_stage('capture', started)
+        if self.__motion_gate is not None and not self.__motion_gate.should_process(frame):
+            self.__observe_stage('motion', stage_started)
+            _frames_skipped.inc(source=self.__source_id, reason='motion')
+            return None
+        stage_started = self.__observe_stage('motion', stage_started)
+        print(f'Process> validate for source {self.__source_id} started...')
+        faces, boxes = self.__face_detector.detect_all_faces_with_boxes(frame)
+        startup.mark('first frame')
+        stage_started = self.__observe_stage('detect', stage_started)
+        if faces is None:
+            if self.__face_tracker is not None:
+                self.__face_tracker.update([])
+            _frame_seconds.observe(perf_counter() - started, source=self.__source_id)
+            return None
+        _faces.inc(len(faces), source=self.__source_id)
+        if self.__motion_gate is not None:
+            self.__motion_gate.hold()
+        dataMgr.write_camera_capture(self.__source_id, time, frame)
+        stage_started = self.__observe_stage('write', stage_started)
+        response = {
+            'SourceId': self.__source_id,
+            'Time': time,
+            'ValidationThreshold': self.__validation_threshold
+        }
+        if self.__face_tracker is not None:
+            tracks = self.__face_tracker.update(boxes)
+        else:
+            tracks = [None] * len(faces)
+        embedded = [index for index, track in enumerate(tracks)
+                    if track is None or self.__face_tracker.needs_embedding(track)]
+        embeddings = emb.get_embeddings([faces[index] for index in embedded]) if len(embedded) > 0 else []
+        if embeddings is None:
+            embedded, embeddings = [], []
+        stage_started = self.__observe_stage('embed', stage_started)
+        matches = embTable.most_similar_persons(embeddings, k=1)
+        if matches is None:
+            matches = [[] for _ in embedded]
+        stage_started = self.__observe_stage('match', stage_started)
+        searched = dict(zip(embedded, zip(embeddings, matches)))
+        persons = []
+        for index, (face, track) in enumerate(zip(faces, tracks)):
+            person_data = None
+            if index in searched:
+                embedding, found = searched[index]
+                if track is not None and track.confident and \
+                        (len(found) == 0 or found[0][2] < self.__validation_threshold):
+                    FaceTracker.mark_embedded(track)
+                    person_data = self.__reuse_identity(time, face, track)
+                else:
+                    person_data = self.__validate_face(time, face, embedding, found)
+                    if track is not None:
+                        self.__face_tracker.assign(track, person_data)
+            elif track is not None and track.person_data is not None:
+                person_data = self.__reuse_identity(time, face, track)
+            if person_data is not None:
+                persons.append(person_data)
+        response['DetectedPersons'] = persons
+        stage_started = self.__observe_stage('identify', stage_started)
+        self.__publisher.publish(response)
+        self.__observe_stage('publish', stage_started)
+        _frame_seconds.observe(perf_counter() - started, source=self.__source_id)
+        if self.__captured_at is not None:
+            _capture_to_publish_seconds.observe(monotonic() - self.__captured_at, source=self.__source_id)
+        return response
+
+    def __observe_stage(self, stage: str, started: float):
+        """
+        Records the duration of the stage of the validation.
+
+        :param stage: name of the stage
+        :param started: perf_counter value at the start of the stage
+        :return: perf_counter value at the end of the stage
+        """
+
+        now = perf_counter()
+        _stage_seconds.observe(now - started, source=self.__source_id, stage=stage)
+        return now
+
+    def __count_frame(self):
+        """
+        Counts the validated frame and updates the smoothed frame rate of the source.
+        """
+
+        _frames.inc(source=self.__source_id)
+        now = monotonic()
+        if self.__last_frame_at is not None:
+            interval = now - self.__last_frame_at
+            self.__frame_interval = interval if self.__frame_interval is None else \
+                0.9 * self.__frame_interval + 0.1 * interval
+            if self.__frame_interval > 0:
+                _fps.set(1 / self.__frame_interval, source=self.__source_id)
+        self.__last_frame_at = now
+
+    def __validate_face(self, time: str, face, embedding, found):
+        """
+        Validates a face by its most similar person. A recognized face may enrich the gallery of its person,
+        an unknown face is added to the embedding table as a new person.
+
+        :param time: time mark of capture
+        :param face: face image
+        :param embedding: embedding of the face
+        :param found: list with the (person, person data, similarity) tuple of the most similar person
+        :return: data of the detected person for the response or None
+        """
+
+        current_person = Person('tmp_person')
+        current_person_pd = PersonData(embedding, '', face)
+        current_person.add_data(current_person_pd)
+        if len(found) > 0:
+            most_similar_person, most_similar_data, similarity = found[0]
+        else:
+            most_similar_person, most_similar_data, similarity = current_person, current_person_pd, 0.0
+        if similarity >= self.__validation_threshold:
+            if most_similar_person.guid is not None:
+                last_photo_path = dataMgr.write_event(most_similar_person.guid,
+                                                      self.__source_id,
+                                                      time, face)
+                person_data = {'Guid': most_similar_person.guid,
+                               'LastPhotoPath': last_photo_path,
+                               'Validated': True,
+                               'MostSimilarGuid': most_similar_person.guid,
+                               'MostSimilarPhotoPath': most_similar_data.path,
+                               'Similarity': similarity}
+                if not embTable.check_max_count(most_similar_person):
+                    path = dataMgr.write_image_by_guid(most_similar_person.guid, face)
+                    embTable.add_person_data(most_similar_person.guid, PersonData(embedding, path, face))
+                if most_similar_person.guid != 'tmp_person':
+                    return person_data
+        else:
+            guid = str(uuid.uuid4())
+            last_photo_path = dataMgr.write_event(guid, self.__source_id, time, face)
+            person_data = {'Guid': guid,
+                           'LastPhotoPath': last_photo_path,
+                           'Validated': False,
+                           'MostSimilarGuid': most_similar_person.guid,
+                           'MostSimilarPhotoPath': most_similar_data.path,
+                           'Similarity': similarity}
+            current_path = dataMgr.write_image_by_guid(guid, face)
+            current_person.guid = guid
+            current_person_pd.path = current_path
+            if current_person.guid != 'tmp_person':
+                embTable.add_person(current_person)
+                return person_data
+        return None
+
+    def __reuse_identity(self, time: str, face, track: Track):
+        """
+        Reports a face with the identity of its track without embedding and searching it.
+
+        :param time: time mark of capture
+        :param face: face image
+        :param track: track of the face
+        :return: data of the detected person for the response
+        """
+
+        person_data = dict(track.person_data)
+        person_data['LastPhotoPath'] = dataMgr.write_event(person_data['Guid'], self.__source_id, time, face)
+        return person_data
 
     def __get_frame(self):
         if self.__source_type == InputType.CAM or self.__source_type == InputType.VIDEO:
-            if not self.__source_cap.isOpened():
-                print(f'Error> Error while trying to read {self.__source_type}!')
-                # raise Exception(f'Cannot read input {self.__source_type} data!')
-            else:
-                ret, frame = self.__source_cap.read()
-                if ret:
-                    # cv2.imwrite('frame.png', frame)
-                    return frame
+            last_number = self.__frame_number
+            frame, self.__frame_number, age = self.__source_cap.get_frame(self.__frame_number)
+            if frame is None:
                 return None
+            if self.__frame_number > last_number + 1:
+                _frames_skipped.inc(self.__frame_number - last_number - 1, source=self.__source_id, reason='busy')
+            if age > cfg.frame_max_age:
+                print(f'Warning> Frame of source {self.__source_id} is {age:.2f} s old and is skipped.')
+                _frames_skipped.inc(source=self.__source_id, reason='age')
+                return None
+            self.__captured_at = monotonic() - age
+            return frame
         elif self.__source_type == InputType.IMAGE:
+            self.__captured_at = monotonic()
             return self.__source_cap
         return None
+
+
+_frames = metrics.counter('validator_frames_total', 'Frames taken for validation.', ['source'])
+_frames_skipped = metrics.counter('validator_frames_skipped_total', 'Frames that were not validated.',
+                                  ['source', 'reason'])
+_faces = metrics.counter('validator_faces_total', 'Faces found in the validated frames.', ['source'])
+_fps = metrics.gauge('validator_fps', 'Smoothed rate of validated frames per second.', ['source'])
+_stage_seconds = metrics.histogram('validator_stage_seconds', 'Duration of a stage of the frame validation.',
+                                   ['source', 'stage'])
+_frame_seconds = metrics.histogram('validator_frame_seconds', 'Duration of the validation of a frame.', ['source'])
+_capture_to_publish_seconds = metrics.histogram('validator_capture_to_publish_seconds',
+                                                'Time from the capture of a frame to the publishing of its result.',
+                                                ['source'])
@@ -0,0 +1,36 @@
+import numpy
+
+import configuration as cfg
+from annIndex import IVFIndex
+
+
+def normalize(matrix: numpy.ndarray):
+    return matrix / numpy.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_default_probing_finds_the_exact_match():
+    generator = numpy.random.default_rng(0)
+    centers = normalize(generator.standard_normal((5000, cfg.embedding_size), dtype=numpy.float32))
+    gallery = normalize(centers + 0.04 * generator.standard_normal(centers.shape, dtype=numpy.float32))
+    identities = generator.integers(0, centers.shape[0], 500)
+    queries = normalize(centers[identities] + 0.04 * generator.standard_normal((500, cfg.embedding_size),
+                                                                                dtype=numpy.float32))
+    index = IVFIndex(nprobe=cfg.ivf_nprobe, nlist=cfg.ivf_nlist, probe_fraction=cfg.ivf_probe_fraction)
+    index.train(gallery)
+
+    exact = numpy.argmax(queries @ gallery.T, axis=1)
+    approximate = numpy.array([shortlist[numpy.argmax(gallery[shortlist] @ query)]
+                               for query, shortlist in zip(queries, index.search(queries))])
+    assert numpy.mean(exact == identities) == 1.0
+    assert numpy.mean(approximate == exact) >= 0.99
+
+
+def test_search_visits_a_fraction_of_the_lists():
+    gallery = normalize(numpy.random.default_rng(1).standard_normal((400, 16), dtype=numpy.float32))
+    index = IVFIndex(nlist=20, probe_fraction=0.25)
+    index.train(gallery)
+    shortlist = index.search(gallery[:1])[0]
+    assert 0 < shortlist.shape[0] < gallery.shape[0]
+
+    index.probe_fraction = 1.0
+    assert numpy.array_equal(numpy.sort(index.search(gallery[:1])[0]), numpy.arange(gallery.shape[0]))
@@ -0,0 +1,50 @@
+import os
+
+import numpy
+
+from embeddingCache import EmbeddingCache
+
+
+def test_entries_are_invalidated_by_changed_files_and_models(tmp_path):
+    cache_path = str(tmp_path / 'embeddings.npz')
+    images = [tmp_path / 'a.png', tmp_path / 'b.png']
+    for image in images:
+        image.write_bytes(b'image')
+    embeddings = numpy.eye(2, 4, dtype=numpy.float32)
+    cache = EmbeddingCache(cache_path, 'model-1')
+    for image, embedding in zip(images, embeddings):
+        cache.put(str(image), embedding)
+    cache.save()
+
+    cache = EmbeddingCache(cache_path, 'model-1')
+    cache.load()
+    numpy.testing.assert_array_equal(cache.get(str(images[0])), embeddings[0])
+    images[1].write_bytes(b'changed image')
+    assert cache.get(str(images[1])) is None
+    os.remove(images[0])
+    assert cache.get(str(images[0])) is None
+
+    cache = EmbeddingCache(cache_path, 'model-2')
+    cache.load()
+    images[0].write_bytes(b'image')
+    assert cache.get(str(images[0])) is None
+
+
+def test_unused_entries_are_pruned(tmp_path):
+    cache_path = str(tmp_path / 'embeddings.npz')
+    images = [tmp_path / 'a.png', tmp_path / 'b.png']
+    cache = EmbeddingCache(cache_path, 'model')
+    for index, image in enumerate(images):
+        image.write_bytes(b'image')
+        cache.put(str(image), numpy.full(4, index, dtype=numpy.float32))
+    cache.save()
+
+    cache = EmbeddingCache(cache_path, 'model')
+    cache.load()
+    assert cache.get(str(images[0])) is not None
+    cache.save(prune=True)
+
+    cache = EmbeddingCache(cache_path, 'model')
+    cache.load()
+    assert cache.get(str(images[0])) is not None
+    assert cache.get(str(images[1])) is None
@@ -0,0 +1,63 @@
+import numpy
+import pytest
+
+import configuration as cfg
+import embeddingsTable as embTable
+from person import Person, PersonData
+
+
+def unit_rows(count: int, seed: int):
+    rows = numpy.random.default_rng(seed).standard_normal((count, cfg.embedding_size)).astype(numpy.float32)
+    return rows / numpy.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def make_person(guid: str, embeddings):
+    person = Person(guid)
+    person.data.extend(PersonData(embedding) for embedding in embeddings)
+    return person
+
+
+@pytest.fixture
+def table():
+    embTable.clear()
+    yield embTable
+    embTable.clear()
+
+
+def test_search_widens_past_photos_of_one_person(table):
+    query = unit_rows(1, 0)[0]
+    noise = unit_rows(3 * cfg.max_photo_count, 1)
+    # more photos close to the query than the first shortlist of k * max_photo_count rows holds
+    table.add_person(make_person('close', query + 0.01 * noise))
+    table.add_person(make_person('second', [query + 0.5 * unit_rows(1, 2)[0]]))
+    table.add_person(make_person('other', unit_rows(4, 3)))
+
+    found = table.most_similar_persons([query], k=2)[0]
+    assert [person.guid for person, _, _ in found] == ['close', 'second']
+    assert found[0][2] > found[1][2]
+
+
+def test_ivf_index_is_trained_and_retrained_as_the_gallery_grows(table, monkeypatch):
+    monkeypatch.setattr(cfg, 'ivf_min_train_size', 50)
+    monkeypatch.setattr(cfg, 'ivf_retrain_growth', 2.0)
+    table.set_search_backend('ivf')
+    rows = unit_rows(130, 4)
+
+    def add(first: int, last: int):
+        for row in range(first, last):
+            table.add_person(make_person(f'person-{row}', rows[row:row + 1]))
+
+    add(0, 40)
+    assert not embTable.__search_index.is_trained
+    add(40, 50)
+    assert embTable.__search_index.trained_count == 50
+    add(50, 100)
+    assert embTable.__search_index.trained_count == 50
+    assert embTable.__search_index.count == 100
+    # the 101st row exceeds twice the trained rows
+    add(100, 130)
+    assert embTable.__search_index.trained_count == 101
+    assert embTable.__search_index.count == 130
+
+    found = table.most_similar_persons(rows[[0, 75, 129]], k=1)
+    assert [matches[0][0].guid for matches in found] == ['person-0', 'person-75', 'person-129']
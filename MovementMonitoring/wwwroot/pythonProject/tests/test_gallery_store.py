@@ -0,0 +1,143 @@
+import multiprocessing as mp
+import os.path as osp
+import queue
+
+import numpy
+
+from galleryStore import GalleryStore
+
+
+def unit_rows(count: int, seed: int, dimension: int = 512):
+    rows = numpy.random.default_rng(seed).standard_normal((count, dimension)).astype(numpy.float32)
+    return rows / numpy.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_reader_maps_rows_across_generations(tmp_path):
+    path = str(tmp_path / 'store')
+    rows = unit_rows(5, 0)
+    writer = GalleryStore(path, 512, writable=True, capacity=2)
+    reader = GalleryStore(path, 512)
+    writer.append(rows[:1], [('a', 'a/0.png')])
+    assert reader.refresh() == 0
+    assert reader.count == 1
+    writer.append(rows[1:], [('b', f'b/{index}.png') for index in range(4)])
+    assert reader.refresh() == 1
+    assert reader.count == 5
+    numpy.testing.assert_array_equal(reader.matrix[:5], rows)
+    assert reader.metadata(4) == ('b', 'b/3.png')
+    reader.close()
+    writer.close()
+
+
+def test_reader_ignores_sidecar_lines_beyond_the_published_count(tmp_path):
+    path = str(tmp_path / 'store')
+    writer = GalleryStore(path, 512, writable=True, capacity=4)
+    reader = GalleryStore(path, 512)
+    writer.append(unit_rows(2, 1), [('a', 'a/0.png'), ('a', 'a/1.png')])
+    # the writer has flushed the sidecar line of a row but not published its count yet
+    with open(osp.join(path, 'gallery.rows'), 'ab') as file:
+        file.write(b'["b", "b/0.png"]\n')
+    reader.refresh()
+    assert reader.count == 2
+    assert reader.metadata(1) == ('a', 'a/1.png')
+    reader.close()
+    writer.close()
+
+
+def run_worker(store_path: str, model_path: str, cache_path: str, guid: str, embeddings: dict, updates, added,
+               applied, results):
+    """
+    Worker process reading the store. Adds a new person, searches it before and after the supervisor has
+    appended it to the store and reports what it found.
+    """
+
+    import configuration as cfg
+    import embeddingsTable as embTable
+    from person import Person, PersonData
+
+    cfg.model_path = model_path
+    cfg.cache_path = cache_path
+    embTable.open_store(store_path, writable=False)
+    embTable.set_update_listener(lambda update_guid, rows: updates.put((update_guid, rows)))
+    result = {'known': embTable.most_similar_persons([embeddings['known']])[0][0][0].guid}
+    person = Person(guid)
+    person.add_data(PersonData(embeddings[guid], osp.join(guid, '0.png')))
+    embTable.add_person(person)
+    # the next frame of the same face
+    found = embTable.most_similar_persons([embeddings[guid]])[0]
+    result['pending'] = (found[0][0].guid, found[0][2])
+    embTable.add_person_data(guid, PersonData(embeddings[guid], osp.join(guid, '1.png')))
+    result['pending_count'] = len(embTable.get_person_by_guid(guid).data)
+    added.put(guid)
+    applied.wait(60)
+    found = embTable.most_similar_persons(list(embeddings.values()))
+    result['stored'] = {name: match[0][0].guid for name, match in zip(embeddings, found)}
+    result['stored_count'] = len(embTable.get_person_by_guid(guid).data)
+    results.put((guid, result))
+
+
+def get_from_workers(inbox, workers, timeout: float = 120):
+    """
+    Gets the next item of the queue filled by the workers, fails as soon as a worker has crashed.
+    """
+
+    for _ in range(int(timeout)):
+        try:
+            return inbox.get(timeout=1)
+        except queue.Empty:
+            crashed = [worker.name for worker in workers if worker.exitcode not in (None, 0)]
+            assert len(crashed) == 0, f'Workers {crashed} crashed'
+    raise TimeoutError('The workers did not answer')
+
+
+def test_two_workers_find_their_new_persons_before_and_after_the_store_has_them(tmp_path):
+    import configuration as cfg
+    import embeddingsTable as embTable
+    from person import Person, PersonData
+
+    model_path = str(tmp_path / 'model.pth')
+    open(model_path, 'wb').close()
+    cfg.model_path = model_path
+    cfg.cache_path = str(tmp_path / 'cache')
+    store_path = str(tmp_path / 'store')
+    rows = unit_rows(3, 2)
+    embeddings = {'known': rows[0], 'worker-1': rows[1], 'worker-2': rows[2]}
+    embTable.open_store(store_path, writable=True)
+    known = Person('known')
+    known.add_data(PersonData(embeddings['known'], ''))
+    embTable.add_person(known)
+
+    context = mp.get_context('spawn')
+    updates, added, results = context.Queue(), context.Queue(), context.Queue()
+    applied = context.Event()
+    workers = [context.Process(target=run_worker,
+                               args=(store_path, model_path, cfg.cache_path, guid, embeddings, updates, added,
+                                     applied, results))
+               for guid in ('worker-1', 'worker-2')]
+    for worker in workers:
+        worker.start()
+    try:
+        for _ in workers:
+            get_from_workers(added, workers)
+        # the supervisor appends the additions of the workers to the store
+        while True:
+            try:
+                guid, update_rows = updates.get(timeout=1)
+            except queue.Empty:
+                break
+            embTable.apply_update(guid, update_rows)
+        applied.set()
+        reported = dict(get_from_workers(results, workers) for _ in workers)
+    finally:
+        for worker in workers:
+            worker.join(10)
+            if worker.is_alive():
+                worker.terminate()
+
+    for guid, result in reported.items():
+        assert result['known'] == 'known'
+        assert result['pending'][0] == guid
+        assert result['pending'][1] > 0.999
+        assert result['pending_count'] == 2
+        assert result['stored'] == {'known': 'known', 'worker-1': 'worker-1', 'worker-2': 'worker-2'}
+        assert result['stored_count'] == 2
@@ -0,0 +1,41 @@
+import pytest
+import torch
+import torch.nn as nn
+
+import inferenceEngine
+from backbone import Backbone
+
+face_size = (112, 112)
+
+
+@pytest.fixture(scope='module')
+def backbone():
+    """
+    Backbone with random weights and random statistics of its batch normalizations, so folding them changes
+    the weights.
+    """
+
+    torch.manual_seed(0)
+    model = Backbone(face_size)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d)):
+                module.running_mean.uniform_(-0.2, 0.2)
+                module.running_var.uniform_(0.5, 2.0)
+                module.weight.uniform_(0.5, 1.5)
+                module.bias.uniform_(-0.2, 0.2)
+    return model.eval()
+
+
+def test_folded_backbone_matches_eager(backbone):
+    difference, cosine = inferenceEngine.check_equivalence(backbone, inferenceEngine.fold_batch_norms(backbone),
+                                                           face_size)
+    assert difference < 1e-4
+    assert cosine >= 0.9999
+
+
+def test_torchscript_engine_matches_eager(backbone):
+    engine = inferenceEngine.build(backbone, 'torchscript', face_size)
+    difference, cosine = inferenceEngine.check_equivalence(backbone, engine, face_size)
+    assert difference < 1e-4
+    assert cosine >= 0.9999
@@ -0,0 +1,37 @@
+import numpy
+import pytest
+import torch
+import torchvision.transforms as transforms
+
+from preprocessing import Preprocessor
+
+
+@pytest.mark.parametrize('size', [112, 224])
+def test_batch_equals_the_pil_transform(size):
+    reference = transforms.Compose(
+        [
+            transforms.ToPILImage(),
+            transforms.Resize([int(128 * size / 112), int(128 * size / 112)], ),
+            transforms.CenterCrop([size, size]),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
+        ],
+    )
+    generator = numpy.random.default_rng(0)
+    faces = [generator.integers(0, 256, (size, size, 3), dtype=numpy.uint8) for _ in range(8)]
+
+    expected = torch.stack([reference(numpy.ascontiguousarray(face[:, :, ::-1])) for face in faces])
+    actual = Preprocessor([size, size])(faces)
+
+    assert actual.shape == expected.shape
+    assert float((expected - actual).abs().max()) == 0.0
+
+
+def test_reused_buffer_does_not_change_earlier_batches():
+    generator = numpy.random.default_rng(1)
+    preprocessor = Preprocessor([112, 112])
+    faces = [generator.integers(0, 256, (112, 112, 3), dtype=numpy.uint8) for _ in range(4)]
+    first = preprocessor(faces[:2])
+    expected = first.clone()
+    preprocessor(faces[2:])
+    torch.testing.assert_close(first, expected, rtol=0, atol=0)
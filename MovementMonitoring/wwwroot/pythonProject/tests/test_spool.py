@@ -0,0 +1,59 @@
+import os
+import os.path as osp
+
+from spool import Spool
+
+
+def corrupt_record(path: str, message: bytes):
+    """
+    Flips a byte in the body of the record of the message in the segment files of the spool.
+    """
+
+    for name in sorted(os.listdir(path)):
+        if not name.endswith('.seg'):
+            continue
+        segment_path = osp.join(path, name)
+        with open(segment_path, 'rb') as file:
+            data = bytearray(file.read())
+        index = data.find(message)
+        if index >= 0:
+            data[index] ^= 0xFF
+            with open(segment_path, 'wb') as file:
+                file.write(data)
+            return
+    raise AssertionError(f'Message {message!r} is not in the spool')
+
+
+def test_corrupted_record_in_write_segment_does_not_block_the_spool(tmp_path):
+    spool = Spool(str(tmp_path))
+    for body in (b'first', b'second', b'third'):
+        spool.append(body)
+    spool.sync()
+    corrupt_record(str(tmp_path), b'second')
+
+    assert spool.read(10) == [b'first']
+    spool.commit()
+    assert spool.empty
+    assert spool.read(10) == []
+
+    spool.append(b'fourth')
+    assert spool.pending_count == 1
+    assert spool.read(10) == [b'fourth']
+    spool.commit()
+    assert spool.empty
+    spool.close()
+
+
+def test_corrupted_record_is_skipped_after_restart(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=1)
+    for body in (b'first', b'second', b'third'):
+        spool.append(body)
+    spool.close()
+    corrupt_record(str(tmp_path), b'second')
+
+    spool = Spool(str(tmp_path), segment_size=1)
+    assert spool.pending_count == 2
+    assert spool.read(10) == [b'first', b'third']
+    spool.commit()
+    assert spool.empty
+    spool.close()
@@ -0,0 +1,45 @@
+import queue
+
+import numpy
+
+import configuration as cfg
+from supervisor import Supervisor
+
+
+class FakeProcess:
+    def __init__(self, target, args, name):
+        self.args = args
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return True
+
+
+class FakeContext:
+    Queue = queue.Queue
+    Process = FakeProcess
+
+
+def test_restarted_worker_receives_photos_that_are_not_written_yet(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'gallery_shared', False)
+    supervisor = Supervisor([('1', 'a'), ('2', 'b')], 2)
+    supervisor._Supervisor__context = FakeContext()
+    for index in range(2):
+        supervisor._Supervisor__start_worker(index)
+    written, queued = str(tmp_path / 'written.png'), str(tmp_path / 'queued.png')
+    open(written, 'wb').close()
+    embeddings = numpy.eye(2, 4, dtype=numpy.float32)
+    supervisor._Supervisor__keep_unwritten('guid', [(embeddings[0], written), (embeddings[1], queued)])
+
+    supervisor._Supervisor__start_worker(1)
+    guid, rows = supervisor._Supervisor__inboxes[1].get_nowait()
+    assert guid == 'guid'
+    assert [path for _, path in rows] == [queued]
+    numpy.testing.assert_array_equal(rows[0][0], embeddings[1])
+
+    open(queued, 'wb').close()
+    supervisor._Supervisor__pruned_at = 0.0
+    supervisor._Supervisor__start_worker(1)
+    assert supervisor._Supervisor__inboxes[1].empty()
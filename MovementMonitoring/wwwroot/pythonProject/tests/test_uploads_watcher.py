@@ -0,0 +1,47 @@
+import os
+import threading
+import time
+
+from uploadsWatcher import UploadsWatcher
+
+
+def make_uploads(root):
+    guid = root / 'guid'
+    (guid / 'empty').mkdir(parents=True)
+    (guid / 'nested').mkdir()
+    (guid / 'nested' / 'kept.png').write_bytes(b'image')
+    (guid / 'photo.png').write_bytes(b'image')
+    (root / 'stray.txt').write_bytes(b'text')
+    return guid
+
+
+def test_scan_removes_strays_and_keeps_folders_with_files(tmp_path):
+    guid = make_uploads(tmp_path)
+    ingested = []
+    watcher = UploadsWatcher(str(tmp_path), lambda guid_name, paths: ingested.append((guid_name, paths)),
+                             debounce=0.05, poll_interval=0.05, notifications=False)
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5.0
+    while watcher.ingested_count == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    watcher.stop()
+    thread.join(5.0)
+
+    assert ingested == [('guid', [str(guid / 'photo.png')])]
+    assert not (tmp_path / 'stray.txt').exists()
+    assert not (guid / 'empty').exists()
+    assert (guid / 'nested' / 'kept.png').exists()
+
+
+def test_notifications_handle_nested_folders_like_a_scan(tmp_path):
+    guid = make_uploads(tmp_path)
+    watcher = UploadsWatcher(str(tmp_path), lambda guid_name, paths: None)
+
+    watcher._UploadsWatcher__touch(os.path.abspath(guid))
+
+    assert not (guid / 'empty').exists()
+    assert (guid / 'nested' / 'kept.png').exists()
+    assert (tmp_path / 'stray.txt').exists()
+    watcher._UploadsWatcher__touch(os.path.abspath(tmp_path / 'stray.txt'))
+    assert not (tmp_path / 'stray.txt').exists()
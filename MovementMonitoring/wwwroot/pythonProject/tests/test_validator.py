@@ -0,0 +1,36 @@
+import numpy
+
+import dataManager as dataMgr
+import embedder as emb
+from validator import InputType, Validator
+
+
+class FakeDetector:
+    def __init__(self, count: int):
+        self.__count = count
+
+    def detect_all_faces_with_boxes(self, frame):
+        faces = [numpy.zeros((112, 112, 3), dtype=numpy.uint8) for _ in range(self.__count)]
+        boxes = [(10 * index, 0, 10 * index + 8, 8) for index in range(self.__count)]
+        return faces, boxes
+
+
+class FakePublisher:
+    def __init__(self):
+        self.responses = []
+
+    def publish(self, response):
+        self.responses.append(response)
+
+
+def test_frame_without_tracker_survives_a_failing_embedder(monkeypatch):
+    monkeypatch.setattr(emb, 'get_embeddings', lambda images: None)
+    monkeypatch.setattr(dataMgr, 'write_camera_capture', lambda source_id, time, capture: None)
+    publisher = FakePublisher()
+    frame = numpy.zeros((64, 64, 3), dtype=numpy.uint8)
+    validator = Validator(frame, 'source', InputType.IMAGE, FakeDetector(2), publisher)
+
+    response = validator.validate()
+
+    assert response['DetectedPersons'] == []
+    assert publisher.responses == [response]